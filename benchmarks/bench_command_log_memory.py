@@ -0,0 +1,57 @@
+"""
+Benchmark memory used by command log entries loaded from the log.
+
+    python -m benchmarks.bench_command_log_memory --entries 100000
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Dict, Any, List
+
+from cincan.command_log import CommandLog, JSON_TIME_FORMAT
+
+
+def synthetic_entries(count: int, samples: int = 1000) -> List[Dict[str, Any]]:
+    """JSON of log entries, samples are read by many commands"""
+    start = datetime(2021, 3, 1)
+    entries = []
+    for n in range(count):
+        sample = n % samples
+        entries.append({
+            'command': ['quay.io/cincan/tshark', '-r', f'samples/{sample}.pcap', '-w', f'out/{n}.pcap'],
+            'timestamp': (start + timedelta(seconds=n)).strftime(JSON_TIME_FORMAT),
+            'exit_code': 0,
+            'input': [{'path': f'/home/analyst/samples/{sample}.pcap', 'sha256': f'{sample:064x}',
+                       'timestamp': start.strftime(JSON_TIME_FORMAT)}],
+            'output': [{'path': '/dev/stdout', 'sha256': f'{n:064x}'},
+                       {'path': f'/home/analyst/out/{n}.pcap', 'sha256': f'{n + 1:064x}'}],
+        })
+    return entries
+
+
+def measure(entries: List[Dict[str, Any]]) -> int:
+    """Allocated bytes for loaded entries"""
+    gc.collect()
+    tracemalloc.start()
+    loaded = [CommandLog.from_json(js) for js in entries]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del loaded
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=100000, help='number of log entries')
+    args = parser.parse_args()
+
+    # round trip through strings, so that the loaded entries do not share strings with the source
+    entries = json.loads(json.dumps(synthetic_entries(args.entries)))
+    used = measure(entries)
+    print(f"{args.entries} entries {used / 1024 / 1024:.1f} MiB, {used / args.entries:.0f} bytes/entry")
+
+
+if __name__ == '__main__':
+    main()
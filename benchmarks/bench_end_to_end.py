@@ -0,0 +1,125 @@
+"""
+End-to-end throughput of 'cincan run' against the fake Docker Engine, no Docker required.
+
+Each run creates a container, uploads the input files, runs the fake tool and downloads
+its outputs, as 'cincan run fake/tool in-0.bin in-1.bin ...' would do.
+
+    python -m benchmarks.bench_end_to_end --runs 200 --files 5 --latency 0.001
+"""
+import argparse
+import base64
+import concurrent.futures
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import pathlib
+import tempfile
+import time
+from typing import Dict, List
+
+from benchmarks.fake_engine import FakeEngine, FakeEngineServer, IMAGE_NAME
+from cincan.frontend import ToolImage
+from cincan.timings import PHASES
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def one_run(run_dir: str, files: List[str], background_cleanup: bool, compress_upload: bool) -> Dict:
+    start = time.monotonic()
+    tool = ToolImage(image=f'{IMAGE_NAME}:latest', batch=True)
+    tool.background_cleanup = background_cleanup
+    tool.compress_upload = compress_upload
+    tool.config.cache_directory = pathlib.Path('cache').resolve()
+    log = tool.run([f'{run_dir}/{f}' for f in files])
+    wall = time.monotonic() - start
+    if log.exit_code != 0:
+        raise Exception(f"run in {run_dir} failed with exit code {log.exit_code}")
+    return {'wall': wall, 'seconds': log.timings.seconds, 'bytes': log.timings.bytes,
+            'files': len(tool.upload_files) + len(tool.download_files)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=100, help='number of runs')
+    parser.add_argument('--files', type=int, default=5, help='input files per run')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='size of each input file')
+    parser.add_argument('--jobs', type=int, default=1, help='concurrent runs')
+    parser.add_argument('--latency', type=float, default=0.0, help='engine latency per request in seconds')
+    parser.add_argument('--bandwidth', type=float, help='engine bandwidth in bytes/s, unlimited by default')
+    parser.add_argument('--stdout-bytes', type=int, default=0, help='extra stdout from each run')
+    parser.add_argument('--background-cleanup', action='store_true', help='remove containers by a detached helper')
+    parser.add_argument('--compressible', action='store_true', help='input files of log lines instead of random data')
+    parser.add_argument('--compress-upload', action='store_true', help='compress uploads which compress well')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pathlib.Path(tmp)
+        engine = FakeEngine(args.latency, args.bandwidth, args.stdout_bytes)
+        server = FakeEngineServer((root / 'docker.sock').as_posix(), engine)
+        server.start()
+        os.environ['DOCKER_HOST'] = f"unix://{root / 'docker.sock'}"
+        os.environ['PYTHONPATH'] = pathlib.Path(__file__).parent.parent.as_posix()  # for the cleanup helper
+        files = [f'in-{j}.bin' for j in range(args.files)]
+        os.chdir(root)
+        try:
+            for i in range(args.runs):
+                pathlib.Path(f'run-{i}').mkdir()
+                for f in files:
+                    data = os.urandom(args.file_size)
+                    if args.compressible:
+                        # log lines with random ids, compress to about 1/4
+                        ids = base64.b16encode(data)
+                        data = b''.join(b'GET /item/%s HTTP/1.1 200\n' % ids[j:j + 8]
+                                        for j in range(0, len(ids), 8))[:args.file_size]
+                    pathlib.Path(f'run-{i}', f).write_bytes(data)
+
+            start = time.monotonic()
+            with contextlib.redirect_stdout(io.TextIOWrapper(open(os.devnull, 'wb'))):
+                with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+                    results = list(executor.map(
+                        lambda i: one_run(f'run-{i}', files, args.background_cleanup, args.compress_upload),
+                        range(args.runs)))
+            elapsed = time.monotonic() - start
+        finally:
+            os.chdir(cwd)
+            server.shutdown()
+            server.server_close()
+
+    phases = [p for p in PHASES if any(p in r['seconds'] for r in results)]
+    report = {
+        'runs': args.runs,
+        'elapsed': elapsed,
+        'runs_per_s': args.runs / elapsed,
+        'files_per_s': sum(r['files'] for r in results) / elapsed,
+        'latency': {name: {f'p{p}': percentile([r['seconds'].get(name, 0.0) for r in results], p)
+                           for p in [50, 90, 99]}
+                    for name in phases},
+        'requests': engine.requests,
+        'bytes': {name: sum(r['bytes'].get(name, 0) for r in results)
+                  for name in sorted({name for r in results for name in r['bytes']})},
+    }
+    report['latency']['wall'] = {f'p{p}': percentile([r['wall'] for r in results], p) for p in [50, 90, 99]}
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{args.runs} runs in {elapsed:.2f} s, {report['runs_per_s']:.1f} runs/s, "
+          f"{report['files_per_s']:.1f} files/s")
+    print(f"{'phase':<16} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10}")
+    for name, values in report['latency'].items():
+        print(f"{name:<16} " + ' '.join(f"{v * 1000:>10.2f}" for v in values.values()))
+    print("requests: " + ', '.join(f"{k} {v}" for k, v in sorted(engine.requests.items())))
+    print("bytes: " + ', '.join(f"{k} {v}" for k, v in report['bytes'].items()))
+
+
+if __name__ == '__main__':
+    main()
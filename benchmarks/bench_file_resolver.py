@@ -0,0 +1,88 @@
+"""
+Benchmark FileResolver on large synthetic directory trees.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.bench_file_resolver --files 200000
+"""
+import argparse
+import os
+import pathlib
+import tempfile
+import timeit
+from typing import List
+
+from cincan.file_tool import FileResolver, FileMatcher
+
+
+def create_tree(root: pathlib.Path, files: int, width: int = 20, per_dir: int = 100) -> pathlib.Path:
+    """Create synthetic tree with given number of files, 'width' sub directories on each level"""
+    tree = root / 'tree'
+    tree.mkdir()
+    dirs = [tree]
+    created = 0
+    while created < files:
+        d = dirs.pop(0)
+        for i in range(per_dir):
+            if created >= files:
+                break
+            suffix = '.txt' if i % 10 == 0 else '.bin'
+            (d / f'file-{i}{suffix}').touch()
+            created += 1
+        for i in range(width):
+            sub = d / f'dir-{i}'
+            sub.mkdir()
+            dirs.append(sub)
+    return tree
+
+
+def legacy_walk(directory: pathlib.Path) -> List[pathlib.Path]:
+    """The walk as done before os.scandir, for reference"""
+    res = []
+    listed = set()
+    for f in directory.iterdir():
+        if f not in listed:
+            res.append(f)
+            listed.add(f)
+        if f.is_dir():
+            res.extend(legacy_walk(f))
+    return res
+
+
+def measure(name: str, func, repeat: int):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print(f"{name:<40} {best:10.4f} s")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=50000, help='number of files in the tree')
+    parser.add_argument('--repeat', type=int, default=3, help='repeat each measurement, best is reported')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pathlib.Path(tmp)
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            tree = create_tree(pathlib.Path('.'), args.files)
+            print(f"{args.files} files in {tree.as_posix()}")
+            measure("legacy pathlib walk", lambda: legacy_walk(tree), args.repeat)
+            measure("resolver", lambda: FileResolver(['tree'], root), args.repeat)
+            measure("resolver, with output path",
+                    lambda: FileResolver(['tree', 'tree/dir-0/new/output.txt'], root), args.repeat)
+            measure("resolver, include *.txt",
+                    lambda: FileResolver(['tree'], root, input_filters=FileMatcher.parse(['*.txt'])), args.repeat)
+            measure("resolver, include tree/dir-1/*",
+                    lambda: FileResolver(['tree'], root, input_filters=FileMatcher.parse(['tree/dir-1/*'])),
+                    args.repeat)
+            measure("resolver, exclude tree/dir-1*",
+                    lambda: FileResolver(['tree'], root, input_filters=FileMatcher.parse(['^tree/dir-1*'])),
+                    args.repeat)
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Write system calls for the standard output of a line-chatty tool, run against the fake Docker Engine.
+
+The tool writes each line in its own frame. On a terminal every frame is written at once,
+into a file or a pipe the frames are coalesced into larger writes.
+
+    python -m benchmarks.bench_output_sink --lines 100000
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import pathlib
+import tempfile
+import time
+from typing import Dict
+
+from benchmarks.fake_engine import FakeEngine, FakeEngineServer, IMAGE_NAME
+from cincan.frontend import ToolImage
+
+
+class CountingFile(io.FileIO):
+    """File which counts the writes into it, and claims to be a terminal when asked to"""
+    def __init__(self, path: str, tty: bool):
+        super().__init__(path, 'wb')
+        self.tty = tty
+        self.writes = 0
+
+    def isatty(self) -> bool:
+        return self.tty
+
+    def write(self, data) -> int:
+        self.writes += 1
+        return super().write(data)
+
+
+def one_run(output: str, tty: bool) -> Dict:
+    tool = ToolImage(image=f'{IMAGE_NAME}:latest', batch=True)
+    tool.background_cleanup = False
+    counter = CountingFile(output, tty)
+    stdout = io.TextIOWrapper(io.BufferedWriter(counter))
+    start = time.monotonic()
+    with contextlib.redirect_stdout(stdout):
+        log = tool.run([])
+        stdout.flush()
+    elapsed = time.monotonic() - start
+    stdout.close()
+    return {'writes': counter.writes, 'exec': log.timings.seconds['exec'], 'wall': elapsed,
+            'bytes': os.path.getsize(output)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=100000, help='stdout lines from the tool')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pathlib.Path(tmp)
+        server = FakeEngineServer((root / 'docker.sock').as_posix(), FakeEngine(stdout_lines=args.lines))
+        server.start()
+        os.environ['DOCKER_HOST'] = f"unix://{root / 'docker.sock'}"
+        os.chdir(root)
+        try:
+            results = {'terminal': one_run('terminal.out', tty=True), 'file': one_run('file.out', tty=False)}
+        finally:
+            os.chdir(cwd)
+            server.shutdown()
+            server.server_close()
+
+    print(f"{args.lines} lines, a frame each")
+    print(f"{'stdout':<10} {'writes':>10} {'bytes':>10} {'exec s':>10} {'wall s':>10}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['writes']:>10} {r['bytes']:>10} {r['exec']:>10.3f} {r['wall']:>10.3f}")
+    print(f"{results['terminal']['writes'] / max(1, results['file']['writes']):.0f}x fewer writes into a file")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,427 @@
+"""
+Stand-in for Docker Engine, speaking the subset of the Engine API used by cincan over a Unix socket.
+
+The only image is 'fake/tool' with a tool which writes SHA-256 digest of each existing
+file given as argument into '<file>.sha256', and the digests into stdout.
+Input from stdin is echoed into stdout.
+
+Start it standalone and point DOCKER_HOST to it, e.g.
+
+    python -m benchmarks.fake_engine --socket /tmp/fake-docker.sock --latency 0.002
+    DOCKER_HOST=unix:///tmp/fake-docker.sock cincan run fake/tool sample.bin
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import posixpath
+import re
+import socketserver
+import struct
+import tarfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs, unquote
+
+from cincan.compression import DecompressReader
+
+API_VERSION = '1.41'
+IMAGE_NAME = 'fake/tool'
+IMAGE_ID = 'sha256:' + hashlib.sha256(IMAGE_NAME.encode()).hexdigest()
+WORK_DIR = '/home/appuser'
+
+
+class FsEntry:
+    """File or directory in the container, data is None for directories"""
+    def __init__(self, data: Optional[bytes], mode: int, mtime: float):
+        self.data = data
+        self.mode = mode
+        self.mtime = mtime
+
+
+class FakeContainer:
+    """Container with in-memory file system"""
+    def __init__(self, config: Dict):
+        self.id = uuid.uuid4().hex + uuid.uuid4().hex
+        self.config = config
+        self.created = time.time()
+        self.files: Dict[str, FsEntry] = {'/': FsEntry(None, 0o755, 0), '/home': FsEntry(None, 0o755, 0),
+                                          WORK_DIR: FsEntry(None, 0o755, 0)}
+        self.changes: Dict[str, int] = {}  # path -> kind, 0 modified, 1 added
+        self.started = threading.Event()
+        self.finished = threading.Event()
+        self.finished_at = 0.0
+        self.exit_code = 0
+        self.attached = False
+
+    def absolute(self, path: str) -> str:
+        return posixpath.normpath(posixpath.join(WORK_DIR, path))
+
+    def add(self, path: str, entry: FsEntry):
+        path = self.absolute(path)
+        parent = posixpath.dirname(path)
+        if parent not in self.files:
+            self.add(parent, FsEntry(None, 0o755, entry.mtime))
+        elif parent != '/' and parent not in self.changes:
+            self.changes[parent] = 0
+        self.changes[path] = 0 if path in self.files else 1
+        self.files[path] = entry
+
+    def run(self, stdin: Optional[bytes], stdout_bytes: int, stdout_lines: int = 0) -> List[Tuple[int, bytes]]:
+        """Run the tool, return output frames"""
+        frames = []
+        for arg in self.config.get('Cmd') or []:
+            entry = self.files.get(self.absolute(arg))
+            if entry is None or entry.data is None:
+                frames.append((2, f"{arg}: no such file\n".encode()))
+                self.exit_code = 1
+                continue
+            digest = hashlib.sha256(entry.data).hexdigest()
+            self.add(arg + '.sha256', FsEntry(f"{digest}\n".encode(), 0o644, time.time()))
+            frames.append((1, f"{digest}  {arg}\n".encode()))
+        if stdin:
+            frames.append((1, stdin))
+        for off in range(0, stdout_bytes, 4096):
+            frames.append((1, b'x' * min(4096, stdout_bytes - off)))
+        for n in range(stdout_lines):
+            frames.append((1, b'%d: line of output\n' % n))  # a frame per line, as from a line buffered tool
+        return frames
+
+    def finish(self):
+        self.finished_at = time.time()
+        self.finished.set()
+
+    def inspect(self) -> Dict:
+        finished_at = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.finished_at)) + \
+            '.%09dZ' % int(self.finished_at % 1 * 1e9)
+        return {
+            'Id': self.id, 'Image': IMAGE_ID, 'Name': '/' + self.id[:12], 'Config': self.config,
+            'State': {'Running': self.started.is_set() and not self.finished.is_set(), 'ExitCode': self.exit_code,
+                      'FinishedAt': finished_at if self.finished.is_set() else '0001-01-01T00:00:00Z'},
+        }
+
+    def archive(self, path: str) -> Optional[bytes]:
+        """Tar archive of the path, None if not found"""
+        path = self.absolute(path)
+        if path not in self.files:
+            return None
+        base = posixpath.dirname(path)
+        out = io.BytesIO()
+        with tarfile.open(fileobj=out, mode='w') as tar:
+            for name in sorted(self.files):
+                if name != path and not name.startswith(path.rstrip('/') + '/'):
+                    continue
+                entry = self.files[name]
+                info = tarfile.TarInfo(posixpath.relpath(name, base))
+                info.mode = entry.mode
+                info.mtime = entry.mtime
+                if entry.data is None:
+                    info.type = tarfile.DIRTYPE
+                    tar.addfile(info)
+                else:
+                    info.size = len(entry.data)
+                    tar.addfile(info, io.BytesIO(entry.data))
+        return out.getvalue()
+
+    def path_stat(self, path: str) -> Optional[str]:
+        entry = self.files.get(self.absolute(path))
+        if entry is None:
+            return None
+        stat = {'name': posixpath.basename(path), 'size': len(entry.data or b''), 'mode': entry.mode,
+                'mtime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(entry.mtime)), 'linkTarget': ''}
+        return base64.b64encode(json.dumps(stat).encode()).decode()
+
+
+class FakeEngine:
+    """Engine state and simulated network characteristics"""
+    def __init__(self, latency: float = 0.0, bandwidth: Optional[float] = None, stdout_bytes: int = 0,
+                 run_time: float = 0.0, stdout_lines: int = 0, cpus: Optional[int] = None):
+        self.latency = latency  # seconds added to each request
+        self.bandwidth = bandwidth  # bytes per second for archives and streams, None for unlimited
+        self.stdout_bytes = stdout_bytes  # extra output from each run
+        self.run_time = run_time  # seconds each run continues after writing its output files
+        self.stdout_lines = stdout_lines  # extra output lines from each run, each in its own frame
+        self.cpus = cpus  # CPUs of the engine, e.g. of a VM, None to accept any CPU set
+        self.labels: Dict[str, str] = {}  # labels of the image
+        self.containers: Dict[str, FakeContainer] = {}
+        self.tags = {f'{IMAGE_NAME}:latest', f'{IMAGE_NAME}:dev'}  # local images, all are the same image
+        self.remote_tags = set(self.tags)  # images which can be pulled
+        self.requests: Dict[str, int] = {}  # count by operation
+        self.lock = threading.Lock()
+
+    def transfer(self, byte_count: int):
+        """Simulate transfer time of bytes"""
+        if self.bandwidth:
+            time.sleep(byte_count / self.bandwidth)
+
+    def count(self, operation: str):
+        with self.lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+
+    def image(self) -> Dict:
+        return {
+            'Id': IMAGE_ID, 'RepoTags': sorted(self.tags),
+            'Created': '2021-03-01T00:00:00.000000000Z',
+            'Config': {'Entrypoint': ['fake-tool'], 'Cmd': None, 'WorkingDir': WORK_DIR,
+                       'Labels': dict(self.labels)},
+        }
+
+    def find_container(self, c_id: str) -> Optional[FakeContainer]:
+        c = self.containers.get(c_id)
+        if c is None:
+            matching = [c for i, c in self.containers.items() if i.startswith(c_id)]
+            c = matching[0] if len(matching) == 1 else None
+        return c
+
+
+class EngineHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    engine: FakeEngine = None  # set by the server
+
+    def log_message(self, format, *args):
+        pass
+
+    def __reply(self, status: int, body: Optional[bytes] = None, content_type: str = 'application/json',
+                headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body or b'')))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.engine.transfer(len(body))
+            self.wfile.write(body)
+
+    def __json(self, status: int, value):
+        self.__reply(status, json.dumps(value).encode())
+
+    def __error(self, status: int, message: str):
+        self.__json(status, {'message': message})
+
+    def __body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            data = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                data.extend(self.rfile.read(size))
+                self.rfile.readline()
+        else:
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.engine.transfer(len(data))
+        return bytes(data)
+
+    def do_GET(self):
+        self.__handle()
+
+    def do_HEAD(self):
+        self.__handle()
+
+    def do_POST(self):
+        self.__handle()
+
+    def do_PUT(self):
+        self.__handle()
+
+    def do_DELETE(self):
+        self.__handle()
+
+    def __handle(self):
+        url = urlparse(self.path)
+        path = re.sub(r'^/v[0-9.]+', '', unquote(url.path))
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if self.engine.latency:
+            time.sleep(self.engine.latency)
+
+        if path == '/_ping':
+            return self.__reply(200, b'OK', 'text/plain')
+        if path == '/version':
+            return self.__json(200, {'ApiVersion': API_VERSION, 'Version': 'fake', 'MinAPIVersion': '1.12'})
+        m = re.match(r'^/images/(.+)/json$', path)
+        if m:
+            self.engine.count('image')
+            name = m.group(1)
+            if name in self.engine.image()['RepoTags'] or IMAGE_ID.startswith(name) or \
+                    IMAGE_ID[len('sha256:'):].startswith(name):
+                return self.__json(200, self.engine.image())
+            return self.__error(404, f'No such image: {name}')
+        if path == '/images/create':
+            return self.__pull(query.get('fromImage', ''), query.get('tag', 'latest'))
+        if path == '/containers/create':
+            self.engine.count('create')
+            config = json.loads(self.__body() or b'{}')
+            cpuset = (config.get('HostConfig') or {}).get('CpusetCpus')
+            if cpuset and self.engine.cpus is not None and \
+                    max(int(c) for c in re.split('[,-]', cpuset)) >= self.engine.cpus:
+                return self.__error(400, f'Requested CPUs are not available - requested {cpuset}, '
+                                         f'available: 0-{self.engine.cpus - 1}')
+            container = FakeContainer(config)
+            self.engine.containers[container.id] = container
+            return self.__json(201, {'Id': container.id, 'Warnings': []})
+        if path == '/containers/json':
+            return self.__list_containers(json.loads(query.get('filters', '{}')))
+        m = re.match(r'^/containers/([^/]+)(/[a-z]+)?$', path)
+        if not m:
+            return self.__error(404, f'page not found {path}')
+        container = self.engine.find_container(m.group(1))
+        if container is None:
+            if self.command == 'POST' and m.group(2) != '/wait':
+                self.__body()
+            return self.__error(404, f'No such container: {m.group(1)}')
+        operation = (m.group(2) or '')[1:]
+        self.engine.count(operation or self.command.lower())
+        if operation == 'json':
+            return self.__json(200, container.inspect())
+        if operation == 'attach':
+            return self.__attach(container, query)
+        if operation == 'start':
+            self.__body()
+            container.started.set()
+            if not container.attached:
+                container.run(None, 0)
+                container.finish()
+            return self.__reply(204)
+        if operation == 'wait':
+            self.__body()
+            container.finished.wait()
+            return self.__json(200, {'StatusCode': container.exit_code, 'Error': None})
+        if operation == 'archive':
+            return self.__archive(container, query['path'])
+        if operation == 'changes':
+            return self.__json(200, [{'Path': p, 'Kind': k} for p, k in sorted(container.changes.items())])
+        if operation == 'kill':
+            self.__body()
+            if container.started.is_set() and not container.finished.is_set():
+                container.finish()
+                return self.__reply(204)
+            return self.__error(409, f'Container {container.id} is not running')
+        if operation == '' and self.command == 'DELETE':
+            del self.engine.containers[container.id]
+            return self.__reply(204)
+        return self.__error(404, f'page not found {path}')
+
+    def __pull(self, name: str, tag: str):
+        self.__body()
+        self.engine.count('pull')
+        image = f'{name}:{tag}'
+        if image not in self.engine.remote_tags:
+            return self.__error(404, f'manifest for {image} not found: manifest unknown: manifest unknown')
+        statuses = [{'status': f'Pulling from {name}', 'id': tag}]
+        for layer in ['layer0', 'layer1']:
+            statuses.append({'status': 'Downloading', 'id': layer, 'progressDetail': {'current': 512, 'total': 1024}})
+            statuses.append({'status': 'Pull complete', 'id': layer, 'progressDetail': {}})
+        statuses.append({'status': f'Status: Downloaded newer image for {image}'})
+        self.engine.tags.add(image)
+        # streamed as chunks, like Docker does
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for status in statuses:
+            data = json.dumps(status).encode() + b'\r\n'
+            self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def __list_containers(self, filters: Dict[str, List[str]]):
+        self.engine.count('list')
+        res = []
+        for c in list(self.engine.containers.values()):
+            labels = c.config.get('Labels') or {}
+            state = 'exited' if c.finished.is_set() else ('running' if c.started.is_set() else 'created')
+            wanted = [label.split('=', 1) for label in filters.get('label', [])]  # 'key' or 'key=value'
+            if not all(w[0] in labels and (len(w) == 1 or labels[w[0]] == w[1]) for w in wanted):
+                continue
+            if filters.get('status') and state not in filters['status']:
+                continue
+            res.append({'Id': c.id, 'Created': int(c.created), 'State': state, 'Labels': labels})
+        return self.__json(200, res)
+
+    def __archive(self, container: FakeContainer, path: str):
+        if self.command == 'PUT':
+            data = self.__body()
+            with tarfile.open(fileobj=DecompressReader(io.BytesIO(data)), mode='r|') as tar:
+                for member in tar:
+                    name = posixpath.join(path, member.name)
+                    if member.isdir():
+                        container.add(name, FsEntry(None, member.mode, member.mtime))
+                    elif member.isfile():
+                        container.add(name, FsEntry(tar.extractfile(member).read(), member.mode, member.mtime))
+            return self.__reply(200)
+        stat = container.path_stat(path)
+        if stat is None:
+            return self.__error(404, f'Could not find the file {path} in container {container.id}')
+        if self.command == 'HEAD':
+            return self.__reply(200, headers={'X-Docker-Container-Path-Stat': stat})
+        return self.__reply(200, container.archive(path), 'application/x-tar',
+                            headers={'X-Docker-Container-Path-Stat': stat})
+
+    def __attach(self, container: FakeContainer, query: Dict[str, str]):
+        """Hijack the connection for multiplexed stdout/stderr and raw stdin"""
+        self.__body()
+        container.attached = True
+        self.send_response(101)
+        self.send_header('Content-Type', 'application/vnd.docker.multiplexed-stream')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Upgrade', 'tcp')
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        container.started.wait()
+        stdin = None
+        if query.get('stdin') in {'1', 'true', 'True'}:
+            stdin = bytearray()
+            chunk = self.rfile.read1(65536)
+            while chunk:
+                stdin.extend(chunk)
+                chunk = self.rfile.read1(65536)
+        try:
+            for s_type, data in container.run(stdin, self.engine.stdout_bytes, self.engine.stdout_lines):
+                self.engine.transfer(len(data))
+                self.wfile.write(struct.pack('>BxxxL', s_type, len(data)) + data)
+            self.wfile.flush()
+            time.sleep(self.engine.run_time)
+        finally:
+            container.finish()
+
+
+class FakeEngineServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, engine: FakeEngine):
+        handler = type('Handler', (EngineHandler,), {'engine': engine})
+        super().__init__(socket_path, handler)
+        self.engine = engine
+
+    def start(self) -> threading.Thread:
+        """Serve in a background thread"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socket', default='/tmp/fake-docker.sock', help='Unix socket path')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each request')
+    parser.add_argument('--bandwidth', type=float, help='bytes per second for transfers, unlimited by default')
+    parser.add_argument('--stdout-bytes', type=int, default=0, help='extra stdout from each run')
+    parser.add_argument('--run-time', type=float, default=0.0,
+                        help='seconds each run continues after writing its output files')
+    parser.add_argument('--stdout-lines', type=int, default=0, help='extra stdout lines from each run, a frame each')
+    args = parser.parse_args()
+    engine = FakeEngine(args.latency, args.bandwidth, args.stdout_bytes, args.run_time, args.stdout_lines)
+    with FakeEngineServer(args.socket, engine) as server:
+        print(f"export DOCKER_HOST=unix://{args.socket}")
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+Microbenchmarks of the host-side hot paths, no Docker required.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --filter tar_ --repeat 10
+
+Results are appended into a JSON lines history file (benchmarks/history.jsonl by default),
+each run is compared to the previous recorded run of the same benchmark.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import pathlib
+import platform
+import statistics
+import struct
+import subprocess
+import tarfile
+import tempfile
+import timeit
+import types
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Any
+
+from benchmarks.bench_file_resolver import create_tree
+from cincan.command_inspector import CommandInspector
+from cincan.command_log import CommandLog, CommandLogIndex, CommandLogWriter, FileLog, read_with_hash
+from cincan.file_tool import FileMatcher, FileResolver
+from cincan.frontend import ToolImage
+from cincan.tar_tool import TarTool
+
+ROOT = pathlib.Path(__file__).parent.parent
+DEFAULT_HISTORY = ROOT / 'benchmarks' / 'history.jsonl'
+
+
+class Benchmark:
+    """Benchmark with one-time setup, 'items' is the number of items processed per round"""
+    def __init__(self, name: str, func: Callable[[pathlib.Path], Callable[[], Any]], items: int):
+        self.name = name
+        self.func = func
+        self.items = items
+
+
+BENCHMARKS: List[Benchmark] = []
+
+
+def benchmark(items: int):
+    """Register benchmark, the function does setup in the directory and returns the measured callable"""
+    def register(func):
+        BENCHMARKS.append(Benchmark(func.__name__[len('bench_'):], func, items))
+        return func
+    return register
+
+
+class FakeContainer:
+    """Container with just enough for TarTool uploads"""
+    def __init__(self):
+        self.attrs = {'Image': 'sha256:bench'}
+        self.image = types.SimpleNamespace(attrs={'Config': {'WorkingDir': '/home/appuser'}})
+        self.uploaded = 0
+
+    def put_archive(self, path: str, data):
+        chunk = data.read(1024 * 1024)
+        while chunk:
+            self.uploaded += len(chunk)
+            chunk = data.read(1024 * 1024)
+
+
+@benchmark(items=100000)
+def bench_file_matcher_upload(directory: pathlib.Path):
+    files = [pathlib.Path(f'samples/dir-{i % 100}/file-{i}.{"txt" if i % 10 else "bin"}') for i in range(100000)]
+    matchers = FileMatcher.parse(['samples/*.txt', '^samples/dir-1*'])
+
+    def run():
+        res = files
+        for m in matchers:
+            res = m.filter_upload_files(res)
+        return res
+    return run
+
+
+@benchmark(items=100000)
+def bench_file_matcher_download(directory: pathlib.Path):
+    files = [f'/home/appuser/out/dir-{i % 100}/file-{i}.txt' for i in range(100000)]
+    matchers = FileMatcher.parse(['out/*/file-1*', '^out/dir-2*'])
+
+    def run():
+        res = files
+        for m in matchers:
+            res = m.filter_download_files(res, '/home/appuser/')
+        return res
+    return run
+
+
+@benchmark(items=20000)
+def bench_file_resolver(directory: pathlib.Path):
+    os.chdir(directory)
+    create_tree(pathlib.Path('.'), 20000)
+    args = ['-r', 'tree', '--out=tree/dir-0/new/output.txt', 'not-a-file', '-x', 'tree/dir-1/file-0.txt']
+
+    def run():
+        upload_files = {}
+        FileResolver(args, directory).resolve_upload_files(upload_files)
+        return upload_files
+    return run
+
+
+@benchmark(items=2000)
+def bench_tar_create(directory: pathlib.Path):
+    os.chdir(directory)
+    create_tree(pathlib.Path('.'), 2000)
+    for f in pathlib.Path('tree').rglob('*.txt'):
+        f.write_bytes(os.urandom(4096))
+    logger = logging.getLogger('bench')
+
+    def run():
+        resolver = FileResolver(['tree'], directory)
+        upload_files = {}
+        resolver.resolve_upload_files(upload_files)
+        TarTool(logger, FakeContainer(), {}, stats=resolver.stats).upload(upload_files, [])
+    return run
+
+
+@benchmark(items=2000)
+def bench_tar_list(directory: pathlib.Path):
+    tar_file = directory / 'input.tar'
+    with tarfile.open(tar_file, 'w') as tar:
+        for i in range(2000):
+            info = tarfile.TarInfo(f'input/file-{i}.bin')
+            info.size = 4096
+            tar.addfile(info, io.BytesIO(os.urandom(4096)))
+    logger = logging.getLogger('bench')
+
+    def run():
+        TarTool(logger, FakeContainer(), {}, explicit_file=tar_file.as_posix()).upload({}, [])
+    return run
+
+
+@benchmark(items=10000)
+def bench_unpack_container_stream(directory: pathlib.Path):
+    data = bytearray()
+    for i in range(10000):
+        payload = os.urandom(100 + i % 4000)
+        data.extend(struct.pack('>Q', ((1 + i % 2) << 56) | len(payload)))
+        data.extend(payload)
+    tool = ToolImage.__new__(ToolImage)  # no Docker client needed to parse the stream
+    tool.is_tty = False
+    tool.logger = logging.getLogger('bench')
+    unpack = tool._ToolImage__unpack_container_stream
+
+    def run():
+        stream = io.BytesIO(data)
+        frames = 0
+        while unpack(stream)[1]:
+            frames += 1
+        return frames
+    return run
+
+
+@benchmark(items=64)
+def bench_read_with_hash(directory: pathlib.Path):
+    data = os.urandom(64 * 1024 * 1024)  # items are MiB
+
+    def run():
+        return read_with_hash(io.BytesIO(data).read, io.BytesIO().write)
+    return run
+
+
+@benchmark(items=1000)
+def bench_command_log_queries(directory: pathlib.Path):
+    os.environ['HOME'] = directory.as_posix()
+    (directory / '.cincan').mkdir()
+    writer = CommandLogWriter()
+    start = datetime(2021, 3, 1)
+    # pipelines of three commands per sample, plus a shared resource used by all
+    for n in range(10000):
+        log = CommandLog(['cincan/tool', str(n)], start + timedelta(seconds=n))
+        sample, step = divmod(n, 3)
+        log.in_files = [FileLog(pathlib.Path(f'/work/{sample}/{step}'), f'{sample:032x}{step:032x}'),
+                        FileLog(pathlib.Path('/work/shared'), f'{0xffff:064x}')]
+        log.out_files = [FileLog(pathlib.Path(f'/work/{sample}/{step + 1}'), f'{sample:032x}{step + 1:032x}')]
+        writer.write(log)
+    index = CommandLogIndex()
+    inspector = CommandInspector(index, pathlib.Path('/work'))
+
+    def run():
+        for sample in range(1000):
+            inspector.fanin(pathlib.Path(f'/work/{sample}/3'), 3, digest=f'{sample:032x}{3:032x}')
+            inspector.fanout(pathlib.Path(f'/work/{sample}/0'), 3, digest=f'{sample:032x}{0:032x}')
+    return run
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def previous_results(history: pathlib.Path) -> Dict[str, Dict[str, float]]:
+    """Latest recorded result of each benchmark"""
+    latest = {}
+    if history.is_file():
+        with history.open() as f:
+            for line in f:
+                if line.strip():
+                    latest.update(json.loads(line)['results'])
+    return latest
+
+
+def run_benchmark(bench: Benchmark, repeat: int) -> Dict[str, float]:
+    cwd, home = os.getcwd(), os.environ.get('HOME')
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            func = bench.func(pathlib.Path(tmp).resolve())
+            func()  # warm-up
+            times = timeit.repeat(func, number=1, repeat=repeat)
+        finally:
+            os.chdir(cwd)
+            if home is not None:
+                os.environ['HOME'] = home
+    best = min(times)
+    return {'best': best, 'median': statistics.median(times), 'items': bench.items, 'items_per_s': bench.items / best}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', default='', help='run only benchmarks with names containing this')
+    parser.add_argument('--repeat', type=int, default=5, help='repeat each measurement, best and median reported')
+    parser.add_argument('--history', type=pathlib.Path, default=DEFAULT_HISTORY, help='JSON lines history file')
+    parser.add_argument('--no-save', action='store_true', help='do not append results into the history')
+    args = parser.parse_args(argv)
+
+    logging.getLogger('bench').setLevel(logging.WARNING)
+    previous = previous_results(args.history)
+    results = {}
+    print(f"{'benchmark':<28} {'best s':>10} {'median s':>10} {'items/s':>12} {'change':>8}")
+    for bench in [b for b in BENCHMARKS if args.filter in b.name]:
+        res = run_benchmark(bench, args.repeat)
+        results[bench.name] = res
+        prev = previous.get(bench.name)
+        change = f"{(res['best'] / prev['best'] - 1) * 100:+.1f}%" if prev else ''
+        print(f"{bench.name:<28} {res['best']:>10.4f} {res['median']:>10.4f} {res['items_per_s']:>12.0f} {change:>8}")
+
+    if not args.no_save and results:
+        record = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'version': (ROOT / 'VERSION').read_text().strip(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results,
+        }
+        with args.history.open('a') as f:
+            f.write(json.dumps(record) + '\n')
+    return results
+
+
+if __name__ == '__main__':
+    main()
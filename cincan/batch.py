@@ -0,0 +1,168 @@
+import concurrent.futures
+import shlex
+import sys
+import threading
+from logging import Logger
+from typing import Callable, IO, List, Optional, TYPE_CHECKING
+
+import docker
+import docker.errors
+import requests.exceptions
+
+from cincan.command_log import CommandLog, CommandLogWriter
+from cincan.progress import Progress, ProgressTask
+from cincan.resources import Allocation, Footprint, FootprintHistory, ResourcePool
+from cincan.scheduler import Endpoint, Scheduler
+
+if TYPE_CHECKING:
+    from cincan.frontend import ToolImage
+
+PING_TIMEOUT = 10  # seconds, health check of an endpoint
+
+
+class EndpointError(Exception):
+    """Docker endpoint can not be reached"""
+
+
+# errors which tell that the endpoint, rather than the run, failed
+ENDPOINT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout, EndpointError)
+
+
+def client_for(endpoint: Endpoint, timeout: Optional[float] = None) -> docker.DockerClient:
+    """Client of a Docker endpoint, EndpointError if it can not be reached"""
+    kwargs = {'timeout': timeout} if timeout else {}
+    try:
+        return docker.DockerClient(base_url=endpoint.host, **kwargs) if endpoint.host else docker.from_env(**kwargs)
+    except docker.errors.DockerException as e:
+        raise EndpointError(str(e) or e.__class__.__name__) from e
+
+
+def ping_endpoint(endpoint: Endpoint) -> Optional[str]:
+    """Health check of a Docker endpoint, return error or None"""
+    try:
+        client = client_for(endpoint, timeout=PING_TIMEOUT)
+        try:
+            client.ping()
+        finally:
+            client.close()
+    except (EndpointError, docker.errors.DockerException, requests.exceptions.RequestException) as e:
+        return str(e) or e.__class__.__name__
+    return None
+
+
+def read_commands(file: IO[str]) -> List[List[str]]:
+    """Read commands, one per line as a tool and its arguments, ignoring empty lines and comments.
+    Options of 'cincan run' are not supported, ValueError is raised for a line starting with one."""
+    commands = []
+    for number, line in enumerate(file, 1):
+        args = shlex.split(line, comments=True)
+        if args and args[0].startswith('-'):
+            raise ValueError(f"line {number}: options of 'cincan run' are not supported, "
+                             f"give the tool and its arguments")
+        if args:
+            commands.append(args)
+    return commands
+
+
+class BatchRunner:
+    """Run a batch of tools concurrently, each run placed on an endpoint by the scheduler"""
+
+    def __init__(self, scheduler: Scheduler,
+                 tool_for: Callable[[str, Optional[str], docker.DockerClient], 'ToolImage'],
+                 logger: Logger, progress: Progress, command_log: bool = False,
+                 pool: Optional[ResourcePool] = None, footprints: Optional[FootprintHistory] = None):
+        self.scheduler = scheduler
+        self.tool_for = tool_for  # tool by name, Docker host and its client
+        self.logger = logger
+        self.progress = progress
+        self.command_log = command_log
+        self.output_lock = threading.Lock()
+        self.pool = pool  # CPUs and memory for the runs on this host, None to not place them
+        self.footprints = footprints  # observed footprints of the tools
+
+    def run_all(self, commands: List[List[str]], jobs: int) -> int:
+        """Run the commands, return the number of failed ones"""
+        self.progress.footer = self.scheduler.status
+        with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as executor:
+            failed = sum(not ok for ok in executor.map(self.run_one, commands))
+        self.progress.close()
+        for endpoint in self.scheduler.endpoints:
+            self.logger.info(endpoint.status())
+        return failed
+
+    def run_one(self, command: List[str]) -> bool:
+        """Run a command, retry on other endpoint if the endpoint fails, return success"""
+        name = ' '.join(shlex.quote(a) for a in command)
+        for _ in self.scheduler.endpoints:
+            endpoint = self.scheduler.acquire()
+            if endpoint is None:
+                self.logger.error(f"{name}: no healthy Docker endpoint")
+                return False
+            with self.progress.task(name) as task:
+                task.update(status=f"on {endpoint.name}")
+                try:
+                    tool = self.tool_for(command[0], endpoint.host, client_for(endpoint))
+                    allocation = None
+                    if self.pool and endpoint.is_local() and endpoint.placement:
+                        allocation = self.__allocate(command[0], tool, task)
+                    try:
+                        log = tool.run_buffered(command[1:])
+                    finally:
+                        allocation and self.pool.release(allocation)
+                    if allocation and 'cpuset_cpus' not in tool.resources:
+                        endpoint.placement = False  # rejected by the engine, which is not on the CPUs of this host
+                    if tool.footprint and self.footprints:
+                        self.footprints.record(command[0], tool.footprint)
+                except ENDPOINT_ERRORS as e:
+                    task.finish(failed=True)
+                    self.logger.warning(f"{name}: endpoint {endpoint.name} failed, {e}")
+                    self.scheduler.release(endpoint, failed=True, error=str(e))
+                    continue  # try another endpoint
+                except SystemExit:
+                    # a run exits on errors, e.g. when the tool is not found, the error is already logged
+                    task.finish(failed=True)
+                    self.logger.error(f"{name}: failed on {endpoint.name}")
+                    self.scheduler.release(endpoint, failed=True)
+                    return False
+                except Exception as e:
+                    task.finish(failed=True)
+                    self.logger.error(f"{name}: failed on {endpoint.name}, {e}")
+                    self.scheduler.release(endpoint, failed=True)
+                    return False
+            self.scheduler.release(endpoint, failed=log.exit_code != 0)
+            self.__output(name, endpoint, log)
+            return log.exit_code == 0
+        self.logger.error(f"{name}: failed on all endpoints")
+        return False
+
+    def __allocate(self, name: str, tool: 'ToolImage', task: ProgressTask) -> Allocation:
+        """Wait for CPUs and memory for the declared, or earlier observed, footprint of the tool"""
+        try:
+            declared = Footprint.from_labels(tool.image.labels or {})
+        except ValueError as e:
+            self.logger.warning(f"{name}: ignoring footprint labels of the image: {e}")
+            declared = None
+        footprint = declared or (self.footprints and self.footprints.get(name)) or Footprint()
+        status = task.status
+        task.update(status=f"{status}, waiting for {footprint}")
+        allocation = self.pool.acquire(footprint)
+        task.update(status=f"{status}, CPUs {','.join(str(c) for c in allocation.cpus)}")
+        self.logger.debug(f"{name}: footprint {footprint}, options {allocation.container_options()}")
+        tool.resources = allocation.container_options()
+        tool.sample_footprint = not footprint.declared
+        return allocation
+
+    def __output(self, name: str, endpoint: Endpoint, log: CommandLog):
+        """Write output of a run at once, so that outputs of concurrent runs are not mixed"""
+        with self.output_lock:
+            self.progress.clear()
+            sys.stdout.buffer.write(log.stdout)
+            sys.stdout.buffer.flush()
+            sys.stderr.buffer.write(log.stderr)
+            sys.stderr.buffer.flush()
+            if log.exit_code == 0:
+                self.logger.info(f"{name}: done on {endpoint.name}")
+                if self.command_log:
+                    CommandLogWriter().write(log)
+            else:
+                self.logger.error(f"{name}: exit code {log.exit_code} on {endpoint.name}")
@@ -0,0 +1,179 @@
+import errno
+import fcntl
+import os
+import pathlib
+import shutil
+import tempfile
+from typing import IO, Iterator, Optional, Set, Tuple
+
+from cincan.command_log import read_with_hash
+
+FICLONE = 0x40049409  # Linux ioctl to clone file content, supported by e.g. Btrfs and XFS
+
+
+class BlobStore:
+    """Content-addressed file store, files are stored by their SHA-256 digest"""
+    def __init__(self, directory: pathlib.Path):
+        self.directory = directory
+
+    def path_for(self, digest: str) -> pathlib.Path:
+        return self.directory / digest[:2] / digest
+
+    def contains(self, digest: str) -> bool:
+        return self.path_for(digest).is_file()
+
+    def size_of(self, digest: str) -> int:
+        try:
+            return self.path_for(digest).stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def is_intact(self, digest: str) -> bool:
+        """Is the file stored and its content still matching the digest, a hard link may have modified it.
+        A read-only file without other links is trusted, others are hashed again"""
+        path = self.path_for(digest)
+        try:
+            st = path.stat()
+            if st.st_nlink == 1 and not st.st_mode & 0o222:
+                return True
+            with path.open('rb') as f:
+                return read_with_hash(f.read) == digest
+        except FileNotFoundError:
+            return False
+
+    def add(self, source: IO[bytes], digest: Optional[str] = None) -> str:
+        """Copy data from stream into the store, return its digest"""
+        if digest and self.is_intact(digest):
+            return digest
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                data_digest = read_with_hash(source.read, f.write)
+            target = self.path_for(data_digest)
+            if self.is_intact(data_digest):
+                os.unlink(tmp_name)  # already stored, keep the existing file and its links
+            else:
+                target.parent.mkdir(exist_ok=True)
+                os.chmod(tmp_name, 0o444)  # content must never change
+                os.replace(tmp_name, target)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+        return data_digest
+
+    def add_file(self, file: pathlib.Path, digest: Optional[str] = None) -> str:
+        """Copy file into the store, return its digest"""
+        if digest and self.is_intact(digest):
+            return digest
+        with file.open('rb') as f:
+            return self.add(f, digest)
+
+    def add_shared(self, file: pathlib.Path, digest: str, link: bool = False) -> bool:
+        """Add file into the store sharing its data, by reflink or by hard link if link is set.
+        False if neither is possible, then the file is not stored"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        target = self.path_for(digest)
+        target.parent.mkdir(exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=target.parent, prefix='.', suffix='.tmp')
+        os.close(fd)
+        os.unlink(tmp_name)  # just a unique name for the link
+        tmp_file = pathlib.Path(tmp_name)
+        try:
+            if not self.__reflink(file, tmp_file):
+                if not (link and self.__hard_link(file, tmp_file)):
+                    return False
+            os.chmod(tmp_file, 0o444)  # content must never change, hard linked file is read-only too
+            os.replace(tmp_file, target)
+        except BaseException:
+            if os.path.lexists(tmp_file):
+                os.unlink(tmp_file)
+            raise
+        return True
+
+    def share_to(self, digest: str, target: pathlib.Path, link: bool = False) -> bool:
+        """Place stored file to target by reflink or by hard link if link is set, replacing the target atomically.
+        False if neither is possible, then the target is not touched"""
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = target.parent / f'.{target.name}.cincan-tmp'
+        source = self.path_for(digest)
+        try:
+            if not self.__reflink(source, tmp_file):
+                if not (link and self.__hard_link(source, tmp_file)):
+                    return False
+            os.replace(tmp_file, target)
+        except BaseException:
+            if os.path.lexists(tmp_file):
+                os.unlink(tmp_file)
+            raise
+        return True
+
+    def copy_to(self, digest: str, target: pathlib.Path, link: bool = False):
+        """Copy stored file to target, replacing the target atomically.
+        Reflink is used when supported, hard link if link is set, otherwise the data is copied"""
+        if self.share_to(digest, target, link):
+            return
+        tmp_file = target.parent / f'.{target.name}.cincan-tmp'
+        try:
+            shutil.copyfile(self.path_for(digest), tmp_file)
+            os.replace(tmp_file, target)
+        except BaseException:
+            if os.path.lexists(tmp_file):
+                os.unlink(tmp_file)
+            raise
+
+    @classmethod
+    def __reflink(cls, source: pathlib.Path, target: pathlib.Path) -> bool:
+        """Clone file sharing the data blocks until modified, False if not supported"""
+        with source.open('rb') as src, target.open('wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return True
+            except OSError as e:
+                if e.errno not in {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS}:
+                    raise
+        target.unlink()
+        return False
+
+    @classmethod
+    def __hard_link(cls, source: pathlib.Path, target: pathlib.Path) -> bool:
+        """Hard link file, False if not possible e.g. across file systems"""
+        try:
+            os.link(source, target)
+            return True
+        except OSError as e:
+            if e.errno not in {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP}:
+                raise
+        return False
+
+    def open(self, digest: str) -> IO[bytes]:
+        return self.path_for(digest).open('rb')
+
+    def remove(self, digest: str):
+        try:
+            self.path_for(digest).unlink()
+        except FileNotFoundError:
+            pass
+
+    def digests(self) -> Iterator[str]:
+        """Iterate digests of all stored files"""
+        if not self.directory.is_dir():
+            return
+        for sub_dir in self.directory.iterdir():
+            if sub_dir.is_dir() and len(sub_dir.name) == 2:
+                for file in sub_dir.iterdir():
+                    if not file.name.startswith('.'):
+                        yield file.name
+
+    def remove_unreferenced(self, referenced: Set[str], dry_run: bool = False) -> Tuple[int, int]:
+        """Remove files not in the referenced set, return number and total size of the removed files"""
+        count, size = 0, 0
+        for digest in list(self.digests()):
+            if digest in referenced:
+                continue
+            count += 1
+            size += self.size_of(digest)
+            if not dry_run:
+                self.remove(digest)
+        return count, size
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import time
+from typing import Any, Dict, Iterator, Optional
+
+
+class JsonCache:
+    """Key-value cache storing a JSON document per key into a directory"""
+    def __init__(self, directory: pathlib.Path, ttl: Optional[float] = None):
+        self.directory = directory
+        self.ttl = ttl  # time to live in seconds, None for entries which never expire
+
+    def __file_for(self, key: str) -> pathlib.Path:
+        # keys are image ids, registry names, etc., hash them to get safe file names
+        return self.directory / (hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get cached value, None if not cached or expired"""
+        entry = self.get_entry(key)
+        if entry is None or self.is_expired(entry):
+            return None
+        return entry['value']
+
+    def get_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get cache entry with its time stamp regardless of expiration"""
+        try:
+            with self.__file_for(key).open('r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None  # not cached or broken entry
+        if entry.get('key') != key or 'value' not in entry:
+            return None
+        return entry
+
+    def is_expired(self, entry: Dict[str, Any]) -> bool:
+        return self.ttl is not None and time.time() - entry.get('time', 0) > self.ttl
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Store value, replacing the old one atomically"""
+        entry = {'key': key, 'time': time.time(), 'value': value}
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entry, f)
+                os.replace(tmp_name, self.__file_for(key))
+            except BaseException:
+                os.unlink(tmp_name)
+                raise
+        except OSError:
+            pass  # cache is only an optimization
+
+    def remove(self, key: str):
+        try:
+            self.__file_for(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        """Iterate all cache entries with their keys and time stamps"""
+        if not self.directory.is_dir():
+            return
+        for file in self.directory.glob('*.json'):
+            try:
+                with file.open('r') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if 'key' in entry and 'value' in entry:
+                yield entry
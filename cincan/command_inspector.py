@@ -1,7 +1,8 @@
 import hashlib
 import pathlib
+from collections import deque
 from io import TextIOBase
-from typing import Optional, List, Tuple, Set
+from typing import Optional, List, Tuple, Set, Dict
 
 from cincan.command_log import CommandLogIndex, CommandLog, quote_args
 
@@ -51,41 +52,39 @@ class CommandInspector:
 
     def fanin(self, file: pathlib.Path, depth: int, already_covered: Set[str] = None,
               digest: Optional[str] = None) -> FileDependency:
-        file_digest = digest or self.hash_of(file)
-        file_dep = FileDependency(self.__work_path(file), file_digest, out=False)
-        file_check = file.as_posix() + ':' + file_digest
-        already_covered = already_covered or set([])
-        if depth < 1 or file_check in already_covered:
-            return file_dep
-        already_covered.add(file_check)
-
-        for cmd in self.log.list_entries(reverse=True):
-            output_here = any(filter(lambda f: f.digest == file_digest, cmd.out_files))
-            if output_here:
-                cmd_dep = CommandDependency(cmd, out=False)
-                for file in cmd.in_files:
-                    cmd_dep.next.append(self.fanin(file.path, depth - 1, already_covered, file.digest))
-                file_dep.next.append(cmd_dep)
-        return file_dep
+        """Resolve commands and files which have produced the file"""
+        return self.__traverse(file, depth, already_covered, digest, out=False)
 
     def fanout(self, file: pathlib.Path, depth: int, already_covered: Set[str] = None,
                digest: Optional[str] = None) -> FileDependency:
-        file_digest = digest or self.hash_of(file)
-        file_dep = FileDependency(self.__work_path(file), file_digest, out=True)
-        file_check = file.as_posix() + ':' + file_digest
-        already_covered = already_covered or set([])
-        if depth < 1 or file_check in already_covered:
-            return file_dep
-        already_covered.add(file_check)
+        """Resolve commands and files which have been produced from the file"""
+        return self.__traverse(file, depth, already_covered, digest, out=True)
+
+    def __traverse(self, file: pathlib.Path, depth: int, already_covered: Optional[Set[str]],
+                   digest: Optional[str], out: bool) -> FileDependency:
+        """Breadth-first traversal of the dependencies using the digest index of the log"""
+        root = FileDependency(self.__work_path(file), digest or self.hash_of(file), out=out)
+        already_covered = already_covered if already_covered is not None else set()
+        commands: Dict[str, List[CommandLog]] = {}  # index look-ups by digest
+        queue = deque([(file, root, depth)])
+        while queue:
+            path, file_dep, f_depth = queue.popleft()
+            file_check = path.as_posix() + ':' + file_dep.digest
+            if f_depth < 1 or file_check in already_covered:
+                continue
+            already_covered.add(file_check)
 
-        for cmd in self.log.list_entries(reverse=True):
-            input_here = any(filter(lambda f: f.digest == file_digest, cmd.in_files))
-            if input_here:
-                cmd_dep = CommandDependency(cmd, out=True)
-                for file in cmd.out_files:
-                    cmd_dep.next.append(self.fanout(file.path, depth -1, already_covered, file.digest))
+            if file_dep.digest not in commands:
+                look_up = self.log.consumers_of if out else self.log.producers_of
+                commands[file_dep.digest] = list(look_up(file_dep.digest))
+            for cmd in commands[file_dep.digest]:
+                cmd_dep = CommandDependency(cmd, out=out)
+                for next_file in (cmd.out_files if out else cmd.in_files):
+                    next_dep = FileDependency(self.__work_path(next_file.path), next_file.digest, out=out)
+                    cmd_dep.next.append(next_dep)
+                    queue.append((next_file.path, next_dep, f_depth - 1))
                 file_dep.next.append(cmd_dep)
-        return file_dep
+        return root
 
     @classmethod
     def hash_of(cls, file: pathlib.Path) -> str:
@@ -1,14 +1,22 @@
 import hashlib
+import heapq
 import json
+import logging
 import pathlib
+import sqlite3
 import string
+import sys
 import uuid
 import os
 import getpass
+import urllib.parse
 from datetime import datetime
-from typing import Optional, List, Dict, Any, Iterable
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Set
+
+from cincan.timings import Timings
 
 JSON_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+LOG_DB_NAME = 'commands.sqlite'
 
 
 def quote_args(args: Iterable[str]) -> List[str]:
@@ -36,14 +44,37 @@ def read_with_hash(read_more, write_to: Optional = None) -> str:
 
 class FileLog:
     """Command log entry for a file"""
+    __slots__ = ('raw_path', 'raw_digest', 'timestamp')
+
     def __init__(self, path: pathlib.Path, digest: str, timestamp: Optional[datetime] = None):
         self.path = path
         self.digest = digest
         self.timestamp = timestamp
 
+    @property
+    def path(self) -> pathlib.Path:
+        """Path of the file, stored as interned string as logs refer to same files over and over again"""
+        return pathlib.Path(self.raw_path)
+
+    @path.setter
+    def path(self, value: pathlib.Path):
+        self.raw_path = sys.intern(value.as_posix())
+
+    @property
+    def digest(self) -> str:
+        """Digest as hex string, stored as 32 bytes"""
+        return self.raw_digest.hex() if isinstance(self.raw_digest, bytes) else self.raw_digest
+
+    @digest.setter
+    def digest(self, value: str):
+        try:
+            self.raw_digest = bytes.fromhex(value) if value else ''
+        except ValueError:
+            self.raw_digest = value  # not a hex digest, keep as it is
+
     def to_json(self) -> Dict[str, Any]:
         js = {
-            'path': self.path.as_posix()
+            'path': self.raw_path
         }
         if self.digest:
             js['sha256'] = self.digest
@@ -53,7 +84,10 @@ class FileLog:
 
     @classmethod
     def from_json(cls, js: Dict[str, Any]) -> 'FileLog':
-        log = FileLog(pathlib.Path(js['path']), js.get('sha256', ''))
+        log = FileLog.__new__(FileLog)
+        log.raw_path = sys.intern(js['path'])  # avoid creating path object
+        log.digest = js.get('sha256', '')
+        log.timestamp = None
         if 'timestamp' in js:
             log.timestamp = datetime.strptime(js['timestamp'], JSON_TIME_FORMAT)
         return log
@@ -64,15 +98,47 @@ class FileLog:
 
 class CommandLog:
     """Command log entry"""
-    def __init__(self, command: List[str], timestamp: datetime = datetime.now()):
+    __slots__ = ('command', 'timestamp', 'exit_code', 'in_files', 'out_files', 'streams', 'cached', 'timings')
+
+    def __init__(self, command: List[str], timestamp: datetime = datetime.now(), with_streams: bool = True):
         self.command = command
         self.timestamp = timestamp
         self.exit_code = 0
-        self.stdin: Optional[bytes] = b''
-        self.stdout: Optional[bytes] = b''
-        self.stderr: Optional[bytes] = b''
+        # stdin, stdout and stderr data, not stored for entries read from the log
+        self.streams: Optional[List[bytes]] = [b'', b'', b''] if with_streams else None
         self.in_files: List[FileLog] = []
         self.out_files: List[FileLog] = []
+        self.cached = False  # results restored from an identical earlier run
+        self.timings: Optional[Timings] = None
+
+    def __set_stream(self, i: int, data: Optional[bytes]):
+        if self.streams is None:
+            self.streams = [b'', b'', b'']
+        self.streams[i] = data
+
+    @property
+    def stdin(self) -> Optional[bytes]:
+        return self.streams[0] if self.streams else b''
+
+    @stdin.setter
+    def stdin(self, data: Optional[bytes]):
+        self.__set_stream(0, data)
+
+    @property
+    def stdout(self) -> Optional[bytes]:
+        return self.streams[1] if self.streams else b''
+
+    @stdout.setter
+    def stdout(self, data: Optional[bytes]):
+        self.__set_stream(1, data)
+
+    @property
+    def stderr(self) -> Optional[bytes]:
+        return self.streams[2] if self.streams else b''
+
+    @stderr.setter
+    def stderr(self, data: Optional[bytes]):
+        self.__set_stream(2, data)
 
     def command_string(self) -> str:
         return " ".join(quote_args(self.command))
@@ -83,25 +149,173 @@ class CommandLog:
             'timestamp': self.timestamp.strftime(JSON_TIME_FORMAT),
             'exit_code': self.exit_code,
         }
+        if self.cached:
+            js['cached'] = True
         if len(self.in_files) > 0:
             js['input'] = [f.to_json() for f in self.in_files]
         if len(self.out_files) > 0:
             js['output'] = [f.to_json() for f in self.out_files]
+        if self.timings:
+            js['timings'] = self.timings.to_json()
         return js
 
     @classmethod
     def from_json(cls, js: Dict[str, Any]) -> 'CommandLog':
-        log = CommandLog(js['command'], datetime.strptime(js['timestamp'], JSON_TIME_FORMAT))
+        log = CommandLog([sys.intern(c) for c in js['command']], datetime.strptime(js['timestamp'], JSON_TIME_FORMAT),
+                         with_streams=False)
+        log.cached = js.get('cached', False)
         if 'input' in js:
             log.in_files = [FileLog.from_json(fs) for fs in js['input']]
         if 'output' in js:
             log.out_files = [FileLog.from_json(fs) for fs in js['output']]
+        if 'timings' in js:
+            log.timings = Timings.from_json(js['timings'])
         return log
 
     def __repr__(self) -> str:
         return json.dumps(self.to_json(), indent=4)
 
 
+class CommandLogStore:
+    """Append-only command log database, SQLite in WAL mode allows concurrent appends and reads"""
+    SCHEMA_VERSION = 2
+
+    def __init__(self, db_file: pathlib.Path, read_only: bool = False):
+        self.db_file = db_file
+        self.read_only = read_only
+        if read_only:
+            # log of another user, never write into it, not even to upgrade the schema
+            uri = f"file:{urllib.parse.quote(db_file.as_posix())}?mode=ro"
+            self.connection = sqlite3.connect(uri, uri=True, timeout=60, isolation_level=None)
+        else:
+            # autocommit, each append is a transaction of its own; wait for other writers
+            self.connection = sqlite3.connect(str(db_file), timeout=60, isolation_level=None)
+        self.schema_version = self.__schema_version()
+        if not read_only and self.schema_version < self.SCHEMA_VERSION:
+            self.__upgrade_schema()
+            self.schema_version = self.SCHEMA_VERSION
+
+    def __schema_version(self) -> int:
+        return self.connection.execute('PRAGMA user_version').fetchone()[0]
+
+    def __upgrade_schema(self):
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            version = self.__schema_version()  # may have been upgraded meanwhile
+            if version < 1:
+                self.connection.execute("""CREATE TABLE commands (
+                    id INTEGER PRIMARY KEY,
+                    timestamp TEXT NOT NULL,
+                    entry TEXT NOT NULL)""")
+                self.connection.execute('CREATE INDEX commands_by_time ON commands(timestamp)')
+                self.connection.execute('CREATE TABLE migrated (name TEXT PRIMARY KEY)')
+            if version < 2:
+                # digest index of input and output files
+                self.connection.execute("""CREATE TABLE files (
+                    command_id INTEGER NOT NULL REFERENCES commands(id),
+                    output INTEGER NOT NULL,
+                    digest TEXT NOT NULL)""")
+                self.connection.execute('CREATE INDEX files_by_digest ON files(digest, output)')
+                for c_id, entry in self.connection.execute('SELECT id, entry FROM commands').fetchall():
+                    self.__index_files(c_id, json.loads(entry))
+            self.connection.execute(f'PRAGMA user_version={self.SCHEMA_VERSION}')
+
+    def close(self):
+        self.connection.close()
+
+    def append(self, log: CommandLog):
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.__insert(log.to_json())
+
+    def __insert(self, js: Dict[str, Any]):
+        c_id = self.connection.execute('INSERT INTO commands(timestamp, entry) VALUES (?, ?)',
+                                       (js['timestamp'], json.dumps(js))).lastrowid
+        self.__index_files(c_id, js)
+
+    def __index_files(self, c_id: int, js: Dict[str, Any]):
+        rows = []
+        for output, key in [(0, 'input'), (1, 'output')]:
+            rows.extend((c_id, output, f['sha256']) for f in js.get(key, []) if f.get('sha256'))
+        self.connection.executemany('INSERT INTO files(command_id, output, digest) VALUES (?, ?, ?)', rows)
+
+    def entries(self, reverse: bool = False) -> Iterator[CommandLog]:
+        """Iterate entries in time order, reading them as required"""
+        if self.schema_version < 1:
+            return  # empty database of another user
+        order = 'DESC' if reverse else 'ASC'
+        cursor = self.connection.execute(f'SELECT entry FROM commands ORDER BY timestamp {order}, id {order}')
+        for (entry,) in cursor:
+            yield CommandLog.from_json(json.loads(entry))
+
+    def with_file(self, digest: str, output: bool) -> Iterator[CommandLog]:
+        """Iterate entries with the file as input or output, newest first"""
+        if self.schema_version < 2:
+            # old database of another user, no digest index
+            for e in self.entries(reverse=True):
+                if any(f.digest == digest for f in (e.out_files if output else e.in_files)):
+                    yield e
+            return
+        cursor = self.connection.execute(
+            'SELECT DISTINCT c.id, c.timestamp, c.entry FROM files f JOIN commands c ON c.id = f.command_id '
+            'WHERE f.digest = ? AND f.output = ? ORDER BY c.timestamp DESC, c.id DESC', (digest, int(output)))
+        for _, _, entry in cursor:
+            yield CommandLog.from_json(json.loads(entry))
+
+    def digests(self) -> Set[str]:
+        """Digests of all logged input and output files"""
+        if self.schema_version < 2:
+            return {f.digest for e in self.entries() for f in e.in_files + e.out_files if f.digest}
+        return {d for (d,) in self.connection.execute('SELECT DISTINCT digest FROM files')}
+
+    def __len__(self) -> int:
+        if self.schema_version < 1:
+            return 0
+        return self.connection.execute('SELECT COUNT(*) FROM commands').fetchone()[0]
+
+    def migrate(self, directory: pathlib.Path) -> int:
+        """Move log entries from the old one file per entry layout into the database"""
+        files = legacy_log_files(directory)
+        if not files:
+            return 0
+        count = 0
+        done = []
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')  # concurrent migrations wait here
+            for file in files:
+                try:
+                    with file.open('r') as f:
+                        js = json.load(f)
+                except FileNotFoundError:
+                    continue  # migrated by concurrent process
+                except ValueError:
+                    continue  # not a log entry, leave it alone
+                if not isinstance(js, dict) or 'timestamp' not in js:
+                    logging.getLogger('log').warning(f"{file}: no timestamp, not migrated")
+                    continue
+                done.append(file)
+                # file name tells if the entry is already migrated, but the file not yet removed
+                if self.connection.execute('INSERT OR IGNORE INTO migrated(name) VALUES (?)',
+                                           (file.name,)).rowcount:
+                    self.__insert(js)
+                    count += 1
+        for file in done:
+            try:
+                file.unlink()
+            except FileNotFoundError:
+                pass
+        return count
+
+
+def legacy_log_files(directory: pathlib.Path) -> List[pathlib.Path]:
+    """List log files of the old one file per entry layout"""
+    if not directory.is_dir():
+        return []
+    return [pathlib.Path(e.path) for e in os.scandir(directory)
+            if e.is_file() and not e.name.startswith(LOG_DB_NAME) and not e.name.startswith('.')]
+
+
 class CommandLogBase:
     """Command log reader/writer base class"""
     def __init__(self, log_directory: Optional[pathlib.Path] = None):
@@ -119,8 +333,12 @@ class CommandLogBase:
             with open(pathlib.Path.home() / '.cincan/uid.txt', "w") as uid_file:
                 uid_file.write(self.directoryname)
 
-        self.log_directory = log_directory or pathlib.Path.home() / '.cincan' / 'shared' / self.directoryname /'logs'
+        # logs of all users are in own sub directories of the shared directory
+        self.shared_directory = None if log_directory else pathlib.Path.home() / '.cincan' / 'shared'
+        self.log_directory = log_directory or self.shared_directory / self.directoryname / 'logs'
         self.log_directory.mkdir(parents=True, exist_ok=True)
+        self.store = CommandLogStore(self.log_directory / LOG_DB_NAME)
+        self.store.migrate(self.log_directory)
 
 
 class CommandLogWriter(CommandLogBase):
@@ -129,37 +347,77 @@ class CommandLogWriter(CommandLogBase):
         super().__init__(log_directory)
 
     def write(self, log: CommandLog):
-        log_file = self.__log_file()
-        while log_file.exists():
-            log_file = self.__log_file()
-        with log_file.open("w") as f:
-            json.dump(log.to_json(), f)
-
-    def __log_file(self) -> pathlib.Path:
-        return self.log_directory / datetime.now().strftime(self.file_name_format)
+        self.store.append(log)
 
 
 class CommandLogIndex(CommandLogBase):
     """Command log index for reading command log"""
     def __init__(self, log_directory: Optional[pathlib.Path] = None):
         super().__init__(log_directory)
-        log_root = self.log_directory.parent or self.log_directory  # read log from all users
-        self.array = self.__read_log(log_root)
+        self.stores = [self.store]
+        self.legacy_files: List[pathlib.Path] = []
+        if self.shared_directory:
+            # read log from all users
+            for user_dir in sorted(self.shared_directory.iterdir()):
+                directory = user_dir / 'logs'
+                if directory == self.log_directory or not directory.is_dir():
+                    continue
+                if (directory / LOG_DB_NAME).is_file():
+                    try:
+                        self.stores.append(CommandLogStore(directory / LOG_DB_NAME, read_only=True))
+                    except sqlite3.Error as e:
+                        logging.getLogger('log').warning(f"{directory / LOG_DB_NAME}: cannot read log: {e}")
+                # not migrated by the user yet
+                self.legacy_files.extend(legacy_log_files(directory))
+
+        self.__legacy_entries: Optional[List[CommandLog]] = None
+
+    def __legacy(self) -> List[CommandLog]:
+        """Entries not yet migrated into databases, newest first"""
+        if self.__legacy_entries is None:
+            self.__legacy_entries = []
+            for file in self.legacy_files:
+                try:
+                    with file.open('r') as f:
+                        js = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    continue  # migrated meanwhile or not a log entry
+                if not isinstance(js, dict) or 'timestamp' not in js:
+                    continue
+                self.__legacy_entries.append(CommandLog.from_json(js))
+            self.__legacy_entries.sort(key=lambda e: e.timestamp, reverse=True)
+        return self.__legacy_entries
 
     def list_entries(self, reverse: bool = False) -> Iterable[CommandLog]:
-        return sorted(self.array, key=lambda e: e.timestamp, reverse=reverse)
-
-    def __read_log(self, directory: pathlib.Path) -> List[CommandLog]:
-        log_l = []
-        for file in self.log_directory.iterdir():
-            if file.is_dir():
-                # recursively go to sub d
-                log_l.extend(self.__read_log(file))
-            else:
-                with file.open('r') as f:
-                    js = json.load(f)
-                    log_l.append(CommandLog.from_json(js))
-        return log_l
+        """Iterate entries of all users in time order"""
+        legacy = self.__legacy() if reverse else list(reversed(self.__legacy()))
+        return heapq.merge(legacy, *[s.entries(reverse) for s in self.stores],
+                           key=lambda e: e.timestamp, reverse=reverse)
+
+    def producers_of(self, digest: str) -> Iterable[CommandLog]:
+        """Commands which have output the file with the digest, newest first"""
+        return self.__with_file(digest, output=True)
+
+    def consumers_of(self, digest: str) -> Iterable[CommandLog]:
+        """Commands which have read the file with the digest, newest first"""
+        return self.__with_file(digest, output=False)
+
+    def referenced_digests(self) -> Set[str]:
+        """Digests of all files in the logs of all users"""
+        digests = set()
+        for store in self.stores:
+            digests.update(store.digests())
+        for entry in self.__legacy():
+            digests.update(f.digest for f in entry.in_files + entry.out_files if f.digest)
+        return digests
+
+    def __with_file(self, digest: str, output: bool) -> Iterable[CommandLog]:
+        if not digest:
+            return []  # directories and missing files have no digest
+        legacy = [e for e in self.__legacy()
+                  if any(f.digest == digest for f in (e.out_files if output else e.in_files))]
+        return heapq.merge(legacy, *[s.with_file(digest, output) for s in self.stores],
+                           key=lambda e: e.timestamp, reverse=True)
 
 
 class CommandRunner:
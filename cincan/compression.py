@@ -0,0 +1,214 @@
+import bz2
+import concurrent.futures
+import gzip
+import lzma
+import os
+import time
+import urllib.parse
+import zlib
+from collections import deque
+from typing import BinaryIO, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+# compressions by file name suffixes, and by magic bytes in the beginning of the data
+SUFFIXES = {'.gz': 'gz', '.tgz': 'gz', '.bz2': 'bz2', '.tbz': 'bz2', '.tbz2': 'bz2', '.xz': 'xz', '.txz': 'xz'}
+MAGIC = {b'\x1f\x8b': 'gz', b'BZh': 'bz2', b'\xfd7zXZ\x00': 'xz'}
+
+# compress a block of data into a complete stream, concatenated streams are valid data for each format
+COMPRESSORS: Dict[str, Callable[[bytes, int], bytes]] = {
+    'gz': lambda data, level: gzip.compress(data, compresslevel=level, mtime=0),
+    'bz2': lambda data, level: bz2.compress(data, compresslevel=level),
+    'xz': lambda data, level: lzma.compress(data, preset=level),
+}
+DEFAULT_LEVELS = {'gz': 6, 'bz2': 9, 'xz': 6}
+# block sizes, large enough not to weaken the compression much
+BLOCK_SIZES = {'gz': 1024 * 1024, 'bz2': 900 * 1000, 'xz': 8 * 1024 * 1024}
+
+
+def compression_by_name(name: str) -> Optional[str]:
+    """Compression of an archive by the file name, None if not compressed"""
+    return SUFFIXES.get(os.path.splitext(name)[1].lower())
+
+
+def compression_by_magic(head: bytes) -> Optional[str]:
+    """Compression by the first bytes of data, None if not compressed"""
+    return next((c for m, c in MAGIC.items() if head.startswith(m)), None)
+
+
+def thread_cpu_time() -> float:
+    """CPU time of the calling thread in seconds, zero where the thread clock is not available"""
+    if not hasattr(time, 'CLOCK_THREAD_CPUTIME_ID'):
+        return 0.0
+    return time.clock_gettime(time.CLOCK_THREAD_CPUTIME_ID)
+
+
+class ParallelCompressor:
+    """
+    Compress written data in parallel blocks, pigz-style, into a file.
+    Each block is compressed into a stream of its own, the blocks are written in order.
+    """
+
+    def __init__(self, file: BinaryIO, compression: str, jobs: Optional[int] = None, level: Optional[int] = None):
+        self.file = file
+        self.compression = compression
+        self.level = DEFAULT_LEVELS[compression] if level is None else level
+        self.block_size = BLOCK_SIZES[compression]
+        self.jobs = jobs or os.cpu_count() or 1
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.jobs, thread_name_prefix='compress')
+        self.pending: Deque[concurrent.futures.Future] = deque()
+        self.buffer = bytearray()
+        self.in_bytes = 0
+        self.out_bytes = 0
+        self.cpu_seconds = 0.0  # spent in compressing, by all worker threads
+
+    def write(self, data: bytes) -> int:
+        view = memoryview(data)
+        while len(self.buffer) + len(view) >= self.block_size:
+            take = self.block_size - len(self.buffer)
+            self.buffer += view[:take]
+            self.__submit(bytes(self.buffer))
+            self.buffer.clear()
+            view = view[take:]
+        self.buffer += view
+        return len(data)
+
+    def close(self):
+        """Compress and write the remaining data, the file is not closed"""
+        try:
+            if self.buffer or not self.in_bytes:
+                self.__submit(bytes(self.buffer))  # empty data is compressed to a valid empty stream
+                self.buffer.clear()
+            while self.pending:
+                self.__write_next()
+            self.file.flush()
+        finally:
+            self.executor.shutdown()
+
+    def __submit(self, block: bytes):
+        self.in_bytes += len(block)
+        self.pending.append(self.executor.submit(self.__compress, block))
+        while len(self.pending) > 2 * self.jobs:
+            self.__write_next()  # limit the memory use
+
+    def __compress(self, block: bytes) -> Tuple[bytes, float]:
+        start = thread_cpu_time()
+        data = COMPRESSORS[self.compression](block, self.level)
+        return data, thread_cpu_time() - start
+
+    def __write_next(self):
+        data, cpu_seconds = self.pending.popleft().result()
+        self.cpu_seconds += cpu_seconds
+        self.out_bytes += len(data)
+        self.file.write(data)
+
+
+DECOMPRESSORS = {
+    'gz': lambda: zlib.decompressobj(wbits=31),
+    'bz2': bz2.BZ2Decompressor,
+    'xz': lzma.LZMADecompressor,
+}
+
+
+class DecompressReader:
+    """
+    Read decompressed data from a file, compression detected by the magic bytes.
+    Unlike the stream modes of 'tarfile', concatenated compressed streams are read, too.
+    """
+
+    def __init__(self, file: BinaryIO, chunk_size: int = 16 * 1024):
+        self.file = file
+        self.chunk_size = chunk_size  # of compressed data, decompressed chunk may be much larger
+        self.input = file.read(chunk_size)
+        self.compression = compression_by_magic(self.input)
+        self.decompressor = DECOMPRESSORS[self.compression]() if self.compression else None
+        self.buffer = b''
+        self.offset = 0
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        while size != 0:
+            if self.offset >= len(self.buffer):
+                data = self.__decompress()
+                if data is None:
+                    break  # end of data
+                self.buffer, self.offset = data, 0
+            end = len(self.buffer) if size < 0 else min(len(self.buffer), self.offset + size)
+            parts.append(self.buffer[self.offset:end])
+            if size > 0:
+                size -= end - self.offset
+            self.offset = end
+        return b''.join(parts)
+
+    def __decompress(self) -> Optional[bytes]:
+        """Next decompressed data, None at the end"""
+        if not self.input:
+            self.input = self.file.read(self.chunk_size)
+            if not self.input:
+                if self.decompressor and not self.decompressor.eof:
+                    raise EOFError("compressed data ended before the end-of-stream marker")
+                return None
+        if not self.decompressor:
+            data, self.input = self.input, b''
+            return data
+        if self.decompressor.eof:
+            # next concatenated stream
+            self.decompressor = DECOMPRESSORS[self.compression]()
+        data = self.decompressor.decompress(self.input)
+        self.input = self.decompressor.unused_data
+        return data
+
+
+class _Chunks:
+    """Collect written data as chunks"""
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> List[bytes]:
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def compress_stream(read: Callable[[int], bytes], compressor_for: Callable[[BinaryIO], ParallelCompressor],
+                    chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Compress data from 'read' into chunks as they get ready, e.g. for a streaming request body"""
+    sink = _Chunks()
+    compressor = compressor_for(sink)
+    try:
+        for data in iter(lambda: read(chunk_size), b''):
+            compressor.write(data)
+            yield from sink.take()
+    finally:
+        compressor.close()
+    yield from sink.take()
+
+
+def is_remote_engine(base_url: str) -> bool:
+    """Is the Docker Engine behind the API base URL on another host, e.g. over TCP or SSH?"""
+    url = urllib.parse.urlsplit(base_url)
+    if url.scheme == 'http+docker':
+        return url.hostname == 'ssh'  # otherwise local unix socket or named pipe
+    return url.hostname not in {'localhost', '127.0.0.1', '::1'}
+
+
+def sample_ratio(file: BinaryIO, start: int, length: int, samples: int = 16, window: int = 256 * 1024) -> float:
+    """
+    Estimate compression ratio (compressed / original) of file data by fast compression of sample windows.
+    The windows are spread over the data, so that e.g. a compressed file in the beginning does not decide it all.
+    """
+    step = max(window, length // samples)
+    original = compressed = 0
+    try:
+        for offset in range(start, start + length, step):
+            file.seek(offset)
+            data = file.read(window)
+            original += len(data)
+            compressed += len(zlib.compress(data, 1))
+    finally:
+        file.seek(start)
+    return compressed / original if original else 1.0
@@ -1,14 +1,16 @@
 import json
 import pathlib
+from typing import Optional
 
 
 class Configuration:
     """Configuration options"""
 
-    def __init__(self, file: pathlib.Path = pathlib.Path.home() / '.cincan' / 'config.json'):
-        self.file = file
+    def __init__(self, file: Optional[pathlib.Path] = None):
+        # home resolved on use, not on import
+        self.file = file or pathlib.Path.home() / '.cincan' / 'config.json'
         if self.file.is_file():
-            with file.open() as f:
+            with self.file.open() as f:
                 self.values = json.load(f)
         else:
             self.values = {}
@@ -16,6 +18,25 @@ class Configuration:
         self.default_stable_tag = self.values.get("stable_tag", "latest")
         self.default_dev_tag = self.values.get("dev_tag", "dev")
         self.default_shells = self.values.get("shells", ["/bin/bash", "/bin/sh"])
+        self.cache_directory = pathlib.Path(
+            self.values.get("cache_directory", pathlib.Path.home() / '.cincan' / 'cache')).expanduser()
+        self.tag_cache_ttl = float(self.values.get("tag_cache_ttl", 24 * 60 * 60))  # seconds
+        self.manifest_cache_ttl = float(self.values.get("manifest_cache_ttl", 60 * 60))  # seconds
+        self.output_store = self.values.get("output_store", False)
+        self.output_store_links = self.values.get("output_store_links", False)  # hard link when no reflink
+        self.store_directory = pathlib.Path(
+            self.values.get("store_directory", pathlib.Path.home() / '.cincan' / 'store')).expanduser()
+        self.memoize = self.values.get("memoize", False)
+        self.pull_jobs = int(self.values.get("pull_jobs", 4))  # concurrent pulls of 'cincan pull'
+        self.background_cleanup = self.values.get("background_cleanup", True)
+        self.upload_compression = self.values.get("upload_compression", "auto")  # auto, always or never
+        # Docker endpoints for 'cincan batch', by default the one in the environment
+        self.endpoints = self.values.get("endpoints", [{"name": "default"}])
+        self.placement = self.values.get("placement", True)  # place batch runs on CPUs and memory of this host
+        # with --harvest, output files not changed for the grace period are downloaded while the tool runs
+        self.harvest_interval = float(self.values.get("harvest_interval", 5))  # seconds between polls
+        self.harvest_grace = float(self.values.get("harvest_grace", 10))  # seconds
+        self.run_cache_size = int(self.values.get("run_cache_size", 1024)) * 1024 * 1024  # configured in MB
 
     def is_command_log(self) -> bool:
         return self.values.get('command_log', False)
@@ -1,8 +1,11 @@
+import os
 import pathlib
 import re
+import stat
 from typing import List, Optional, Dict, Set, Tuple, Iterable
 import shlex
 
+
 class FileMatcher:
     """Match files based on a pattern"""
     def __init__(self, match_string: str, include: bool):
@@ -26,6 +29,16 @@ class FileMatcher:
         """Filter uploaded files by this pattern"""
         return list(filter(lambda f: self.__match(f.as_posix()) == self.include, files))
 
+    def may_match_under(self, directory: str) -> bool:
+        """Can any file under the directory pass this pattern? If not, the directory need not be walked"""
+        if self.include:
+            # the literal part before the first '*' must be compatible with the directory path
+            prefix = self.match_string.split('*', 1)[0]
+            dir_prefix = directory + '/'
+            return prefix.startswith(dir_prefix) or dir_prefix.startswith(prefix)
+        # excluding pattern ending with '*' excludes whole sub tree of an excluded directory
+        return not (self.match_string.endswith('*') and self.__match(directory))
+
     def filter_download_files(self, files: List[str], work_dir: str) -> List[str]:
         """Filter downloaded files by this pattern"""
         if self.absolute_path:
@@ -78,19 +91,70 @@ class FileMatcher:
         return True
 
 
+class StatSnapshot:
+    """Status of host files for a single run, each file is stat'ed and resolved at most once"""
+    def __init__(self):
+        self.__entries: Dict[pathlib.Path, os.DirEntry] = {}
+        self.__stats: Dict[pathlib.Path, Optional[os.stat_result]] = {}
+        self.__resolved: Dict[pathlib.Path, pathlib.Path] = {}
+
+    def add_entry(self, path: pathlib.Path, entry: os.DirEntry):
+        """Add directory entry from os.scandir, its status is read only when required"""
+        self.__entries[path] = entry
+
+    def stat(self, path: pathlib.Path) -> Optional[os.stat_result]:
+        """Get file status, following symbolic links. None if file does not exist"""
+        if path in self.__stats:
+            return self.__stats[path]
+        entry = self.__entries.get(path)
+        try:
+            st = entry.stat() if entry else os.stat(path)
+        except (OSError, ValueError):
+            st = None
+        self.__stats[path] = st
+        return st
+
+    def exists(self, path: pathlib.Path) -> bool:
+        return self.stat(path) is not None
+
+    def is_dir(self, path: pathlib.Path) -> bool:
+        st = self.stat(path)
+        return st is not None and stat.S_ISDIR(st.st_mode)
+
+    def is_file(self, path: pathlib.Path) -> bool:
+        st = self.stat(path)
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    def resolve(self, path: pathlib.Path) -> pathlib.Path:
+        """Resolve absolute path, directory entries which are not links are resolved by their parent"""
+        r = self.__resolved.get(path)
+        if r is None:
+            entry = self.__entries.get(path)
+            if entry is not None and not entry.is_symlink():
+                r = self.resolve(path.parent) / path.name
+            else:
+                r = path.resolve()
+            self.__resolved[path] = r
+        return r
+
+
 class FileResolver:
     """Resolve files from command line arguments"""
     def __init__(self, args: List[str], directory: pathlib.Path, output_dirs: List[str] = None,
-                 do_resolve: bool = True, input_filters: List[FileMatcher] = None):
+                 do_resolve: bool = True, input_filters: List[FileMatcher] = None,
+                 stats: Optional[StatSnapshot] = None):
         self.original_args = args
         self.directory = directory
+        self.stats = stats or StatSnapshot()
         self.host_files: List[pathlib.Path] = []
+        self.host_file_set: Set[pathlib.Path] = set()  # for fast membership checks of host_files
+        self.input_filters = input_filters or []
         self.command_args = args.copy()
         # Additional punctuation chars, whereas we might split command (On top of shlex basic)
         self.additional_punc_chars = "=,"
         # these are output directories, upload them without contents
         for dir in output_dirs or []:
-            self.host_files.append(pathlib.Path(dir))
+            self.__add_host_file(pathlib.Path(dir))
         self.output_dirs = set([pathlib.Path(d) for d in (output_dirs or [])])
 
         if do_resolve:
@@ -98,8 +162,13 @@ class FileResolver:
             self.__analyze()
 
             # exclude files by filters, perhaps?
-            for filth in input_filters or []:
+            for filth in self.input_filters:
                 self.host_files = filth.filter_upload_files(self.host_files)
+            self.host_file_set = set(self.host_files)
+
+    def __add_host_file(self, file: pathlib.Path):
+        self.host_files.append(file)
+        self.host_file_set.add(file)
 
     def __file_exists(self, path: str, already_listed: Set[pathlib.Path], parent_check: bool = True) -> Optional[str]:
         """
@@ -113,7 +182,7 @@ class FileResolver:
         """
         o_file = pathlib.Path(path)
         # does file/dir exists? No attempt to copy '/', leave it as it is...
-        file_exists = o_file.exists() and not all([c == '/' for c in path])
+        file_exists = self.stats.exists(o_file) and not all([c == '/' for c in path])
 
         # When filename contains potentially spaces, were are only interested about absolute path
         # Not checking parents
@@ -123,14 +192,14 @@ class FileResolver:
             # the file does not exist, but it is relative path to a file/directory...
             o_parent = o_file.parent
             while not file_exists and o_parent and o_parent.as_posix() != '.':
-                if o_parent.is_dir() and o_parent not in self.host_files:
+                if self.stats.is_dir(o_parent) and o_parent not in self.host_file_set:
                     file_exists = True  # ...and there is existing parent directory, perhaps for output
                 o_parent = o_parent.parent
 
         if file_exists:
             h_file, a_name = self.__archive_name_for(o_file)
             if h_file not in already_listed:
-                self.host_files.append(h_file)
+                self.__add_host_file(h_file)
                 already_listed.add(h_file)
             # '/' in the end gets eaten away... fix
             for p in range(len(path) - 1, 0, -1):
@@ -138,9 +207,9 @@ class FileResolver:
                     break
                 a_name += '/'
 
-        if file_exists and o_file.is_dir() and o_file not in self.output_dirs:
+        if file_exists and self.stats.is_dir(o_file) and o_file not in self.output_dirs:
             # include files in sub directories
-            self.__include_sub_dirs(o_file.iterdir(), already_listed)
+            self.__include_sub_dirs(o_file, already_listed)
         if file_exists:
             return a_name
         else:
@@ -169,14 +238,26 @@ class FileResolver:
                 o_arg = o_arg.replace(m_part, m_name)
             self.command_args.append(o_arg)
 
-    def __include_sub_dirs(self, files: Iterable[pathlib.Path], file_set: Set[pathlib.Path]):
-        """Include files from sub directories"""
-        for f in files:
-            if f not in file_set:
-                self.host_files.append(f)
-                file_set.add(f)
-            if f.is_dir():
-                self.__include_sub_dirs(f.iterdir(), file_set)
+    def __include_sub_dirs(self, directory: pathlib.Path, file_set: Set[pathlib.Path]):
+        """Include files from sub directories, do not descend where input filters would remove everything"""
+        stack = [os.scandir(directory)]
+        try:
+            while stack:
+                entry = next(stack[-1], None)
+                if entry is None:
+                    stack.pop().close()
+                    continue
+                f = pathlib.Path(entry.path)
+                self.stats.add_entry(f, entry)
+                if f not in file_set:
+                    self.__add_host_file(f)
+                    file_set.add(f)
+                # file type from the directory entry, no need for separate stat
+                if entry.is_dir() and all(m.may_match_under(f.as_posix()) for m in self.input_filters):
+                    stack.append(os.scandir(f))
+        finally:
+            for it in stack:
+                it.close()
 
     def resolve_upload_files(self, upload_files: Dict[pathlib.Path, str]):
         """Resolve the files to upload"""
@@ -193,7 +274,7 @@ class FileResolver:
 
         # filter out files which do not exist nor should exists
         for file in it_files:
-            if file.exists() or file in self.output_dirs:
+            if self.stats.exists(file) or file in self.output_dirs:
                 res.append(file)
 
         if files is None:
@@ -203,21 +284,20 @@ class FileResolver:
                 all_dirs.add(file)
                 for p in file.parents:
                     all_dirs.add(p)
-            for file in filter(lambda f: not f.exists(), it_files):
+            for file in filter(lambda f: not self.stats.exists(f), it_files):
                 # file not exists, but marked for upload - must mean some sub directory for output
                 p = file.parent
-                while not p.exists():
+                while not self.stats.exists(p):
                     p = p.parent
                 if p not in all_dirs:
                     res.append(p)
         return res
 
-    @classmethod
-    def __archive_name_for(cls, file: pathlib.Path) -> Tuple[pathlib.Path, str]:
+    def __archive_name_for(self, file: pathlib.Path) -> Tuple[pathlib.Path, str]:
         """Resolve host file and archive name for uploaded file"""
-        if cls.__use_absolute_path(file):
-            h_file = file.resolve()
-            a_file = file.resolve().as_posix()
+        if self.__use_absolute_path(file):
+            h_file = self.stats.resolve(file)
+            a_file = h_file.as_posix()
             a_file = a_file[1:] if a_file.startswith('/') else a_file
         else:
             h_file = file
@@ -1,6 +1,8 @@
 import argparse
+import asyncio
 import hashlib
 import io
+import json
 import re
 import logging
 import os
@@ -9,40 +11,77 @@ import select
 import socket
 import struct
 import sys
+import tempfile
 import tty
 import termios
+import threading
 from datetime import datetime
-from typing import List, Set, Dict, Optional, Tuple, IO, Union
+from typing import Any, List, Set, Dict, Optional, Tuple, IO, Union
 import pkg_resources
 import docker
 import docker.errors
 from cincanregistry import list_handler, create_list_argparse, ToolRegistry, Remotes
 from cincanregistry.utils import parse_file_time, format_time
-from cincan.command_log import CommandLog, FileLog, CommandLogWriter, CommandRunner, quote_args
+from cincan.batch import BatchRunner, ping_endpoint, read_commands
+from cincan.blob_store import BlobStore
+from cincan.cache import JsonCache
+from cincan.command_inspector import CommandInspector
+from cincan.compression import is_remote_engine
+from cincan.command_log import CommandLog, FileLog, CommandLogWriter, CommandLogIndex, CommandRunner, quote_args, \
+    read_with_hash
 from cincan.configuration import Configuration
 from cincan.container_check import ContainerCheck
-from cincan.file_tool import FileResolver, FileMatcher
-from cincan.tar_tool import TarTool
+from cincan.file_tool import FileResolver, FileMatcher, StatSnapshot
+from cincan.tar_tool import Harvester, TarTool, path_stat
+from cincan.timings import Timings
 from cincan.image_fetcher import ImageFetcher
+from cincan.manifest_cache import ManifestCache
+from cincan.output_sink import OutputSink
+from cincan.progress import Progress
+from cincan.reaper import ContainerReaper, CONTAINER_LABEL, OWNER_LABEL
+from cincan.resources import Footprint, FootprintHistory, FootprintSampler, ResourcePool
+from cincan.run_cache import RunCache
+from cincan.scheduler import Endpoint, Scheduler
 from docker.utils import kwargs_from_env
 from cincan.version_handler import VersionHandler
 
 BUFFER_SIZE = 1024 * 1024  # Bytes
 CONTAINER_KILL_TIMEOUT = 30  # In seconds
+# tool database of cincanregistry is created on first use, which fails when tools of a batch do it concurrently
+REGISTRY_LOCK = threading.Lock()
+
+
+def is_cpuset_rejected(error: docker.errors.APIError) -> bool:
+    """Is container creation rejected for CPUs not available to the engine"""
+    explanation = str(error.explanation or '')
+    return error.status_code == 400 and ('cpuset' in explanation.lower() or 'Requested CPUs' in explanation)
+
+
+def default_registry_image(registry: ToolRegistry, image: str) -> str:
+    """Docker Hub image of a cincan tool in the default registry, when the default is not Docker Hub"""
+    prefix = registry.remote_registry.full_prefix
+    if registry.default_remote != Remotes.DOCKERHUB and image.startswith('cincan/') \
+            and not image.startswith(f"{prefix}/"):
+        return f"{prefix}/{os.path.basename(image)}"
+    return image
 
 
 class ToolStream:
     """Handle stream to or from the container"""
 
-    def __init__(self, stream: IO):
+    def __init__(self, stream: IO, copy_to: Optional[IO[bytes]] = None, sink: Optional[OutputSink] = None):
         self.data_length = 0
         self.hash = hashlib.sha256()
         self.raw = bytearray()  # when collected
         self.stream = stream
+        self.copy_to = copy_to  # when memoizing the run
+        self.sink = sink  # output written into the stream
 
     def update(self, data: bytes):
         self.data_length += len(data)
         self.hash.update(data)
+        if self.copy_to:
+            self.copy_to.write(data)
 
 
 class ToolImage(CommandRunner):
@@ -53,21 +92,30 @@ class ToolImage(CommandRunner):
                  pull: bool = False,
                  tag: Optional[str] = None,
                  rm: bool = True,
-                 batch: bool = False):
+                 batch: bool = False,
+                 docker_host: Optional[str] = None,
+                 client: Optional[docker.DockerClient] = None):
         self.config = Configuration()
-        self.registry = ToolRegistry()
+        self.timings = Timings()  # of the next run, includes image look-up for the first run
+        with REGISTRY_LOCK:
+            self.registry = ToolRegistry()
+        self.image_cache = JsonCache(self.config.cache_directory / 'images')  # image metadata by image id
         # Init logger, check naming convention of "name" and "image"
         self.logger = logging.getLogger(image)
         name, image = self.namespace_conversion(name, image)
         # Later versions of Docker API attempt fetch version from server automatically
+        self.docker_host = docker_host  # None for the one in the environment
         try:
-            self.client = docker.from_env()
+            # client given when connected already, e.g. by a batch which handles the failure to connect
+            self.client = client or (docker.DockerClient(base_url=docker_host) if docker_host else docker.from_env())
         except docker.errors.DockerException:
             self.logger.error("Failed to connect to Docker Server. Is it running and with proper permissions?")
             sys.exit(1)
         try:
             # Attempt to configure automatically
             kwargs = kwargs_from_env()
+            if docker_host:
+                kwargs['base_url'] = docker_host
             self.low_level_client = docker.APIClient(version="auto", **kwargs)
         except:
             self.logger.warning(
@@ -77,10 +125,11 @@ class ToolImage(CommandRunner):
         self.batch = batch  # Use batch to disable some properties when running inside script or other automation
         if path is not None:
             self.name = name or path
-            if tag is not None:
-                self.image, log = self.client.images.build(path=path, tag=tag, rm=rm)
-            else:
-                self.image, log = self.client.images.build(path=path, rm=rm)
+            with self.timings.phase('image_lookup'):
+                if tag is not None:
+                    self.image, log = self.client.images.build(path=path, tag=tag, rm=rm)
+                else:
+                    self.image, log = self.client.images.build(path=path, rm=rm)
             self.context = path
             self.__log_dict_values(log)
         elif image is not None:
@@ -88,7 +137,8 @@ class ToolImage(CommandRunner):
             self.loaded_image = True
             fetcher = ImageFetcher(self.config, self.registry, self.client, self.low_level_client, self.logger,
                                    self.batch)
-            self.image = fetcher.get_image(image, pull)
+            with self.timings.phase('image_lookup'):
+                self.image = fetcher.get_image(image, pull)
             self.context = '.'  # not really correct, but will do
         else:
             sys.exit("No file nor image specified")
@@ -97,7 +147,8 @@ class ToolImage(CommandRunner):
         if self.config.show_updates:
             # Only check versions if not defined to run inside script or logging level is low
             if not self.batch and self.logger.getEffectiveLevel() < logging.WARNING:
-                self.version_handler.compare_versions()
+                with self.timings.phase('version_check'):
+                    self.version_handler.compare_versions()
         self.input_tar: Optional[str] = None  # use '-' for stdin
         self.input_filters: Optional[List[FileMatcher]] = None
         self.output_tar: Optional[str] = None  # use '-' for stdout
@@ -115,9 +166,19 @@ class ToolImage(CommandRunner):
         self.cap_add: List[str] = []  # docker run --cap-add=<value>
         self.cap_drop: List[str] = []  # docker run --cap-drop=<value>
         self.runtime: Optional[str] = None  # docker run --runtime=<value>
+        self.resources: Dict[str, Any] = {}  # e.g. cpuset_cpus, nano_cpus and mem_limit of the container
+        self.sample_footprint: bool = False  # observe CPU and memory use of the run?
+        self.footprint: Optional[Footprint] = None  # observed by the last run
 
         self.is_tty: bool = False
         self.read_stdin: bool = False
+        self.memoize: bool = False  # restore results of an identical earlier run, if any
+        self.harvest: bool = False  # download output files while the tool runs
+        self.__run_cache: Optional[RunCache] = None
+        self.background_cleanup: bool = self.config.background_cleanup  # remove containers by a detached helper?
+        # compress uploads which compress well, 'auto' when the engine is remote
+        self.compress_upload: bool = self.config.upload_compression == 'always' or (
+            self.config.upload_compression == 'auto' and is_remote_engine(self.client.api.base_url))
 
         # Shell subcommand specific
         self.shell: str = ""
@@ -145,11 +206,10 @@ class ToolImage(CommandRunner):
             # Default is other than Docker Hub
             if image and not image.startswith(f"{self.registry.remote_registry.full_prefix}/"):
                 if image.startswith('cincan/'):
-                    tool_basename = os.path.basename(image)
                     # Convert Docker Hub cincan image to point to default registry
-                    image = f"{self.registry.remote_registry.full_prefix}/{tool_basename}"
+                    image = default_registry_image(self.registry, image)
                     if name and name.startswith('cincan/'):
-                        name = f"{self.registry.remote_registry.full_prefix}/{tool_basename}"
+                        name = default_registry_image(self.registry, name)
                         self.logger = logging.getLogger(name)
                     self.logger.debug(f"We are migrating away from Docker Hub - using "
                                       f"{self.registry.remote_registry.registry_name} as default.")
@@ -169,7 +229,7 @@ class ToolImage(CommandRunner):
         return parse_file_time(self.image.attrs['Created'])
 
     def _detect_shell(self) -> str:
-
+        """Find the first available shell, results are cached per image"""
         provided = False
         if not isinstance(self.config.default_shells, List):
             self.logger.warning("'shells' attribute value type must be list of strings")
@@ -177,40 +237,41 @@ class ToolImage(CommandRunner):
         if self.shell not in self.config.default_shells:
             self.config.default_shells.insert(0, self.shell)
             provided = True
-        for shell in self.config.default_shells:
-            try:
-                container = self.client.containers.create(self.image)
-                _, stat = container.get_archive(shell)
-                # Currently need to loop through stream on Unix socket, otherwise next connection gets stuck
-                for i in _:
-                    pass
-                self.logger.debug(f"Shell found with info: {stat}")
-                container.remove(force=True)
-            except docker.errors.NotFound:
+        image_meta = self.image_cache.get(self.get_id()) or {}
+        known_shells: Dict[str, bool] = image_meta.get('shells', {})  # path -> exists in the image
+        probe_container = None
+        try:
+            for shell in self.config.default_shells:
+                if shell not in known_shells:
+                    if probe_container is None:
+                        # single container to look into the image file system, never started
+                        probe_container = self.client.containers.create(self.image)
+                    known_shells[shell] = self.__path_exists(probe_container, shell)
+                if known_shells[shell]:
+                    return shell
                 if provided:
                     # First item in the list should be user supplied
                     self.logger.warning(f"User supplied shell path not found. Attempting others instead.")
                     provided = False
                     continue
                 self.logger.debug(f"Shell {shell} not found from the container.")
-                continue
-            return shell
+        finally:
+            if probe_container is not None:
+                probe_container.remove(force=True)
+                image_meta['shells'] = known_shells
+                self.image_cache.put(self.get_id(), image_meta)
         return ""
 
-    def __create_container(self, upload_files: Dict[pathlib.Path, str], input_files: List[FileLog], command: List[str]):
-        """Create a container from the image here"""
-
-        if self.network_mode:
-            self.logger.debug(f"option network={self.network_mode}")
-        if self.user:
-            self.logger.debug(f"option user={self.user}")
-        if self.cap_add:
-            self.logger.debug("option cap-add={}".format(",".join(self.cap_add)))
-        if self.cap_drop:
-            self.logger.debug("option cap-drop={}".format(",".join(self.cap_drop)))
-        if self.runtime:
-            self.logger.debug(f"option runtime={self.runtime}")
+    def __path_exists(self, container: docker.models.containers.Container, path: str) -> bool:
+        """Check if path exists in the container, without downloading it"""
+        stat = path_stat(self.client.api, container.id, path)
+        if stat is None:
+            return False
+        self.logger.debug(f"Path {path} found with info: {stat}")
+        return True
 
+    def __command_for(self, command: List[str]) -> Tuple[List[str], List[str]]:
+        """Resolve entrypoint and command for the container"""
         # Opening shell into container with SHELL subcommand.
         if self.shell:
             self.entrypoint = self._detect_shell()
@@ -234,24 +295,53 @@ class ToolImage(CommandRunner):
         else:
             self.logger.warning(f"Positional arguments used only for passing input files with SHELL command.")
             user_cmd = []
-
-        log = CommandLog([self.name] + user_cmd)
-        # Initial container with correct command and configuration
         self.logger.debug(
             f"Entrypoint for the container: {entry_point}, "
             f"default command for container: {cmd}, user supplied command: {command}")
-        self.container = self.client.containers.create(self.image, command=user_cmd, entrypoint=entry_point,
-                                                       network_mode=self.network_mode,
-                                                       detach=False, tty=self.is_tty, stdin_open=self.read_stdin,
-                                                       user=self.user, cap_add=self.cap_add, cap_drop=self.cap_drop,
-                                                       runtime=self.runtime)
-        # kludge, lets show work directory in tests
-        work_dir = self.container.image.attrs['Config'].get('WorkingDir') or '/'
-        if self.entrypoint:
-            self.logger.debug(f"Workdir: {work_dir}")
+        return entry_point, user_cmd
+
+    def __create_container(self, upload_files: Dict[pathlib.Path, str], input_files: List[FileLog],
+                           entry_point: List[str], user_cmd: List[str], stats: StatSnapshot,
+                           digests: Optional[Dict[pathlib.Path, str]] = None):
+        """Create a container from the image here"""
+
+        if self.network_mode:
+            self.logger.debug(f"option network={self.network_mode}")
+        if self.user:
+            self.logger.debug(f"option user={self.user}")
+        if self.cap_add:
+            self.logger.debug("option cap-add={}".format(",".join(self.cap_add)))
+        if self.cap_drop:
+            self.logger.debug("option cap-drop={}".format(",".join(self.cap_drop)))
+        if self.runtime:
+            self.logger.debug(f"option runtime={self.runtime}")
 
+        log = CommandLog([self.name] + user_cmd)
+        # Initial container with correct command and configuration
+        def create():
+            return self.client.containers.create(
+                self.image, command=user_cmd, entrypoint=entry_point, network_mode=self.network_mode,
+                detach=False, tty=self.is_tty, stdin_open=self.read_stdin,
+                user=self.user, cap_add=self.cap_add, cap_drop=self.cap_drop, runtime=self.runtime,
+                labels={CONTAINER_LABEL: self.name, OWNER_LABEL: self.__reaper().owner}, **self.resources)
+
+        with self.timings.phase('create'):
+            try:
+                self.container = create()
+            except docker.errors.APIError as e:
+                if 'cpuset_cpus' not in self.resources or not is_cpuset_rejected(e):
+                    raise
+                # engine in a VM, e.g. of Docker Desktop, does not have the CPUs of this host
+                self.logger.warning(f"CPU placement rejected, running without it: {e.explanation or e}")
+                self.resources = {k: v for k, v in self.resources.items() if k not in {'cpuset_cpus', 'cpuset_mems'}}
+                self.container = create()
         # upload files into freshly created container
-        tar_tool = TarTool(self.logger, self.container, self.upload_stats, explicit_file=self.input_tar)
+        tar_tool = TarTool(self.logger, self.container, self.upload_stats, explicit_file=self.input_tar, stats=stats,
+                           image_cache=self.image_cache, timings=self.timings, progress=self.__progress(),
+                           compress_upload=self.compress_upload, digests=digests)
+        # kludge, lets show work directory in tests
+        if self.entrypoint:
+            self.logger.debug(f"Workdir: {tar_tool.work_dir}")
         tar_tool.upload(upload_files, input_files)
 
         return log
@@ -300,12 +390,16 @@ class ToolImage(CommandRunner):
             buf.extend(r)
         return s_type, buf
 
-    def __container_exec(self, container, log: CommandLog, write_stdout: bool) -> CommandLog:
+    def __container_exec(self, container, log: CommandLog, write_stdout: bool,
+                         stdout_copy: Optional[IO[bytes]] = None, stderr_copy: Optional[IO[bytes]] = None) -> CommandLog:
         """Execute a command in the container"""
 
         stdin_s = ToolStream(sys.stdin) if self.read_stdin else None
-        stdout_s = ToolStream(sys.stdout.buffer) if write_stdout else None
-        stderr_s = ToolStream(sys.stderr.buffer)
+        stdout_s = ToolStream(sys.stdout.buffer, stdout_copy,
+                              OutputSink(sys.stdout.buffer)) if write_stdout else None
+        stderr_s = ToolStream(sys.stderr.buffer, stderr_copy, OutputSink(sys.stderr.buffer))
+        sinks = [s.sink for s in [stdout_s, stderr_s] if s]
+        last_sink: Optional[OutputSink] = None
 
         self.logger.debug(f"exec tty={self.is_tty}")
 
@@ -343,15 +437,20 @@ class ToolImage(CommandRunner):
         c_socket_open = True
         try:
             while c_socket_open:
+                # wake up to write the coalesced output in time
+                timeouts = [t for t in (s.timeout() for s in sinks) if t is not None]
                 try:
                     # FIXME: Using select, which is known not to work with Windows!
-                    select_in, _, _ = select.select(active_streams, [], [])
+                    select_in, _, _ = select.select(active_streams, [], [], min(timeouts) if timeouts else None)
                 except io.UnsupportedOperation as e:
                     if sys.stdin in active_streams:
                         # pytest stdin is somehow fundamentally dysfunctional
                         active_streams.remove(sys.stdin)
                         continue
                     raise e
+                if not select_in:
+                    for sink in sinks:
+                        sink.flush()
 
                 for sel in select_in:
                     if sel == sys.stdin:
@@ -389,11 +488,15 @@ class ToolImage(CommandRunner):
                             if self.buffer_output:
                                 std_s.raw.extend(s_data)
                             else:
-                                std_s.stream.write(s_data)
-                            # Flush data immediately into terminal screen
-                            std_s.stream.flush()
+                                if last_sink and last_sink is not std_s.sink:
+                                    last_sink.flush()  # keep stdout and stderr in order
+                                # written immediately into terminal screen, coalesced into pipe or file
+                                std_s.sink.write(s_data)
+                                last_sink = std_s.sink
 
         finally:
+            for sink in sinks:
+                sink.flush()
             if self.is_tty and self.read_stdin:
                 # Restore old terminal settings, regardless of what happened
                 termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
@@ -404,6 +507,7 @@ class ToolImage(CommandRunner):
             self.logger.error(f"Container exited with error {error_status}")
 
         log.exit_code = result.get('StatusCode', 0)
+        self.timings.add_bytes('exec', sum(s.data_length for s in [stdin_s, stdout_s, stderr_s] if s))
 
         # collect raw data
         if self.buffer_output:
@@ -422,66 +526,240 @@ class ToolImage(CommandRunner):
 
         return log
 
-    def __download_results(self, container: docker.models.containers.Container, log: CommandLog) -> CommandLog:
-        tar_tool = TarTool(self.logger, container, self.upload_stats, explicit_file=self.output_tar)
+    def __progress(self) -> Progress:
+        """Progress of transfers, redrawn on terminal unless in batch, not shown when quiet"""
+        return Progress(tty=sys.stderr.isatty() and not self.batch,
+                        enabled=self.logger.getEffectiveLevel() < logging.WARNING)
+
+    def __output_tar_tool(self, stats: StatSnapshot) -> TarTool:
+        output_store = BlobStore(self.config.store_directory) if self.config.output_store else None
+        return TarTool(self.logger, self.container, self.upload_stats, explicit_file=self.output_tar, stats=stats,
+                       image_cache=self.image_cache, output_store=output_store, timings=self.timings,
+                       progress=self.__progress(), output_links=self.config.output_store_links)
+
+    def __output_selection(self) -> Dict[str, Any]:
+        """Output files to download, as arguments of TarTool.download_files"""
         if self.explicit_output:
             # just use the explicitly given output
-            dn_files = tar_tool.download_files(self.output_filters, self.no_defaults,
-                                               file_paths=self.explicit_output, implicit_output=False)
-        else:
-            # try to implicitly resolve files
-            dn_files = tar_tool.download_files(self.output_filters, self.no_defaults,
-                                               file_paths=self.output_dirs,
-                                               implicit_output=self.implicit_output)
+            return dict(filters=self.output_filters, no_defaults=self.no_defaults,
+                        file_paths=self.explicit_output, implicit_output=False)
+        # try to implicitly resolve files
+        return dict(filters=self.output_filters, no_defaults=self.no_defaults,
+                    file_paths=self.output_dirs, implicit_output=self.implicit_output)
+
+    def __start_harvest(self, stats: StatSnapshot) -> Tuple[Optional[TarTool], Optional[Harvester]]:
+        """Harvest output files while the tool runs, if asked"""
+        if not self.harvest:
+            return None, None
+        if self.output_tar:
+            self.logger.warning("Output files are not harvested with --out, they are downloaded after the run")
+            return None, None
+        tar_tool = self.__output_tar_tool(stats)
+        grace = self.config.harvest_grace
+        selection = self.__output_selection()
+        return tar_tool, Harvester(lambda now: tar_tool.harvest(grace, now, **selection), self.logger,
+                                   self.config.harvest_interval).start()
+
+    def __download_results(self, tar_tool: Optional[TarTool], log: CommandLog, stats: StatSnapshot) -> CommandLog:
+        tar_tool = tar_tool or self.__output_tar_tool(stats)
+        dn_files = tar_tool.download_files(**self.__output_selection())
         log.out_files.extend(dn_files)
         return log
 
+    @property
+    def run_cache(self) -> RunCache:
+        if self.__run_cache is None:
+            self.__run_cache = RunCache(self.config.cache_directory / 'runs', self.config.run_cache_size, self.logger)
+        return self.__run_cache
+
+    def __can_memoize(self) -> bool:
+        """Can results of this run be restored from an earlier run?"""
+        if not self.memoize:
+            return False
+        if self.shell or self.is_tty or self.create_image or self.input_tar or self.output_tar:
+            self.logger.debug("memoizing not supported with shell, tty, image creation, --in or --out")
+            return False
+        return True
+
+    def __spool_stdin(self) -> Tuple[str, int]:
+        """Read stdin into a temporary file for hashing, the file replaces stdin for the container"""
+        with tempfile.TemporaryFile() as spool:
+            digest = read_with_hash(lambda n: os.read(0, n), spool.write)
+            length = spool.tell()
+            spool.seek(0)
+            os.dup2(spool.fileno(), 0)
+        return digest, length
+
+    def __run_key(self, entry_point: List[str], user_cmd: List[str], upload_files: Dict[pathlib.Path, str],
+                  stats: StatSnapshot, in_files: List[FileLog]) -> Optional[str]:
+        """Key for memoized run from image, command, options and digests of the inputs"""
+        inputs = []
+        for h_file, a_name in sorted(upload_files.items()):
+            st = stats.stat(h_file)
+            if st is None:
+                inputs.append([a_name, 'absent'])
+            elif stats.is_dir(h_file):
+                inputs.append([a_name, 'dir'])
+            elif stats.is_file(h_file):
+                with h_file.open('rb') as f:
+                    digest = read_with_hash(f.read)
+                inputs.append([a_name, digest])
+                in_files.append(FileLog(stats.resolve(h_file), digest, datetime.fromtimestamp(st.st_mtime)))
+            else:
+                self.logger.debug(f"cannot memoize run with input {h_file.as_posix()}")
+                return None
+        stdin_digest = ''
+        if self.read_stdin:
+            stdin_digest, stdin_length = self.__spool_stdin()
+            if stdin_length:
+                in_files.append(FileLog(pathlib.Path('/dev/stdin'), stdin_digest))
+        values = {
+            'image': self.get_id(),
+            'entrypoint': entry_point,
+            'command': user_cmd,
+            'inputs': inputs,
+            'stdin': stdin_digest,
+            'options': {
+                'network': self.network_mode, 'user': self.user, 'cap_add': self.cap_add, 'cap_drop': self.cap_drop,
+                'runtime': self.runtime, 'output_dirs': self.output_dirs, 'explicit_output': self.explicit_output,
+                'implicit_output': self.implicit_output, 'no_defaults': self.no_defaults,
+                'output_filters': [[m.match_string, m.include] for m in self.output_filters or []],
+            },
+        }
+        return RunCache.run_key(values)
+
+    def __restore_run(self, result: Dict, user_cmd: List[str], in_files: List[FileLog]) -> CommandLog:
+        """Restore results of a memoized run"""
+        self.logger.info("Identical earlier run found, restoring its results")
+        log = CommandLog([self.name] + user_cmd, datetime.now())
+        log.cached = True
+        log.in_files.extend(in_files)
+        if self.buffer_output:
+            stdout, stderr = io.BytesIO(), io.BytesIO()
+            log = self.run_cache.restore(result, pathlib.Path.cwd(), log, stdout, stderr)
+            log.stdout = stdout.getvalue()
+            log.stderr = stderr.getvalue()
+        else:
+            log = self.run_cache.restore(result, pathlib.Path.cwd(), log, sys.stdout.buffer, sys.stderr.buffer)
+        return log
+
     def __run(self, args: List[str]) -> CommandLog:
+        """Run native tool in container with given arguments, timings start over for the next run"""
+        try:
+            return self.__run_tool(args)
+        finally:
+            self.timings = Timings()
+
+    def __run_tool(self, args: List[str]) -> CommandLog:
         """Run native tool in container with given arguments"""
         # resolve files to upload
-        resolver = FileResolver(args, pathlib.Path.cwd(), do_resolve=not self.input_tar,
-                                output_dirs=self.output_dirs, input_filters=self.input_filters)
-        upload_files = {}
-        cmd_args = resolver.resolve_upload_files(upload_files)
+        with self.timings.phase('file_resolution'):
+            resolver = FileResolver(args, pathlib.Path.cwd(), do_resolve=not self.input_tar,
+                                    output_dirs=self.output_dirs, input_filters=self.input_filters)
+            upload_files = {}
+            cmd_args = resolver.resolve_upload_files(upload_files)
         for h_file, a_name in upload_files.items():
             self.logger.debug(f"{h_file.as_posix()} -> {a_name}")
         self.logger.debug("args: %s", ' '.join(quote_args(cmd_args)))
 
+        entry_point, user_cmd = self.__command_for(cmd_args)
+        run_key = None
+        if self.__can_memoize():
+            memo_in_files = []
+            with self.timings.phase('hashing'):
+                run_key = self.__run_key(entry_point, user_cmd, upload_files, resolver.stats, memo_in_files)
+            result = self.run_cache.lookup(run_key) if run_key else None
+            if result is not None:
+                try:
+                    with self.timings.phase('restore'):
+                        log = self.__restore_run(result, user_cmd, memo_in_files)
+                    return self.__finish_run(upload_files, log)
+                except FileNotFoundError as e:
+                    self.logger.debug(f"failed to restore memoized run, running it: {e}")
+
         in_files = []
-        log = self.__create_container(upload_files, in_files, cmd_args)
+        # inputs hashed for the run key are not hashed again for upload
+        digests = {f.path: f.digest for f in memo_in_files} if run_key else None
+        log = self.__create_container(upload_files, in_files, entry_point, user_cmd, resolver.stats, digests)
+        stdout_copy = tempfile.TemporaryFile() if run_key else None
+        stderr_copy = tempfile.TemporaryFile() if run_key else None
+        exited = False  # container known to have exited, no need to kill it
+        sampler = FootprintSampler(
+            lambda: self.container.stats(stream=True, decode=True)).start() if self.sample_footprint else None
+        tar_tool, harvester = self.__start_harvest(resolver.stats)
         try:
-            log = self.__container_exec(self.container, log, write_stdout=(self.output_tar != '-'))
+            with self.timings.phase('exec'):
+                log = self.__container_exec(self.container, log, write_stdout=(self.output_tar != '-'),
+                                            stdout_copy=stdout_copy, stderr_copy=stderr_copy)
+            exited = True
+            harvester and harvester.stop()
+            self.footprint = sampler and sampler.footprint()
             log.in_files.extend(in_files)
             if log.exit_code == 0:
                 # download results
-                log = self.__download_results(self.container, log)
+                log = self.__download_results(tar_tool, log, resolver.stats)
+                if run_key:
+                    self.run_cache.store(run_key, log, pathlib.Path.cwd(), stdout_copy, stderr_copy)
+            elif harvester and tar_tool.harvested_files():
+                # already written into the work directory, keep them in the log
+                harvested = tar_tool.harvested_files()
+                work_dir = pathlib.Path.cwd()
+                self.logger.warning(f"tool failed, files harvested while it was running are kept: "
+                                    f"{', '.join(sorted(f.path.relative_to(work_dir).as_posix() for f in harvested))}")
+                log.out_files.extend(harvested)
         except KeyboardInterrupt:
             self.logger.info("Keyboard Interrupt detected, download results anyway.")
-            log = self.__download_results(self.container, log)
+            harvester and harvester.stop()
+            log = self.__download_results(tar_tool, log, resolver.stats)
         finally:
-            self.logger.debug("stopping and removing the container")
+            harvester and harvester.stop()
+            stdout_copy and stdout_copy.close()
+            stderr_copy and stderr_copy.close()
+            with self.timings.phase('removal'):
+                self.__remove_container(exited)
+
+        return self.__finish_run(upload_files, log)
+
+    def __reaper(self) -> ContainerReaper:
+        return ContainerReaper.for_host(self.config.cache_directory, self.docker_host)
+
+    def __remove_container(self, exited: bool):
+        """Stop and remove the container, in the background when possible"""
+        if not exited:
+            self.logger.debug("stopping the container")
             try:
                 # Required when interrupting with Ctrl+C
                 self.container.kill()
             except docker.errors.APIError:
                 self.logger.debug("Container was not running anymore. Can't kill.")
-            if self.create_image:
-                self.logger.info("Creating new image from the produced container.")
-                new_image = self.container.commit()
-                # print(new_image.id)
-                self.logger.info(f"Use it with following id. Shorter version can be used.")
-                self.logger.info(f"id: {new_image.id}")
-                self.logger.info(f"e.g. run 'cincan shell {new_image.short_id}' to open shell.")
-            # We have to remove container manually, can't use auto_remove parameter earlier. (need output files)
-            self.container.remove()
-            # if we created the image, lets also remove it (intended for testing)
-            if not self.loaded_image:
-                self.logger.info(f"removing the docker image {self.get_id()}")
-                try:
-                    self.remove_image()
-                except docker.errors.APIError as e:
-                    self.logger.warning(e)
+        if self.create_image:
+            self.logger.info("Creating new image from the produced container.")
+            new_image = self.container.commit()
+            # print(new_image.id)
+            self.logger.info(f"Use it with following id. Shorter version can be used.")
+            self.logger.info(f"id: {new_image.id}")
+            self.logger.info(f"e.g. run 'cincan shell {new_image.short_id}' to open shell.")
+        if self.background_cleanup and self.loaded_image:
+            # We do not wait for removal, it is done by a detached helper after we have returned
+            self.logger.debug("removing the container in the background")
+            try:
+                self.__reaper().defer(self.container.id)
+                return
+            except OSError as e:
+                self.logger.debug(f"failed to start background removal: {e}")
+        self.logger.debug("removing the container")
+        # We have to remove container manually, can't use auto_remove parameter earlier. (need output files)
+        self.container.remove(force=not exited)
+        # if we created the image, lets also remove it (intended for testing)
+        if not self.loaded_image:
+            self.logger.info(f"removing the docker image {self.get_id()}")
+            try:
+                self.remove_image()
+            except docker.errors.APIError as e:
+                self.logger.warning(e)
 
+    def __finish_run(self, upload_files: Dict[pathlib.Path, str], log: CommandLog) -> CommandLog:
+        log.timings = self.timings
         work_dir = pathlib.Path().cwd()
         self.upload_files = sorted([f.as_posix() for f in list(upload_files.keys())])
         self.download_files = sorted(
@@ -494,10 +772,14 @@ class ToolImage(CommandRunner):
         self.buffer_output = False  # we stream it
         return self.__run(args)
 
+    def run_buffered(self, args: List[str]) -> CommandLog:
+        """Run native tool in container, return output in the log"""
+        self.buffer_output = True  # we return it
+        return self.__run(args)
+
     def run_get_string(self, args: List[str]) -> str:
         """Run native tool in container, return output as a string"""
-        self.buffer_output = True  # we return it
-        log = self.__run(args)
+        log = self.run_buffered(args)
         return log.stdout.decode('utf8') + log.stderr.decode('utf8')
 
     def __log_dict_values(self, log: Set[Dict[str, str]]) -> None:
@@ -554,6 +836,10 @@ def image_default_args(sub_parser):
                                 help='Keep STDIN open even if not attached (see docker run --help)')
         sub_parser.add_argument('-t', '--tty', action='store_true',
                                 help='Allocate a pseudo-TTY (see docker run --help)')
+        sub_parser.add_argument('--memoize', action='store_true',
+                                help='Restore results of an identical earlier run instead of running the tool again')
+        sub_parser.add_argument('--harvest', action='store_true',
+                                help='Download output files while the tool runs, once they have stopped changing')
 
 
 def get_version_information():
@@ -585,13 +871,15 @@ def main():
     m_parser.add_argument('--batch', action='store_true', help='Use with automation. Disables some '
                                                                'properties meant for interactive tty device(s): '
                                                                'Version checking disabled, '
-                                                               'pull-progress-bar disabled.')
+                                                               'progress shown as summary lines.')
     m_parser.add_argument('-q', '--quiet', action='store_true', help='Be quite quiet')
     m_parser.add_argument('-v', '--version', action='store_true', help='Shows currently installed version of the tool.')
     subparsers = m_parser.add_subparsers(dest='sub_command')
 
     run_parser = subparsers.add_parser('run')
     image_default_args(run_parser)
+    run_parser.add_argument('--timings', action='store_true',
+                            help="Print time spent and bytes transferred in each phase of the run to stderr")
 
     test_parser = subparsers.add_parser('test')
     image_default_args(test_parser)
@@ -605,6 +893,26 @@ def main():
     list_parser = create_list_argparse(subparsers)
     mani_parser = subparsers.add_parser('manifest')
     image_default_args(mani_parser)
+    for inspect_command in ['fanin', 'fanout']:
+        inspect_parser = subparsers.add_parser(inspect_command)
+        inspect_parser.add_argument('file', help="the file to inspect from the command log")
+        inspect_parser.add_argument('-d', '--depth', type=int, default=3,
+                                    help="Maximum number of commands to follow from the file (default: 3)")
+    gc_parser = subparsers.add_parser('gc')
+    gc_parser.add_argument('-n', '--dry-run', action='store_true',
+                           help="Only show how much would be removed from the output store")
+    gc_parser.add_argument('--force', action='store_true',
+                           help="Remove all stored files when the command log is not enabled")
+    pull_parser = subparsers.add_parser('pull')
+    pull_parser.add_argument('tools', nargs='*', help="Tools to pull, names without a repository are CinCan tools")
+    pull_parser.add_argument('-a', '--all', action='store_true', help="Pull all tools in the remote registry")
+    pull_parser.add_argument('-j', '--jobs', type=int,
+                             help="Maximum number of concurrent pulls (default: 4, or 'pull_jobs' in configuration)")
+    batch_parser = subparsers.add_parser('batch')
+    batch_parser.add_argument('file', nargs='?', default='-',
+                              help="File of runs, one per line as a tool and its arguments (default: stdin)")
+    batch_parser.add_argument('-j', '--jobs', type=int,
+                              help="Maximum number of concurrent runs (default: sum of 'max_runs' of the endpoints)")
     help_parser = subparsers.add_parser('help')
     if len(sys.argv) > 1:
         args = m_parser.parse_args(args=sys.argv[1:])
@@ -659,6 +967,8 @@ def main():
         tool.runtime = args.runtime
         tool.is_tty = args.tty if sub_command != "shell" else True
         tool.read_stdin = args.interactive if sub_command != "shell" else True
+        tool.memoize = (args.memoize or tool.config.memoize) if sub_command != "shell" else False
+        tool.harvest = args.harvest if sub_command != "shell" else False
 
         all_args = args.tool[1:]
         if sub_command == 'test':
@@ -679,17 +989,99 @@ def main():
             sys.stdout.buffer.write(log.stdout)
         if log.stderr:
             sys.stderr.buffer.write(log.stderr)
+        if sub_command == 'run' and args.timings and log.timings:
+            sys.stderr.write(log.timings.summary())
         sys.exit(log.exit_code)  # exit code
     elif sub_command == 'manifest':
         # sub command 'manifest'
         if len(args.tool) == 0:
             sys.exit('Missing tool name argument')
-        name = args.tool[0]
         reg = ToolRegistry()
         conf = Configuration()
-        name, tag = name.rsplit(":", 1) if ":" in name else [name, conf.default_stable_tag]
-        info = reg.remote_registry.fetch_manifest(name, tag)
-        print(info)
+        names_tags = [(n.rsplit(":", 1) if ":" in n else [n, conf.default_stable_tag]) for n in args.tool]
+        cache = JsonCache(conf.cache_directory / 'manifests', ttl=conf.manifest_cache_ttl)
+        manifest_cache = ManifestCache(reg.remote_registry, cache, logging.getLogger('manifest'))
+        manifests = manifest_cache.get_all(names_tags, reg.remote_registry.max_workers)
+        if len(manifests) == 1:
+            if manifests[0] is not None:
+                print(json.dumps(manifests[0], indent=2))
+        else:
+            # many tools, print manifests as single JSON object by the tool names
+            print(json.dumps(dict(zip(args.tool, manifests)), indent=2))
+        sys.exit(1 if None in manifests else 0)
+    elif sub_command in {'fanin', 'fanout'}:
+        # sub commands 'fanin' and 'fanout'
+        file = pathlib.Path(args.file).resolve()
+        if not file.is_file():
+            sys.exit(f"No such file '{args.file}'")
+        inspector = CommandInspector(CommandLogIndex(), pathlib.Path.cwd())
+        if sub_command == 'fanin':
+            print(inspector.fanin(file, args.depth))
+        else:
+            print(inspector.fanout(file, args.depth))
+    elif sub_command == 'gc':
+        # sub command 'gc'
+        conf = Configuration()
+        if not conf.is_command_log() and not args.force:
+            sys.exit("Command log is not enabled, all stored files would be removed; use --force to remove them")
+        referenced = CommandLogIndex().referenced_digests() if conf.is_command_log() else set()
+        count, size = BlobStore(conf.store_directory).remove_unreferenced(referenced, dry_run=args.dry_run)
+        print(f"{'Would remove' if args.dry_run else 'Removed'} {count} files, {size} bytes "
+              f"not referenced by the command log")
+    elif sub_command == 'pull':
+        # sub command 'pull'
+        conf = Configuration()
+        reg = ToolRegistry()
+        names = list(args.tools)
+        if args.all:
+            loop = asyncio.get_event_loop()
+            names.extend(sorted(loop.run_until_complete(reg.remote_registry.get_tools()).keys()))
+        if not names:
+            sys.exit('Missing tool name argument')
+        prefix = reg.remote_registry.full_prefix
+        # as in 'cincan run', Docker Hub cincan tools are pulled from the default registry
+        images = list(dict.fromkeys(
+            default_registry_image(reg, n) if '/' in n.split(':', 1)[0] else f"{prefix}/{n}" for n in names))
+        jobs = args.jobs or conf.pull_jobs
+        try:
+            client = docker.from_env(max_pool_size=max(jobs, 10))
+            low_level_client = docker.APIClient(version="auto", max_pool_size=max(jobs, 10), **kwargs_from_env())
+        except docker.errors.DockerException:
+            sys.exit("Failed to connect to Docker Server. Is it running and with proper permissions?")
+        logger = logging.getLogger('pull')
+        fetcher = ImageFetcher(conf, reg, client, low_level_client, logger, args.batch)
+        progress = Progress(tty=sys.stderr.isatty() and not args.batch)
+        errors = {i: e for i, e in fetcher.pull_all(images, jobs, progress).items() if e}
+        for image, error in errors.items():
+            logger.error(f"{image}: {error}")
+        sys.exit(1 if errors else 0)
+    elif sub_command == 'batch':
+        # sub command 'batch'
+        conf = Configuration()
+        try:
+            if args.file == '-':
+                commands = read_commands(sys.stdin)
+            else:
+                with open(args.file) as f:
+                    commands = read_commands(f)
+        except ValueError as e:
+            sys.exit(f"{args.file}: {e}")
+        endpoints = [Endpoint.from_config(e, i) for i, e in enumerate(conf.endpoints)]
+
+        def batch_tool(name: str, docker_host: Optional[str], client: docker.DockerClient) -> ToolImage:
+            tool = ToolImage(name, image=name, batch=True, docker_host=docker_host, client=client)
+            tool.memoize = conf.memoize
+            return tool
+
+        runner = BatchRunner(Scheduler(endpoints, ping_endpoint), batch_tool,
+                             logging.getLogger('batch'), Progress(tty=sys.stderr.isatty() and not args.batch),
+                             command_log=conf.is_command_log(),
+                             pool=ResourcePool.of_host() if conf.placement else None,
+                             footprints=FootprintHistory(JsonCache(conf.cache_directory / 'footprints')))
+        failed = runner.run_all(commands, args.jobs or sum(e.max_runs for e in endpoints))
+        if failed:
+            logging.getLogger('batch').error(f"{failed}/{len(commands)} runs failed")
+            sys.exit(1)
     elif sub_command == 'list':
         list_handler(args)
     else:
@@ -1,15 +1,23 @@
+import concurrent.futures
 import sys
 import logging
 from docker.models.images import Image
 from docker.client import DockerClient, APIClient
 from docker.errors import ImageNotFound, NotFound, APIError
-from typing import Dict
-from shutil import get_terminal_size
-from .utils import NavigateCursor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from .cache import JsonCache
 from .configuration import Configuration
+from .progress import Progress, ProgressTask
 from cincanregistry import ToolRegistry
 
 
+class PullError(Exception):
+    """Image could not be pulled, 'not_found' when the image or tag does not exist"""
+    def __init__(self, message: str, not_found: bool = False):
+        super().__init__(message)
+        self.not_found = not_found
+
+
 class ImageFetcher:
     """Class for getting the correct tool image, possibly pulling it from remote"""
 
@@ -21,123 +29,160 @@ class ImageFetcher:
         self.client = client
         self.low_level_client = low_level_client
         self.batch = batch  # Are we running in batch?
+        # image as given -> resolved image and its id, or error
+        self.resolutions = JsonCache(config.cache_directory / 'tags', ttl=config.tag_cache_ttl)
 
-    def get_image(self, image: str, pull: bool = False) -> Image:
-
-        # Use defined default tag if tag not set
-        name_tag = image.rsplit(':', 1) if ':' in image else (
-            [image, self.config.default_stable_tag] if image.startswith(
-                self.registry.remote_registry.full_prefix + "/") else [image, "latest"])
-        initial_tag = name_tag[1]
+    def name_and_tag(self, image: str) -> Tuple[str, str]:
+        """Split image into name and tag, use defined default tag if tag not set"""
+        if ':' in image:
+            name, tag = image.rsplit(':', 1)
+            return name, tag
+        if image.startswith(self.registry.remote_registry.full_prefix + "/"):
+            return image, self.config.default_stable_tag
+        return image, "latest"
 
+    def get_image(self, image: str, pull: bool = False) -> Image:
         if pull:
-            self.logger.info(f"pulling image with tag '{name_tag[1]}'...")
+            self.logger.info(f"pulling image with tag '{self.name_and_tag(image)[1]}'...")
             try:
-                self.__pull_image(name_tag[0], tag=name_tag[1])
-            except ImageNotFound:
-                self.logger.error("Repository not found or no access into it. Is it typed correctly?")
+                return self.pull(image, use_local_dev=True)
+            except PullError as e:
+                self.logger.error(e)
+                sys.exit(1)
+        # earlier resolution of the tag, e.g. stable tag is absent and development tag is used
+        resolution = self.resolutions.get(image)
+        resolved = resolution.get('image') if resolution else None
+        try:
+            image_obj = self.client.images.get(resolved or ":".join(self.name_and_tag(image)))
+        except ImageNotFound:
+            if resolution and 'error' in resolution:
+                self.logger.error(f"{resolution['error']} (cached result, use --pull to check again)")
                 sys.exit(1)
+            # If image not found when pull set False, try to pull it
+            image_obj = self.get_image(image, pull=True)
+        return image_obj
 
+    def pull(self, image: str, status: Optional[Callable[[Dict], None]] = None,
+             use_local_dev: bool = False) -> Image:
+        """
+        Pull image, or development tag of a 'cincan' tool if it has no stable tag.
+        Status updates of the pull are passed to 'status', if given.
+        The resolved tag, or the error, is cached for the following runs.
+        """
+        try:
+            image_obj, resolved = self.__pull(image, status, use_local_dev)
+        except PullError as e:
+            if e.not_found:
+                self.resolutions.put(image, {'error': str(e)})  # remember also that there is nothing to pull
+            raise
+        self.resolutions.put(image, {'image': resolved, 'id': image_obj.id})
+        return image_obj
+
+    def __pull(self, image: str, status: Optional[Callable[[Dict], None]],
+               use_local_dev: bool) -> Tuple[Image, str]:
+        name, tag = self.name_and_tag(image)
+        try:
+            try:
+                self.__pull_image(name, tag, status)
+            except ImageNotFound:
+                raise PullError("Repository not found or no access into it. Is it typed correctly?",
+                               not_found=True) from None
             except NotFound:
                 # Tag was initially set to custom, do not attempt other tag
-                if initial_tag != self.config.default_stable_tag or not image.startswith(
+                if tag != self.config.default_stable_tag or not image.startswith(
                         self.registry.remote_registry.full_prefix + "/"):
-                    self.logger.error(f"Tag '{name_tag[1]}' not found. Is it typed correctly?")
-                    sys.exit(1)
+                    raise PullError(f"Tag '{tag}' not found. Is it typed correctly?", not_found=True) from None
                 # Attempt to run 'cincan' tools with dev tag as well if no stable tag found
-                self.logger.info(f"Tag '{name_tag[1]}' not found. Trying development tag "
+                self.logger.info(f"Tag '{tag}' not found. Trying development tag "
                                  f"'{self.config.default_dev_tag}' instead.")
-                name_tag[1] = self.config.default_dev_tag
-                try:
+                initial_tag, tag = tag, self.config.default_dev_tag
+                if use_local_dev:
                     # Attempt to use dev image without pull at first
-                    image_obj = self.client.images.get(":".join(name_tag))
-                    return image_obj
-                except ImageNotFound:
                     try:
-                        self.client.images.pull(name_tag[0], tag=name_tag[1])
-                    except NotFound:
-                        self.logger.error(
-                            f"'{initial_tag}' or '{self.config.default_dev_tag}' tag not found for image "
-                            f"{name_tag[0]} locally or remotely.")
-                        sys.exit(1)
-            # Catch super class at last if some other errors
-            except APIError as e:
-                self.logger.error(e)
-                sys.exit(1)
-        try:
-            image_obj = self.client.images.get(":".join(name_tag))
-        except ImageNotFound:
-            # If image not found when pull set False, try to pull it
-            image_obj = self.get_image(image, pull=True)
-        return image_obj
+                        return self.client.images.get(f"{name}:{tag}"), f"{name}:{tag}"
+                    except ImageNotFound:
+                        pass
+                try:
+                    self.__pull_image(name, tag, status)
+                except NotFound:
+                    raise PullError(f"'{initial_tag}' or '{tag}' tag not found for image "
+                                    f"{name} locally or remotely.", not_found=True) from None
+            return self.client.images.get(f"{name}:{tag}"), f"{name}:{tag}"
+        # Catch super class at last if some other errors
+        except APIError as e:
+            raise PullError(str(e)) from None
+
+    def pull_all(self, images: List[str], jobs: int, progress: Progress) -> Dict[str, Optional[str]]:
+        """Pull images concurrently, return error message or None for each image"""
+        finished = []
+        progress.footer = lambda: f"{len(finished)}/{len(images)} images pulled"
+
+        def pull_one(image: str) -> Optional[str]:
+            with progress.task(image, report=True) as task:
+                try:
+                    self.pull(image, status=LayerProgress(task).update)
+                except PullError as e:
+                    task.finish(failed=True)
+                    return str(e)
+                finally:
+                    finished.append(image)
+            return None
 
-    def __pull_image(self, repository: str, tag: str):
+        with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as executor:
+            results = dict(zip(images, executor.map(pull_one, images)))
+        progress.close()
+        return results
+
+    def __pull_image(self, repository: str, tag: str, status: Optional[Callable[[Dict], None]] = None):
         """
-        Pull image. If lower API is available and logging level low enough, show progress bar.
-        Progress bar is disabled, if input or output is not for 'tty'.
+        Pull image. If lower API is available and logging level low enough, show progress.
+        Progress is shown as summary lines, if output is not for 'tty' or running in batch.
         """
+        if not isinstance(self.low_level_client, APIClient):
+            self.client.images.pull(repository, tag)
+            return
+        progress = None
+        if status is None and self.logger.getEffectiveLevel() < logging.WARNING:
+            progress = Progress(tty=sys.stderr.isatty() and not self.batch)
+            status = LayerProgress(progress.task(f"{repository}:{tag}")).update
         try:
-            if isinstance(self.low_level_client, APIClient) \
-                    and sys.stdin.isatty() and sys.stdout.isatty() \
-                    and self.logger.getEffectiveLevel() < logging.WARNING and not self.batch:
-                self.__pull_image_with_progress(repository, tag)
-            else:
-                # No fancy progress bar
-                self.client.images.pull(repository, tag)
+            for s in self.low_level_client.pull(repository, tag, stream=True, decode=True):
+                if 'error' in s:
+                    error = s['error']
+                    if 'not found' in error.lower() or 'manifest unknown' in error.lower():
+                        raise NotFound(error)
+                    raise APIError(error)
+                status and status(s)
         except KeyboardInterrupt:
             self.logger.info("\nKeyboard interrupt detected. Closing...")
             sys.exit(0)
+        finally:
+            if progress:
+                for task in progress.tasks:
+                    task.finish()
+                progress.close()
+
+
+class LayerProgress:
+    """Progress of image layers from the status updates of a pull"""
+
+    def __init__(self, task: ProgressTask):
+        self.task = task
+        self.layers: Dict[str, List[int]] = {}  # id -> [current, total] bytes
+        self.complete: Set[str] = set()
 
-    def __pull_image_with_progress(self, repository: str, tag: str):
-        """Pulls image while logging in real time the progress"""
-
-        def log_row(data: Dict):
-            """Log single row of data"""
-            layer_id = data.get("id", "")
-            if layer_id:
-                layer_id_padded = f'{layer_id:<12}: '
-            else:
-                layer_id_padded = layer_id
-            status_ = data.get("status", "")
-            progress = data.get("progress", "")
-            t_width = get_terminal_size().columns
-            line = f'{layer_id_padded}{status_:<{20}} {progress}'
-            if len(f"{repository}: {line}") > t_width:
-                diff = len(f"{repository}: {line}") - t_width
-                self.logger.info(line[:-diff])
-                return
-            self.logger.info(line)
-
-        position = NavigateCursor()
-        first_time = True
-        # Locations means the location of data row in terminal output
-        loc = 0
-        cur_loc = 0
-        locations = {}
-        for status in self.low_level_client.pull(repository, tag, stream=True, decode=True):
-            s_id = status.get("id", "")
-            if s_id and not first_time:
-                position.up(cur_loc)
-                cur_loc = 0
-            elif not s_id:
-                # Last responses do not contain id
-                log_row(status)
-                continue
-            # Get status of each layer once at first
-            if not locations.get(s_id):
-                loc += 1
-                locations[s_id] = {}
-                locations[s_id]["state"] = status
-                locations[s_id]["loc"] = loc
-                cur_loc += 1
-                log_row(locations[s_id].get("state"))
-                first_time = True
-            else:
-                if first_time:
-                    position.up(cur_loc)
-                    cur_loc = 0
-                first_time = False
-                locations[s_id]["state"] = status
-                for _id in sorted(locations, key=lambda item: locations[item].get("loc")):
-                    log_row(locations[_id].get("state"))
-                    cur_loc += 1
+    def update(self, status: Dict):
+        layer = status.get('id')
+        text = status.get('status', '')
+        if not layer or text.startswith('Pulling from'):
+            return
+        current_total = self.layers.setdefault(layer, [0, 0])
+        detail = status.get('progressDetail') or {}
+        if text == 'Downloading' and detail.get('total'):
+            current_total[:] = [detail.get('current', 0), detail['total']]
+        elif text in {'Download complete', 'Pull complete', 'Already exists'}:
+            current_total[0] = current_total[1]
+            self.complete.add(layer)
+        self.task.update(done=sum(c for c, _ in self.layers.values()),
+                         total=sum(t for _, t in self.layers.values()),
+                         status=f"{len(self.complete)}/{len(self.layers)} layers")
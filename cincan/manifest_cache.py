@@ -0,0 +1,69 @@
+import concurrent.futures
+import hashlib
+from logging import Logger
+from typing import Any, Dict, List, Optional, Tuple
+
+from cincan.cache import JsonCache
+
+MANIFEST_MIME = "application/vnd.docker.distribution.manifest.v2+json"
+
+
+def fetch_manifest_if_modified(registry: Any, name: str, tag: str,
+                               digest: Optional[str] = None) -> Tuple[int, Optional[Dict[str, Any]], str]:
+    """
+    Fetch manifest unless its digest matches, return the status code, the manifest and its digest.
+    Status is 304 without manifest when not modified.
+    The public RemoteRegistry.fetch_manifest of cincanregistry has no conditional request, so this uses its
+    private _get_registry_service_token and session; keep all use of the private API here.
+    """
+    headers = {"Accept": MANIFEST_MIME}
+    if digest:
+        headers["If-None-Match"] = f'"{digest}"'
+    token = registry._get_registry_service_token(name)
+    headers["Authorization"] = f"{registry.auth_digest_type} {token}"
+    resp = registry.session.get(f"{registry.registry_root}/{registry.schema_version}/{name}/manifests/{tag}",
+                                headers=headers)
+    if resp.status_code != 200:
+        return resp.status_code, None, digest or ''
+    resp_digest = resp.headers.get('Docker-Content-Digest') or 'sha256:' + hashlib.sha256(resp.content).hexdigest()
+    return resp.status_code, resp.json(), resp_digest
+
+
+class ManifestCache:
+    """Image manifests cached by registry, name and tag, revalidated with a conditional request after TTL"""
+    def __init__(self, registry: Any, cache: JsonCache, logger: Logger):
+        self.registry = registry  # remote registry of cincanregistry, e.g. QuayRegistry
+        self.cache = cache  # TTL of the cache tells when entries are revalidated
+        self.logger = logger
+
+    def get(self, name: str, tag: str) -> Optional[Dict[str, Any]]:
+        """Get manifest, None if not available"""
+        key = f"{self.registry.registry_root}/{name}:{tag}"
+        entry = self.cache.get_entry(key)
+        if entry is not None and not self.cache.is_expired(entry):
+            return entry['value']['body']
+
+        cached = entry['value'] if entry else None
+        try:
+            status, body, digest = fetch_manifest_if_modified(self.registry, name, tag,
+                                                              cached['digest'] if cached else None)
+        except (OSError, ValueError) as e:
+            if cached:
+                self.logger.warning(f"Failed to revalidate manifest of {name}:{tag}, using cached one: {e}")
+                return cached['body']
+            self.logger.error(f"Failed to fetch manifest of {name}:{tag}: {e}")
+            return None
+        if status == 304 and cached:
+            self.logger.debug(f"manifest of {name}:{tag} not modified")
+            self.cache.put(key, cached)  # valid for an other TTL
+            return cached['body']
+        if body is None:
+            self.logger.error(f"Error when getting manifest for tool {name}. Code {status}")
+            return None
+        self.cache.put(key, {'digest': digest, 'body': body})
+        return body
+
+    def get_all(self, names_tags: List[Tuple[str, str]], jobs: int) -> List[Optional[Dict[str, Any]]]:
+        """Get manifests concurrently"""
+        with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as executor:
+            return list(executor.map(lambda n_t: self.get(*n_t), names_tags))
@@ -0,0 +1,50 @@
+import time
+from typing import Callable, IO, Optional
+
+MAX_BUFFER = 64 * 1024  # bytes of output coalesced into a write
+MAX_DELAY = 0.05  # seconds output may be held back
+
+
+class OutputSink:
+    """
+    Tool output written into a stream. On a terminal each frame is written at once, into a pipe or a file
+    frames are coalesced into larger writes, held back at most 'max_delay' seconds.
+    """
+
+    def __init__(self, stream: IO[bytes], tty: Optional[bool] = None, max_buffer: int = MAX_BUFFER,
+                 max_delay: float = MAX_DELAY, clock: Callable[[], float] = time.monotonic):
+        self.stream = stream
+        self.tty = stream.isatty() if tty is None else tty
+        self.max_buffer = max_buffer
+        self.max_delay = max_delay
+        self.clock = clock
+        self.buffer = bytearray()
+        self.since = 0.0  # when the oldest buffered frame was written
+        self.writes = 0  # writes into the stream
+
+    def write(self, data: bytes):
+        if self.tty or (not self.buffer and len(data) >= self.max_buffer):
+            self.__write(data)
+            return
+        if not self.buffer:
+            self.since = self.clock()
+        self.buffer.extend(data)
+        if len(self.buffer) >= self.max_buffer or self.clock() - self.since >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered output"""
+        if self.buffer:
+            data, self.buffer = self.buffer, bytearray()
+            self.__write(data)
+
+    def timeout(self) -> Optional[float]:
+        """Seconds until the buffered output must be written, None if nothing is buffered"""
+        if not self.buffer:
+            return None
+        return max(0.0, self.since + self.max_delay - self.clock())
+
+    def __write(self, data: bytes):
+        self.stream.write(data)
+        self.stream.flush()
+        self.writes += 1
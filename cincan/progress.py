@@ -0,0 +1,214 @@
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, IO, List, Optional, TextIO, Tuple
+
+RATE_WINDOW = 5.0  # seconds, transfer rate is calculated over this window
+
+
+def format_bytes(count: float) -> str:
+    for unit in ['B', 'kB', 'MB']:
+        if count < 1000:
+            return f"{count:.0f} {unit}" if unit == 'B' else f"{count:.1f} {unit}"
+        count /= 1000
+    return f"{count:.1f} GB"
+
+
+def format_duration(seconds: float) -> str:
+    minutes, secs = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{secs:02}" if hours else f"{minutes}:{secs:02}"
+
+
+class ProgressTask:
+    """Progress of a single transfer in bytes, use as context manager to finish it"""
+
+    def __init__(self, progress: 'Progress', name: str, total: Optional[int], report: bool):
+        self.progress = progress
+        self.name = name
+        self.total = total  # None when not known
+        self.done = 0
+        self.status = ''
+        self.report = report  # report completion also when not on a terminal and not running long
+        self.start = progress.clock()
+        self.end: Optional[float] = None
+        self.failed = False
+        self.reported = False  # has been in a summary line
+        self.samples: Deque[Tuple[float, int]] = deque([(self.start, 0)])
+
+    def __enter__(self) -> 'ProgressTask':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finish(failed=exc_type is not None)
+
+    def advance(self, count: int):
+        self.update(done=self.done + count)
+
+    def update(self, done: Optional[int] = None, total: Optional[int] = None, status: Optional[str] = None):
+        with self.progress.lock:
+            now = self.progress.clock()
+            if done is not None:
+                self.done = done
+                if now - self.samples[-1][0] >= 0.1:
+                    self.samples.append((now, done))
+                    while len(self.samples) > 2 and now - self.samples[1][0] > RATE_WINDOW:
+                        self.samples.popleft()
+            if total is not None:
+                self.total = total
+            if status is not None:
+                self.status = status
+            self.progress.refresh()
+
+    def finish(self, failed: bool = False):
+        with self.progress.lock:
+            if self.end is None:
+                self.end = self.progress.clock()
+                self.failed = failed
+                self.progress.refresh(force=True)
+
+    def rate(self) -> float:
+        """Bytes per second, over the recent samples or over the whole transfer when finished"""
+        if self.end is not None:
+            return self.done / (self.end - self.start) if self.end > self.start else 0.0
+        now = self.progress.clock()
+        since, base = self.samples[0]
+        return (self.done - base) / (now - since) if now > since else 0.0
+
+    def eta(self) -> Optional[float]:
+        rate = self.rate()
+        if not self.total or not rate:
+            return None
+        return max(0.0, self.total - self.done) / rate
+
+    def line(self) -> str:
+        text = f"{self.name}:"
+        if self.status:
+            text += f" {self.status}"
+        if self.end is not None:
+            if self.failed:
+                return f"{text} failed"
+            return f"{text} done, {format_bytes(self.done)} in {self.end - self.start:.1f} s, " \
+                   f"{format_bytes(self.rate())}/s"
+        text += f" {format_bytes(self.done)}"
+        if self.total:
+            text += f"/{format_bytes(self.total)}"
+        text += f" {format_bytes(self.rate())}/s"
+        eta = self.eta()
+        if eta is not None:
+            text += f" ETA {format_duration(eta)}"
+        return text
+
+
+class Progress:
+    """
+    Progress of transfers, rendered at most 'fps' times per second.
+    On a terminal, the active transfers are redrawn in place. Otherwise, a summary line is written
+    every 'summary_interval' seconds for the transfers running longer than that.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, tty: Optional[bool] = None, enabled: bool = True,
+                 fps: float = 10.0, summary_interval: float = 5.0, delay: float = 0.5,
+                 footer: Optional[Callable[[], str]] = None, clock: Callable[[], float] = time.monotonic):
+        self.stream = stream or sys.stderr
+        self.tty = self.stream.isatty() if tty is None else tty
+        self.enabled = enabled
+        self.frame_interval = 1.0 / fps
+        self.summary_interval = summary_interval
+        self.delay = delay  # seconds before a transfer is shown on a terminal, to avoid flicker of short ones
+        self.footer = footer  # extra line below the transfers on a terminal
+        self.clock = clock
+        self.tasks: List[ProgressTask] = []
+        self.lock = threading.RLock()
+        self.rendered = 0  # lines drawn by the last frame
+        self.last_frame = float('-inf')
+        self.last_summary = clock()
+
+    def task(self, name: str, total: Optional[int] = None, report: bool = False) -> ProgressTask:
+        task = ProgressTask(self, name, total, report)
+        with self.lock:
+            self.tasks.append(task)
+        return task
+
+    def refresh(self, force: bool = False):
+        """Render, unless rendered less than frame interval ago"""
+        if not self.enabled:
+            return
+        with self.lock:
+            now = self.clock()
+            if not force and now - self.last_frame < self.frame_interval:
+                return
+            self.last_frame = now
+            if self.tty:
+                self.__draw(now)
+            else:
+                self.__summarize(now)
+            self.tasks = [t for t in self.tasks if t.end is None]
+
+    def clear(self):
+        """Remove the drawn lines, e.g. before other output into the terminal"""
+        with self.lock:
+            if self.enabled and self.tty and self.rendered:
+                self.__write(f"\033[{self.rendered}A" + "\033[2K\n" * self.rendered + f"\033[{self.rendered}A")
+                self.rendered = 0
+
+    def close(self):
+        """Render the final state and remove the drawn lines"""
+        with self.lock:
+            self.refresh(force=True)
+            self.clear()
+
+    def __draw(self, now: float):
+        lines = [t.line() for t in self.tasks if t.end is None and now - t.start >= self.delay]
+        if self.footer:
+            lines.append(self.footer())
+        if not lines and not self.rendered:
+            return
+        width = shutil.get_terminal_size().columns - 1
+        out = f"\033[{self.rendered}A" if self.rendered else ''
+        out += ''.join(f"\033[2K{line[:width]}\n" for line in lines)
+        extra = self.rendered - len(lines)
+        if extra > 0:
+            # clear lines left from the previous frame, and return below the new lines
+            out += "\033[2K\n" * extra + f"\033[{extra}A"
+        self.rendered = len(lines)
+        self.__write(out)
+
+    def __summarize(self, now: float):
+        lines = []
+        for t in self.tasks:
+            if t.end is not None:
+                if t.reported or t.report:
+                    lines.append(t.line())
+            elif now - self.last_summary >= self.summary_interval and now - t.start >= self.summary_interval:
+                t.reported = True
+                lines.append(t.line())
+        if now - self.last_summary >= self.summary_interval:
+            self.last_summary = now
+        if lines:
+            self.__write(''.join(f"{line}\n" for line in lines))
+
+    def __write(self, text: str):
+        self.stream.write(text)
+        self.stream.flush()
+
+
+class ProgressReader:
+    """Read from a file of known length and advance progress task by the read bytes"""
+
+    def __init__(self, file: IO[bytes], length: int, task: ProgressTask):
+        self.file = file
+        self.length = length
+        self.task = task
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.file.read(size)
+        self.count += len(chunk)
+        self.task.advance(len(chunk))
+        return chunk
+
+    def __len__(self) -> int:
+        return self.length
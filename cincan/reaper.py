@@ -0,0 +1,134 @@
+import concurrent.futures
+import fcntl
+import hashlib
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+
+import docker
+import docker.errors
+
+CONTAINER_LABEL = 'cincan.tool'  # all containers created by cincan have this label
+OWNER_LABEL = 'cincan.owner'  # reaper owning the container, other users' containers are never swept
+STALE_AGE = 60 * 60  # seconds, containers exited longer ago are removed even if not queued
+REMOVE_WORKERS = 4
+BATCH_DELAY = 0.5  # seconds the helper waits for more containers to remove
+
+
+class ContainerReaper:
+    """Remove containers in a detached helper process, off the critical path of runs.
+    Containers to remove are queued as files, so that removals left undone are done by the next helper."""
+    def __init__(self, directory: pathlib.Path, docker_host: Optional[str] = None):
+        self.directory = directory
+        self.docker_host = docker_host  # None for the one in the environment
+        # queue directory is per user and Docker host, the host name tells apart users sharing a remote engine
+        self.owner = hashlib.sha256(
+            f"{socket.gethostname()}:{directory.resolve().as_posix()}".encode()).hexdigest()[:16]
+
+    @classmethod
+    def for_host(cls, cache_directory: pathlib.Path, docker_host: Optional[str] = None) -> 'ContainerReaper':
+        """Reaper with a queue of its own for each Docker host"""
+        if not docker_host:
+            return cls(cache_directory / 'reap')
+        return cls(cache_directory / f"reap-{hashlib.sha256(docker_host.encode()).hexdigest()[:16]}", docker_host)
+
+    def defer(self, container_id: str):
+        """Queue container for removal and make sure a helper is running"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / container_id).touch()
+        if self.__helper_running():
+            return  # the running helper picks it up, or the next one if it was just about to exit
+        env = dict(os.environ, DOCKER_HOST=self.docker_host) if self.docker_host else None
+        subprocess.Popen([sys.executable, '-m', 'cincan.reaper', self.directory.as_posix()],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         env=env, start_new_session=True)  # survives exit and Ctrl+C of cincan
+
+    def __helper_running(self) -> bool:
+        with (self.directory / '.lock').open('w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return True
+        return False
+
+    def queued(self) -> List[str]:
+        if not self.directory.is_dir():
+            return []
+        return [e.name for e in os.scandir(self.directory) if not e.name.startswith('.')]
+
+    def sweep(self, client: docker.DockerClient) -> int:
+        """Remove queued containers and stale exited containers of this reaper, return number of removed"""
+        ids = set(self.queued())
+        stale_before = time.time() - STALE_AGE
+        try:
+            for c in client.api.containers(all=True, filters={'label': f'{OWNER_LABEL}={self.owner}',
+                                                              'status': 'exited'}):
+                # results of a long run may still be downloaded, look at the exit time of the old ones
+                if c.get('Created', 0) < stale_before and self.__finished_at(client, c['Id']) < stale_before:
+                    ids.add(c['Id'])
+        except docker.errors.APIError:
+            pass  # queued containers are still removed
+        return self.remove(client, ids)
+
+    @classmethod
+    def __finished_at(cls, client: docker.DockerClient, container_id: str) -> float:
+        """Time the container exited, now if not known"""
+        try:
+            finished = client.api.inspect_container(container_id)['State']['FinishedAt']
+            return datetime.strptime(finished[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+        except (docker.errors.APIError, KeyError, ValueError):
+            return time.time()
+
+    def drain(self, client: docker.DockerClient) -> int:
+        """Sweep until no more containers are queued, while holding the helper lock"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with (self.directory / '.lock').open('w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return 0  # other helper is running
+            time.sleep(BATCH_DELAY)
+            attempted = set(self.queued())
+            removed = self.sweep(client)
+            pending = set(self.queued())
+            while pending - attempted:
+                new = pending - attempted
+                attempted.update(new)
+                removed += self.remove(client, new)
+                pending = set(self.queued())
+            return removed
+
+    def remove(self, client: docker.DockerClient, ids: Iterable[str]) -> int:
+        """Remove containers in a batch, return number of removed"""
+        with concurrent.futures.ThreadPoolExecutor(REMOVE_WORKERS) as executor:
+            return sum(executor.map(lambda c_id: self.__remove(client, c_id), ids))
+
+    def __remove(self, client: docker.DockerClient, container_id: str) -> bool:
+        removed = False
+        try:
+            client.api.remove_container(container_id, force=True)
+            removed = True
+        except docker.errors.NotFound:
+            pass  # removed by an other helper
+        except docker.errors.APIError:
+            return False  # leave it for the next helper
+        try:
+            (self.directory / container_id).unlink()
+        except FileNotFoundError:
+            pass
+        return removed
+
+
+def main():
+    """Entry point of the detached helper"""
+    reaper = ContainerReaper(pathlib.Path(sys.argv[1]))
+    reaper.drain(docker.from_env())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+import glob
+import math
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from cincan.cache import JsonCache
+
+# image labels to declare the footprint of a tool, e.g. "2" and "1g"
+CPUS_LABEL = 'cincan.cpus'
+MEMORY_LABEL = 'cincan.memory'
+DEFAULT_CPUS = 1.0
+DEFAULT_MEMORY = 512 * 1024 * 1024
+HISTORY_RUNS = 5  # footprint is the largest of the latest runs
+
+
+def parse_memory(value: str) -> int:
+    """Parse memory size such as '512m' or '2g' into bytes"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?)b?\s*', value.lower())
+    if not match:
+        raise ValueError(f"invalid memory size '{value}'")
+    return int(float(match.group(1)) * 1024 ** ' kmgt'.index(match.group(2) or ' '))
+
+
+def parse_cpu_list(value: str) -> List[int]:
+    """Parse CPU list such as '0-3,8' of Linux"""
+    cpus = []
+    for part in value.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+class Footprint:
+    """CPUs and memory (bytes) used by a run of a tool"""
+
+    def __init__(self, cpus: float = DEFAULT_CPUS, memory: int = DEFAULT_MEMORY, declared: bool = False):
+        self.cpus = cpus
+        self.memory = memory
+        self.declared = declared  # declared by the image, rather than observed
+
+    @classmethod
+    def from_labels(cls, labels: Dict[str, str]) -> Optional['Footprint']:
+        """Footprint declared by image labels, None if not declared, ValueError if the labels are malformed"""
+        if CPUS_LABEL not in labels and MEMORY_LABEL not in labels:
+            return None
+        cpus = float(labels.get(CPUS_LABEL, DEFAULT_CPUS))
+        if not 0 < cpus < float('inf'):
+            raise ValueError(f"invalid CPU count '{labels[CPUS_LABEL]}'")
+        return cls(cpus, parse_memory(labels[MEMORY_LABEL]) if MEMORY_LABEL in labels else DEFAULT_MEMORY,
+                   declared=True)
+
+    def __repr__(self) -> str:
+        return f"{self.cpus:.1f} CPUs, {self.memory // (1024 * 1024)} MB"
+
+
+class FootprintHistory:
+    """Footprints of tools observed in the earlier runs, by tool name"""
+
+    def __init__(self, cache: JsonCache):
+        self.cache = cache
+
+    def get(self, name: str) -> Optional[Footprint]:
+        runs = self.cache.get(name)
+        if not runs:
+            return None
+        return Footprint(max(r['cpus'] for r in runs), max(r['memory'] for r in runs))
+
+    def record(self, name: str, footprint: Footprint):
+        runs = (self.cache.get(name) or [])[-(HISTORY_RUNS - 1):]
+        self.cache.put(name, runs + [{'cpus': round(footprint.cpus, 3), 'memory': footprint.memory}])
+
+
+class Allocation:
+    """Resources allocated to a run"""
+
+    def __init__(self, cpus: List[int], memory: int, node: Optional[int], footprint: Footprint):
+        self.cpus = cpus
+        self.memory = memory
+        self.node = node  # NUMA node of all the CPUs, if there are many nodes
+        self.footprint = footprint
+
+    def container_options(self) -> Dict[str, Any]:
+        """Options for creating the container"""
+        options: Dict[str, Any] = {'cpuset_cpus': ','.join(str(c) for c in self.cpus)}
+        if self.node is not None:
+            options['cpuset_mems'] = str(self.node)
+        if self.footprint.declared:
+            # observed footprint may grow with the input, do not limit by it, the CPU set is the only constraint
+            options['nano_cpus'] = int(min(self.footprint.cpus, len(self.cpus)) * 1e9)
+            options['mem_limit'] = self.footprint.memory
+        return options
+
+
+class ResourcePool:
+    """
+    CPUs and memory of the host, allocated to runs as disjoint CPU sets within a NUMA node when possible.
+    A run is admitted only when there are enough free CPUs and memory for its footprint.
+    """
+
+    def __init__(self, nodes: Dict[int, List[int]], memory: int):
+        self.nodes = {n: sorted(c) for n, c in nodes.items() if c}  # NUMA node -> CPUs
+        self.free = {n: set(c) for n, c in self.nodes.items()}
+        self.memory = memory
+        self.free_memory = memory
+        self.condition = threading.Condition()
+
+    @classmethod
+    def of_host(cls) -> Optional['ResourcePool']:
+        """Resource pool of the CPUs available to this process and the available memory,
+        None if the CPUs are not known, e.g. on macOS"""
+        if not hasattr(os, 'sched_getaffinity'):
+            return None
+        available = os.sched_getaffinity(0)
+        nodes = {}
+        for path in glob.glob('/sys/devices/system/node/node[0-9]*/cpulist'):
+            with open(path) as f:
+                nodes[int(re.search(r'node(\d+)', path).group(1))] = [c for c in parse_cpu_list(f.read())
+                                                                     if c in available]
+        if not any(nodes.values()):
+            nodes = {0: sorted(available)}  # no NUMA information
+        return cls(nodes, cls.__available_memory())
+
+    @staticmethod
+    def __available_memory() -> int:
+        try:
+            with open('/proc/meminfo') as f:
+                info = dict(line.split(':', 1) for line in f)
+            return int(info['MemAvailable'].split()[0]) * 1024
+        except (OSError, KeyError, ValueError):
+            return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+    def cpu_count(self) -> int:
+        return sum(len(c) for c in self.nodes.values())
+
+    def acquire(self, footprint: Footprint) -> Allocation:
+        """Wait until the footprint fits, footprint larger than the whole pool waits for an idle pool"""
+        cpus = min(max(1, math.ceil(footprint.cpus)), self.cpu_count())
+        memory = min(footprint.memory, self.memory)
+        with self.condition:
+            while True:
+                allocation = self.__allocate(cpus, memory, footprint)
+                if allocation:
+                    return allocation
+                self.condition.wait()
+
+    def release(self, allocation: Allocation):
+        with self.condition:
+            for node, cpus in self.nodes.items():
+                self.free[node].update(c for c in allocation.cpus if c in cpus)
+            self.free_memory += allocation.memory
+            self.condition.notify_all()
+
+    def __allocate(self, cpus: int, memory: int, footprint: Footprint) -> Optional[Allocation]:
+        if memory > self.free_memory or cpus > sum(len(f) for f in self.free.values()):
+            return None
+        # best fit into a single node: the node with fewest free CPUs which has enough
+        fits = [n for n in self.nodes if len(self.free[n]) >= cpus]
+        if fits:
+            node = min(fits, key=lambda n: (len(self.free[n]), n))
+            chosen = sorted(self.free[node])[:cpus]
+            self.free[node].difference_update(chosen)
+            numa_node: Optional[int] = node if len(self.nodes) > 1 else None
+        else:
+            # spread over the nodes, most free first
+            chosen = []
+            for node in sorted(self.nodes, key=lambda n: -len(self.free[n])):
+                take = sorted(self.free[node])[:cpus - len(chosen)]
+                self.free[node].difference_update(take)
+                chosen.extend(take)
+            numa_node = None
+        self.free_memory -= memory
+        return Allocation(sorted(chosen), memory, numa_node, footprint)
+
+
+class FootprintSampler:
+    """Sample CPU and peak memory use of a running container from its stats"""
+
+    def __init__(self, stats: Callable[[], Iterable[Dict[str, Any]]], clock=time.monotonic):
+        self.stats = stats  # e.g. lambda: container.stats(stream=True, decode=True)
+        self.clock = clock
+        self.peak_memory = 0
+        self.first_cpu: Optional[int] = None
+        self.last_cpu: Optional[int] = None
+        self.first_time = self.last_time = clock()
+        self.thread = threading.Thread(target=self.__sample, name='footprint', daemon=True)
+
+    def start(self) -> 'FootprintSampler':
+        self.thread.start()
+        return self
+
+    def __sample(self):
+        try:
+            for s in self.stats():
+                self.add(s)
+        except Exception:
+            pass  # stats are not essential, e.g. the stream is closed as the container exits
+
+    def add(self, stats: Dict[str, Any]):
+        memory = (stats.get('memory_stats') or {}).get('usage') or 0
+        self.peak_memory = max(self.peak_memory, (stats.get('memory_stats') or {}).get('max_usage') or 0, memory)
+        cpu = ((stats.get('cpu_stats') or {}).get('cpu_usage') or {}).get('total_usage')
+        if cpu:
+            if self.first_cpu is None:
+                self.first_cpu, self.first_time = cpu, self.clock()
+            self.last_cpu, self.last_time = cpu, self.clock()
+
+    def footprint(self) -> Optional[Footprint]:
+        """Observed footprint, None if not enough samples"""
+        self.thread.join(timeout=1.0)
+        if not self.peak_memory or self.last_cpu is None or self.last_time <= self.first_time:
+            return None
+        cpus = (self.last_cpu - self.first_cpu) / 1e9 / (self.last_time - self.first_time)
+        return Footprint(max(0.1, cpus), self.peak_memory)
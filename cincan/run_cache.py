@@ -0,0 +1,130 @@
+import hashlib
+import json
+import pathlib
+from logging import Logger
+from typing import Any, Dict, IO, List, Optional, Set
+
+from cincan.blob_store import BlobStore
+from cincan.cache import JsonCache
+from cincan.command_log import CommandLog, FileLog
+
+
+class RunCache:
+    """Results of earlier runs, a run with identical image, command and inputs is not executed again"""
+    def __init__(self, directory: pathlib.Path, max_size: int, logger: Logger):
+        self.entries = JsonCache(directory / 'entries')
+        self.blobs = BlobStore(directory / 'blobs')
+        self.state = JsonCache(directory / 'state')  # size of stored files, updated on store, checked by evict
+        self.max_size = max_size  # bytes, of stored outputs and streams
+        self.logger = logger
+
+    @classmethod
+    def run_key(cls, values: Dict[str, Any]) -> str:
+        """Key for a run from everything which can affect its result"""
+        js = json.dumps(values, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(js.encode('utf-8')).hexdigest()
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up stored result, None if not stored or stored files are missing"""
+        result = self.entries.get(key)
+        if result is None:
+            return None
+        if not all(self.blobs.contains(d) for d in self.__digests_of(result)):
+            self.logger.debug("stored run %s incomplete, removing it", key)
+            self.entries.remove(key)
+            return None
+        self.entries.put(key, result)  # refresh the time stamp, the least recently used are evicted first
+        return result
+
+    def store(self, key: str, log: CommandLog, work_dir: pathlib.Path,
+              stdout_file: Optional[IO[bytes]], stderr_file: Optional[IO[bytes]]):
+        """Store result of a successful run"""
+        outputs = []
+        for f in log.out_files:
+            if f.path.as_posix().startswith('/dev/'):
+                continue
+            try:
+                rel_path = f.path.relative_to(work_dir).as_posix()
+            except ValueError:
+                self.logger.debug("output %s not in working directory, run not stored", f.path.as_posix())
+                return
+            if f.digest:
+                digest = self.blobs.add_file(work_dir / rel_path)
+                if digest != f.digest:
+                    self.logger.debug("output %s modified after download, run not stored", rel_path)
+                    return
+            else:
+                digest = ''  # directory
+            outputs.append({'path': rel_path, 'sha256': digest})
+        result = {
+            'exit_code': log.exit_code,
+            'outputs': outputs,
+            'stdout': self.__add_stream(stdout_file),
+            'stderr': self.__add_stream(stderr_file),
+        }
+        self.entries.put(key, result)
+        self.logger.debug("stored run %s", key)
+        # blobs shared with other runs are counted again, evict recomputes the exact size
+        size = self.__stored_size() + sum(self.blobs.size_of(d) for d in set(self.__digests_of(result)))
+        if size > self.max_size:
+            self.evict()
+        else:
+            self.state.put('size', {'bytes': size})
+
+    def __stored_size(self) -> float:
+        state = self.state.get('size')
+        return state['bytes'] if state else float('inf')  # unknown, evict to find out
+
+    def __add_stream(self, stream: Optional[IO[bytes]]) -> str:
+        if stream is None or not stream.tell():
+            return ''
+        stream.seek(0)
+        return self.blobs.add(stream)
+
+    def restore(self, result: Dict[str, Any], work_dir: pathlib.Path, log: CommandLog,
+                stdout: Optional[IO[bytes]], stderr: IO[bytes]) -> CommandLog:
+        """Restore outputs and output streams of stored run"""
+        log.exit_code = result['exit_code']
+        for out in result['outputs']:
+            host_file = work_dir / out['path']
+            self.logger.info(f"=> {out['path']}{'' if out['sha256'] else '/'}")
+            if out['sha256']:
+                self.blobs.copy_to(out['sha256'], host_file)
+            else:
+                host_file.mkdir(parents=True, exist_ok=True)
+            log.out_files.append(FileLog(host_file, out['sha256']))
+        for name, stream in [('stdout', stdout), ('stderr', stderr)]:
+            digest = result[name]
+            if not digest:
+                continue
+            if stream is not None:
+                with self.blobs.open(digest) as f:
+                    data = f.read()
+                stream.write(data)
+                stream.flush()
+            log.out_files.append(FileLog(pathlib.Path(f'/dev/{name}'), digest))
+        return log
+
+    @classmethod
+    def __digests_of(cls, result: Dict[str, Any]) -> List[str]:
+        digests = [o['sha256'] for o in result['outputs'] if o['sha256']]
+        return digests + [result[s] for s in ['stdout', 'stderr'] if result[s]]
+
+    def evict(self):
+        """Remove the least recently used runs until the stored files fit into the size limit"""
+        entries = sorted(self.entries.entries(), key=lambda e: e['time'], reverse=True)
+        kept: Set[str] = set()
+        size = 0
+        for entry in entries:
+            digests = set(self.__digests_of(entry['value'])) - kept
+            entry_size = sum(self.blobs.size_of(d) for d in digests)
+            if size + entry_size > self.max_size:
+                self.logger.debug("evicting stored run %s", entry['key'])
+                self.entries.remove(entry['key'])
+                continue
+            size += entry_size
+            kept.update(digests)
+        for digest in list(self.blobs.digests()):
+            if digest not in kept:
+                self.blobs.remove(digest)
+        self.state.put('size', {'bytes': size})
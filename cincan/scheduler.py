@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+HEALTH_RECHECK = 30.0  # seconds, unhealthy endpoint is checked again after this
+
+
+class Endpoint:
+    """Docker endpoint runs are placed on, 'host' None for the one in the environment"""
+
+    def __init__(self, name: str, host: Optional[str] = None, weight: float = 1.0, max_runs: int = 4):
+        self.name = name
+        self.host = host
+        self.weight = weight  # relative capacity, e.g. 2 to take twice the runs of weight 1
+        self.max_runs = max_runs  # concurrent runs
+        self.active = 0
+        self.done = 0
+        self.failed = 0
+        self.healthy: Optional[bool] = None  # not known before the first check
+        self.checking = False  # health check in progress
+        self.placement = True  # runs placed on the CPUs of this host, unless the engine rejects the CPU sets
+        self.error = ''
+        self.checked = float('-inf')
+
+    @classmethod
+    def from_config(cls, values: Dict[str, Any], index: int) -> 'Endpoint':
+        host = values.get('host')
+        return cls(values.get('name', host or f"endpoint-{index}"), host,
+                   float(values.get('weight', 1.0)), int(values.get('max_runs', 4)))
+
+    def is_local(self) -> bool:
+        """Is the endpoint on this host, i.e. a unix socket? Socket of an engine in a VM, e.g. of Docker Desktop,
+        looks local as well."""
+        host = self.host or os.environ.get('DOCKER_HOST', '')
+        return not host or host.startswith('unix://')
+
+    def load(self) -> float:
+        """Load of the endpoint relative to its weight, if one more run were placed on it"""
+        return (self.active + 1) / self.weight
+
+    def status(self) -> str:
+        if self.healthy is False:
+            return f"{self.name}: down ({self.error})"
+        return f"{self.name}: {self.active}/{self.max_runs} running, {self.done} done, {self.failed} failed"
+
+
+class Scheduler:
+    """Place runs on the least loaded healthy endpoint, runs wait in a queue while all endpoints are full"""
+
+    def __init__(self, endpoints: List[Endpoint], check: Callable[[Endpoint], Optional[str]],
+                 clock: Callable[[], float] = time.monotonic):
+        self.endpoints = endpoints
+        self.check = check  # health check of an endpoint, returns error or None
+        self.clock = clock
+        self.queued = 0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> Optional[Endpoint]:
+        """Wait for a free slot on a healthy endpoint, None if all endpoints are down"""
+        with self.condition:
+            self.queued += 1
+        try:
+            while True:
+                self.__check_health()
+                with self.condition:
+                    healthy = [e for e in self.endpoints if e.healthy]
+                    free = [e for e in healthy if e.active < e.max_runs]
+                    if free:
+                        endpoint = min(free, key=Endpoint.load)
+                        endpoint.active += 1
+                        return endpoint
+                    if not healthy and not any(e.checking for e in self.endpoints):
+                        return None
+                    self.condition.wait(HEALTH_RECHECK)
+        finally:
+            with self.condition:
+                self.queued -= 1
+
+    def release(self, endpoint: Endpoint, failed: bool = False, error: Optional[str] = None):
+        """Run has finished on endpoint, 'error' when the endpoint itself failed"""
+        with self.condition:
+            endpoint.active -= 1
+            if failed:
+                endpoint.failed += 1
+            else:
+                endpoint.done += 1
+            if error:
+                self.__set_health(endpoint, error)
+            self.condition.notify_all()
+
+    def __check_health(self):
+        """Check endpoints not known to be healthy, without holding the lock as a check may take a while"""
+        with self.condition:
+            now = self.clock()
+            due = [e for e in self.endpoints if not e.healthy and not e.checking and now - e.checked >= HEALTH_RECHECK]
+            for e in due:
+                e.checking = True
+        for e in due:
+            error: Optional[str] = 'health check failed'
+            try:
+                error = self.check(e)
+            finally:
+                with self.condition:
+                    e.checking = False
+                    self.__set_health(e, error)
+                    self.condition.notify_all()
+
+    def __set_health(self, endpoint: Endpoint, error: Optional[str]):
+        endpoint.healthy = error is None
+        endpoint.error = error or ''
+        endpoint.checked = self.clock()
+
+    def status(self) -> str:
+        """Status line of the queue and the endpoints"""
+        with self.condition:
+            return ' | '.join([f"{self.queued} queued"] + [e.status() for e in self.endpoints])
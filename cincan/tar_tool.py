@@ -1,60 +1,186 @@
+import hashlib
 import os
 import pathlib
-import shutil
+import queue
+import stat
 import sys
 import tarfile
 import tempfile
-import timeit
+import threading
+import time
 from datetime import datetime
 from logging import Logger
-from typing import Dict, Optional, List, Set, Tuple
+from typing import Callable, Dict, IO, Iterator, Optional, List, Set, Tuple
 
 import docker
 from docker.errors import NotFound
 from docker.models.containers import Container
 
+from cincan.blob_store import BlobStore
+from cincan.cache import JsonCache
 from cincan.command_log import FileLog, read_with_hash
-from cincan.file_tool import FileMatcher
+from cincan.compression import DecompressReader, ParallelCompressor, compress_stream, compression_by_name, \
+    sample_ratio
+from cincan.file_tool import FileMatcher, StatSnapshot
+from cincan.progress import Progress, ProgressReader, format_bytes
+from cincan.timings import Timings
 
 IGNORE_FILENAME = ".cincanignore"
 COMMENT_CHAR = "#"
+STREAM_CHUNK_SIZE = 64 * 1024  # chunk size when streaming an archive
+STREAM_QUEUE_CHUNKS = 16  # chunks buffered for the member listing of a streamed archive
+MIN_COMPRESSED_UPLOAD = 256 * 1024  # smaller uploads are not compressed
+MAX_COMPRESSED_UPLOAD_RATIO = 0.8  # compress upload, if sample compresses at least this well
+UPLOAD_COMPRESSION_LEVEL = 1  # fast gzip, to keep up with the network
+MODE_DIR = 1 << 31  # os.ModeDir of Go, in the path stat of the container
+MODE_SYMLINK = 1 << 27  # os.ModeSymlink of Go
+
+
+def path_stat(api: docker.APIClient, container_id: str, path: str) -> Optional[Dict]:
+    """
+    Stat of a path in the container without its content, None if not found.
+    docker-py has no call for HEAD /containers/{id}/archive, so this uses the private APIClient._url and
+    APIClient._raise_for_status; keep all use of the private API here.
+    """
+    response = api.head(api._url('/containers/{0}/archive', container_id), params={'path': path},
+                        timeout=api.timeout)
+    try:
+        api._raise_for_status(response)
+    except NotFound:
+        return None
+    encoded_stat = response.headers.get('X-Docker-Container-Path-Stat')
+    return docker.utils.decode_json_header(encoded_stat) if encoded_stat else {}
+
+
+class DigestReader:
+    """Read from a file and calculate hash of the read data"""
+    def __init__(self, file):
+        self.file = file
+        self.md = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.file.read(size)
+        self.md.update(chunk)
+        return chunk
+
+    def hexdigest(self) -> str:
+        return self.md.hexdigest()
+
+
+class ChunkReader:
+    """Read from an iterator of byte chunks as from a file, e.g. to stream an archive from the container"""
+    def __init__(self, chunks: Iterator[bytes], on_chunk: Callable[[int], None]):
+        self.chunks = chunks
+        self.on_chunk = on_chunk  # called with size of each chunk
+        self.buffer = b''
+        self.offset = 0
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        while size < 0 or size > 0:
+            if self.offset >= len(self.buffer):
+                self.buffer = next(self.chunks, b'')
+                self.offset = 0
+                if not self.buffer:
+                    break  # end of stream
+                self.on_chunk(len(self.buffer))
+            end = len(self.buffer) if size < 0 else min(len(self.buffer), self.offset + size)
+            parts.append(self.buffer[self.offset:end])
+            if size > 0:
+                size -= end - self.offset
+            self.offset = end
+        return b''.join(parts)
+
+
+class Harvester:
+    """Harvest output files in a background thread while the tool runs, see TarTool.harvest"""
+    def __init__(self, harvest: Callable[[float], int], logger: Logger, interval: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.harvest = harvest  # called with the current time
+        self.logger = logger
+        self.interval = interval  # seconds between polls
+        self.clock = clock
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__run, name='harvest', daemon=True)
+
+    def start(self) -> 'Harvester':
+        self.thread.start()
+        return self
+
+    def __run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                count = self.harvest(self.clock())
+                if count:
+                    self.logger.debug(f"harvested {count} files")
+            except Exception as e:
+                # the files are downloaded after the run anyway
+                self.logger.debug(f"failed to harvest output files: {e}")
+
+    def stop(self):
+        """Stop harvesting, wait for the ongoing download"""
+        self.stopped.set()
+        self.thread.join()
 
 
 class TarTool:
     def __init__(self, logger: Logger, container: Container, upload_stats: Dict[str, List],
-                 explicit_file: Optional[str] = None):
+                 explicit_file: Optional[str] = None, stats: Optional[StatSnapshot] = None,
+                 image_cache: Optional[JsonCache] = None, output_store: Optional[BlobStore] = None,
+                 timings: Optional[Timings] = None, progress: Optional[Progress] = None,
+                 compress_upload: bool = False, digests: Optional[Dict[pathlib.Path, str]] = None,
+                 output_links: bool = False):
         self.logger = logger
         self.container = container
         self.upload_stats = upload_stats
         self.explicit_file = explicit_file
+        self.stats = stats or StatSnapshot()  # host file status, shared with file resolver
+        self.output_store = output_store  # downloaded files are stored once and linked to the host
+        self.output_links = output_links  # hard link from the output store when reflink is not supported
+        self.timings = timings or Timings()
+        self.progress = progress or Progress(enabled=False)
+        self.compress_upload = compress_upload  # compress uploaded archive, if it compresses well
+        self.digests = digests or {}  # known digests of host files by resolved path, not hashed again
+        # files downloaded while the tool runs, with their diff kind and size and modification time when downloaded,
+        # file log None when unmodified input
+        self.harvested: Dict[str, Tuple[Optional[FileLog], int, Tuple[int, int]]] = {}
+        self.unsettled: Dict[str, Tuple[Dict, float]] = {}  # files to harvest, path stat and since when unchanged
         self.time_format_seconds = "%Y-%m-%dT%H:%M:%S"
 
-        self.work_dir: str = container.image.attrs['Config'].get('WorkingDir', '.') or '/'
-        if not self.work_dir.endswith('/'):
-            self.work_dir += '/'
+        # image metadata cached by image id, image content does not change
+        self.image_cache = image_cache
+        self.image_id: str = container.attrs.get('Image', '') if image_cache else ''
+        self.image_meta: Dict = (image_cache.get(self.image_id) if self.image_id else None) or {}
+
+        if 'work_dir' in self.image_meta:
+            self.work_dir: str = self.image_meta['work_dir']
+        else:
+            self.work_dir: str = container.image.attrs['Config'].get('WorkingDir', '.') or '/'
+            if not self.work_dir.endswith('/'):
+                self.work_dir += '/'
+            self.__update_image_meta(work_dir=self.work_dir)
+
+    def __update_image_meta(self, **values):
+        """Update cached image metadata"""
+        if not self.image_id:
+            return
+        self.image_meta.update(values)
+        self.image_cache.put(self.image_id, self.image_meta)
 
     def upload(self, upload_files: Dict[pathlib.Path, str], in_files: List[FileLog]):
         if not self.explicit_file and not upload_files:
             return  # nothing to upload
+        with self.timings.phase('upload'):
+            self.__upload(upload_files, in_files)
 
+    def __upload(self, upload_files: Dict[pathlib.Path, str], in_files: List[FileLog]):
         if self.explicit_file == '-':
-            # tar from stdin
-            tar_file = tempfile.TemporaryFile()
-            try:
-                shutil.copyfileobj(sys.stdin.buffer, tar_file)
-                tar_file.seek(0)
-                self.__list_members(tar_file, in_files)
-                tar_file.seek(0)
-                self.__put_archive(tar_file)
-            finally:
-                tar_file.close()  # should be deleted by close
+            # tar from stdin, uploaded and listed on the fly
+            self.__stream_archive(sys.stdin.buffer, in_files)
         elif self.explicit_file:
             # tar file provided, use it as-it-is
-            explicit_path = pathlib.Path(self.explicit_file)
-            with explicit_path.open("rb") as tar_file:
-                self.__list_members(tar_file, in_files)
-            with explicit_path.open("rb") as tar_file:
-                self.__put_archive(tar_file)
+            with pathlib.Path(self.explicit_file).open("rb") as tar_file:
+                self.__stream_archive(tar_file, in_files)
         else:
             # collect a tar file, and upload it
             tar_file = self.__create_tar(upload_files, in_files)
@@ -64,23 +190,94 @@ class TarTool:
                 tar_file.close()
 
     def __put_archive(self, tar_content):
-        put_arc_start = timeit.default_timer()
-        self.container.put_archive(path=self.work_dir, data=tar_content)
-        self.logger.debug("put_archive time %.4f s", timeit.default_timer() - put_arc_start)
-
-    def __list_members(self, tar_content, in_files: List[FileLog]):
-        with tarfile.open(fileobj=tar_content, mode="r") as tar:
-            for m in tar.getmembers():
-                self.logger.debug(f"checking in file {m.name}")
-                # file size, modification time, upload time
-                self.upload_stats[m.name] = [m.size, m.mtime, datetime.now().timestamp()]
-                if not m.isfile():
-                    continue
-                m_fileobj = tar.extractfile(m)
-                m_file = pathlib.Path(m.name)
-                m_md = read_with_hash(m_fileobj.read)
-                in_files.append(
-                    FileLog(m_file.resolve(), m_md, datetime.fromtimestamp(m.mtime)))
+        put_arc_start = time.monotonic()
+        tar_start = tar_content.tell()
+        length = tar_content.seek(0, os.SEEK_END) - tar_start
+        tar_content.seek(tar_start)
+        compress = self.compress_upload and length >= MIN_COMPRESSED_UPLOAD
+        if compress:
+            ratio = sample_ratio(tar_content, tar_start, length)
+            compress = ratio <= MAX_COMPRESSED_UPLOAD_RATIO
+            self.logger.debug("upload sample compression ratio %.2f, %s", ratio,
+                              "compressing" if compress else "not compressing")
+        with self.progress.task('upload', total=length) as task:
+            reader = ProgressReader(tar_content, length, task)
+            if compress:
+                compressor: Optional[ParallelCompressor] = None
+
+                def compressor_for(sink) -> ParallelCompressor:
+                    nonlocal compressor
+                    compressor = ParallelCompressor(sink, 'gz', level=UPLOAD_COMPRESSION_LEVEL)
+                    return compressor
+
+                self.container.put_archive(path=self.work_dir, data=compress_stream(reader.read, compressor_for))
+                saved = compressor.in_bytes - compressor.out_bytes
+                self.logger.info(f"upload compressed {format_bytes(compressor.in_bytes)} into "
+                                 f"{format_bytes(compressor.out_bytes)}, saved {saved / max(1, length):.0%} "
+                                 f"using {compressor.cpu_seconds:.2f} s CPU")
+                self.timings.add_bytes('upload', compressor.out_bytes)
+                self.timings.add_bytes('upload_saved', saved)
+                self.timings.add_cpu('upload', compressor.cpu_seconds)
+            else:
+                self.container.put_archive(path=self.work_dir, data=reader)
+                self.timings.add_bytes('upload', reader.count)
+        self.logger.debug("put_archive time %.4f s", time.monotonic() - put_arc_start)
+
+    def __stream_archive(self, source: IO[bytes], in_files: List[FileLog]):
+        """Upload archive in a single pass, members are listed from the same data by a parallel reader"""
+        put_arc_start = time.monotonic()
+        try:
+            source_stat = os.fstat(source.fileno())
+            length = source_stat.st_size if stat.S_ISREG(source_stat.st_mode) else None  # unknown for a pipe
+        except (OSError, ValueError):
+            length = None  # no file descriptor
+        chunks: queue.Queue = queue.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+        errors = []
+
+        def list_members():
+            reader = ChunkReader(iter(chunks.get, None), lambda count: None)
+            try:
+                # compressed archive is uploaded as-is, the engine decompresses it
+                self.__list_members(tarfile.open(fileobj=DecompressReader(reader), mode="r|"), in_files)
+            except (tarfile.TarError, OSError) as e:
+                errors.append(e)
+            finally:
+                while reader.read(STREAM_CHUNK_SIZE):
+                    pass  # let the upload proceed
+
+        def tee() -> Iterator[bytes]:
+            try:
+                for chunk in iter(lambda: source.read(STREAM_CHUNK_SIZE), b''):
+                    chunks.put(chunk)
+                    task.advance(len(chunk))
+                    self.timings.add_bytes('upload', len(chunk))
+                    yield chunk
+            finally:
+                chunks.put(None)
+
+        lister = threading.Thread(target=list_members, name='list-members', daemon=True)
+        lister.start()
+        try:
+            with self.progress.task('upload', total=length) as task:
+                self.container.put_archive(path=self.work_dir, data=tee())
+        finally:
+            if lister.is_alive():
+                chunks.put(None)  # upload failed before the end of data
+            lister.join()
+        if errors:
+            raise errors[0]
+        self.logger.debug("put_archive time %.4f s", time.monotonic() - put_arc_start)
+
+    def __list_members(self, tar: tarfile.TarFile, in_files: List[FileLog]):
+        for m in tar:
+            self.logger.debug(f"checking in file {m.name}")
+            # file size, modification time, upload time
+            self.upload_stats[m.name] = [m.size, m.mtime, datetime.now().timestamp()]
+            if not m.isfile():
+                continue
+            m_md = read_with_hash(tar.extractfile(m).read)
+            in_files.append(
+                FileLog(self.stats.resolve(pathlib.Path(m.name)), m_md, datetime.fromtimestamp(m.mtime)))
 
     def __create_tar(self, upload_files: Dict[pathlib.Path, str], in_files: List[FileLog]):
         file_out = tempfile.TemporaryFile()
@@ -101,31 +298,49 @@ class TarTool:
                     tar.addfile(self.__new_directory(a_parent.as_posix()))
                 a_parent = a_parent.parent
 
-            if not host_file.exists():
+            host_stat = self.stats.stat(host_file)
+            if host_stat is None:
                 # no host file, must be explicitly added directory for output
                 tar.addfile(self.__new_directory(arc_name))
             else:
-                tar_file = tar.gettarinfo(host_file, arcname=arc_name)
-                tar_file.mode = 511  # 777 - allow all to access (uid may be different in container)
+                tar_file = self.__tar_info_for(arc_name, host_stat)
                 # file size, modification time, upload time
                 self.upload_stats[arc_name] = [tar_file.size, tar_file.mtime, datetime.now().timestamp()]
-                if host_file.is_file():
-                    # put file to tar
-                    with host_file.open("rb") as f:
-                        tar.addfile(tar_file, fileobj=f)
-                    # create log entry
+                if tar_file.isfile():
+                    # put file to tar, calculate hash for log entry on the way unless already known
+                    resolved = self.stats.resolve(host_file)
+                    digest = self.digests.get(resolved)
                     with host_file.open("rb") as f:
-                        file_md = read_with_hash(f.read)
-                    in_files.append(
-                        FileLog(host_file.resolve(), file_md, datetime.fromtimestamp(host_file.stat().st_mtime)))
-                elif host_file.is_dir():
+                        if digest:
+                            tar.addfile(tar_file, fileobj=f)
+                        else:
+                            reader = DigestReader(f)
+                            tar.addfile(tar_file, fileobj=reader)
+                            digest = reader.hexdigest()
+                    in_files.append(FileLog(resolved, digest, datetime.fromtimestamp(host_stat.st_mtime)))
+                else:
                     # add directory to tar
                     tar.addfile(tar_file)
-                else:
-                    raise Exception(f"Cannot upload file of unknown type {arc_name}")
         file_out.seek(0)
         return file_out
 
+    @classmethod
+    def __tar_info_for(cls, name: str, host_stat: os.stat_result) -> tarfile.TarInfo:
+        """Create tar header for uploaded file from its status"""
+        tar_file = tarfile.TarInfo(name)
+        if stat.S_ISREG(host_stat.st_mode):
+            tar_file.type = tarfile.REGTYPE
+            tar_file.size = host_stat.st_size
+        elif stat.S_ISDIR(host_stat.st_mode):
+            tar_file.type = tarfile.DIRTYPE
+        else:
+            raise Exception(f"Cannot upload file of unknown type {name}")
+        tar_file.uid = host_stat.st_uid
+        tar_file.gid = host_stat.st_gid
+        tar_file.mtime = host_stat.st_mtime
+        tar_file.mode = 511  # 777 - allow all to access (uid may be different in container)
+        return tar_file
+
     @classmethod
     def __new_directory(cls, name: str) -> tarfile.TarInfo:
         p_file = tarfile.TarInfo(name)
@@ -135,6 +350,19 @@ class TarTool:
         p_file.mode = 511  # 777 - allow all to access (uid may be different in container)
         return p_file
 
+    def __read_ignore_file(self, candidates: List[str]) -> List[str]:
+        """Read container specific ignore rules, from cache unless the file was touched by this run"""
+        ignore_file = pathlib.Path(self.work_dir) / IGNORE_FILENAME
+        if ignore_file.as_posix() in candidates:
+            self.logger.debug(f"{IGNORE_FILENAME} modified in container, not using the image defaults")
+            return self.__read_config_file(ignore_file, skip_comment=True)
+        if 'ignore' in self.image_meta:
+            # empty list if the image has no ignore file
+            return self.image_meta['ignore'].copy()
+        ignore_paths = self.__read_config_file(ignore_file, skip_comment=True)
+        self.__update_image_meta(ignore=ignore_paths.copy())
+        return ignore_paths
+
     def __read_config_file(self, filepath: pathlib.Path, skip_comment: bool = False) -> List[str]:
         """Read configuration file.
         Returns a list of strings, where one index represents single line of the file.
@@ -168,17 +396,62 @@ class TarTool:
                        file_paths: List[str] = None, implicit_output=True) -> List[FileLog]:
         """Download modified files, filtered as required"""
         # check all modified (includes the ones we uploaded)
-        candidates = sorted(
-            [d['Path'] for d in filter(lambda f: 'Path' in f, self.container.diff() or [])], reverse=True)
+        with self.timings.phase('diff'):
+            changes = self.container.diff() or []
+        with self.timings.phase('download'):
+            return self.__download_files(changes, filters, no_defaults, file_paths, implicit_output)
+
+    def harvest(self, grace: float, now: float, filters: List[FileMatcher] = None, no_defaults: bool = False,
+                file_paths: List[str] = None, implicit_output=True) -> int:
+        """Download output files of the running tool which have not changed for 'grace' seconds"""
+        changes = self.container.diff() or []
+        kinds = {d['Path']: d.get('Kind') for d in changes if 'Path' in d}
+        candidates = self.__filter_files(sorted(kinds, reverse=True), filters, no_defaults)
+        if not implicit_output:
+            candidates = [c for c in candidates if self.__in_paths(c, file_paths)]
+        count = 0
+        for path in candidates:
+            if path in self.harvested and self.harvested[path][1] == kinds[path]:
+                continue  # a later change is found by the download after the run
+            path_stat = self.__path_stat(path)
+            if path_stat is None or path_stat.get('mode', 0) & (MODE_DIR | MODE_SYMLINK):
+                continue  # removed, or not a regular file; got by the final download
+            unsettled = self.unsettled.get(path)
+            if not unsettled or unsettled[0] != path_stat:
+                self.unsettled[path] = path_stat, now  # new or still changing, wait for the grace period
+                continue
+            if now - unsettled[1] < grace:
+                continue
+            del self.unsettled[path]
+            member_stats: Dict[str, Tuple[int, int]] = {}
+            out_files = self.__download_file_set(path, {path}, bytes_name='harvest', member_stats=member_stats)
+            if path in member_stats:
+                self.harvested[path] = (out_files[0] if out_files else None), kinds[path], member_stats[path]
+                count += 1
+        return count
+
+    def harvested_files(self) -> List[FileLog]:
+        """Files downloaded by harvesting while the tool was running"""
+        return [h[0] for h in self.harvested.values() if h[0]]
+
+    def __download_files(self, changes: List[Dict], filters: Optional[List[FileMatcher]], no_defaults: bool,
+                         file_paths: Optional[List[str]], implicit_output: bool) -> List[FileLog]:
+        candidates = sorted([d['Path'] for d in filter(lambda f: 'Path' in f, changes)], reverse=True)
         # note: candidates start with / as path container absolute
         candidates = self.__filter_files(candidates, filters, no_defaults)
 
         # write to a tar?
         explicit_file = None
+        compressor = None
         try:
             if self.explicit_file == '-':
                 # write tar to stdout
                 explicit_file = tarfile.open(mode="w|", fileobj=sys.stdout.buffer)
+            elif self.explicit_file and compression_by_name(self.explicit_file):
+                # write compressed tar file, compressed in parallel while written
+                compressor = ParallelCompressor(open(self.explicit_file, "wb"),
+                                                compression_by_name(self.explicit_file))
+                explicit_file = tarfile.open(mode="w|", fileobj=compressor)
             elif self.explicit_file:
                 # write tar file
                 explicit_file = tarfile.open(self.explicit_file, "w")
@@ -217,6 +490,24 @@ class TarTool:
             return out_files
         finally:
             explicit_file and explicit_file.close()
+            if compressor:
+                try:
+                    compressor.close()
+                finally:
+                    compressor.file.close()
+                self.logger.debug("compressed %d bytes into %d bytes", compressor.in_bytes, compressor.out_bytes)
+
+    def __in_paths(self, file: str, file_paths: Optional[List[str]]) -> bool:
+        """Is file in one of the explicit result paths?"""
+        for fp in file_paths or []:
+            fp_in_cont = (pathlib.Path(self.work_dir) / fp).as_posix()
+            if file == fp_in_cont or file.startswith(fp_in_cont.rstrip('/') + '/'):
+                return True
+        return False
+
+    def __path_stat(self, path: str) -> Optional[Dict]:
+        """Stat of a path in the container without downloading it, None if not found"""
+        return path_stat(self.container.client.api, self.container.id, path)
 
     def __filter_files(self, candidates: List[str], filters: List[FileMatcher] = None,
                        no_defaults: bool = False) -> List[str]:
@@ -229,8 +520,7 @@ class TarTool:
                                      if f.include] if filters else []
 
         # Check if container has .cincanignore file - these are not downloaded by default
-        ignore_file = pathlib.Path(self.work_dir) / IGNORE_FILENAME
-        ignore_paths = self.__read_config_file(ignore_file, skip_comment=True)
+        ignore_paths = self.__read_ignore_file(candidates)
         # Ignore the ignorefile itself..
         ignore_paths.append(IGNORE_FILENAME)
         # remove files which are paths to files
@@ -300,27 +590,38 @@ class TarTool:
                 candidates = filth.filter_download_files(candidates, self.work_dir)
         return candidates
 
-    def __download_file_set(self, file_path: str, files: Set[str],
-                            write_to: Optional[tarfile.TarFile] = None) -> List[FileLog]:
-        """Download files by a path, copy matching files into host"""
+    def __download_file_set(self, file_path: str, files: Set[str], write_to: Optional[tarfile.TarFile] = None,
+                            bytes_name: str = 'download',
+                            member_stats: Optional[Dict[str, Tuple[int, int]]] = None) -> List[FileLog]:
+        """Download files by a path, copy matching files into host, size and mtime of them into 'member_stats'"""
         base_path = pathlib.Path(file_path)
 
         # fetch the path from container in its own tar ball
-        get_arc_start = timeit.default_timer()
+        get_arc_start = time.monotonic()
         try:
-            chunks, _ = self.container.get_archive(file_path)
+            chunks, path_stat = self.container.get_archive(file_path)
         except docker.errors.NotFound:
             self.logger.debug("Not found in container: %s", file_path)
             return []
 
-        # read the tarball into temp file
-        tmp_tar = tempfile.TemporaryFile()
-        for c in chunks:
-            tmp_tar.write(c)
-        self.logger.debug("get_archive %s time %.4f s", file_path, timeit.default_timer() - get_arc_start)
+        def downloaded(count: int):
+            task.advance(count)
+            self.timings.add_bytes(bytes_name, count)
+
+        # stream the tarball, members are written into host or into the output tar as they come
+        is_dir = path_stat.get('mode', 0) & MODE_DIR
+        with self.progress.task(f"download {file_path}", total=None if is_dir else path_stat.get('size')) as task:
+            reader = ChunkReader(iter(chunks), downloaded)
+            down_tar = tarfile.open(fileobj=reader, mode="r|")
+            out_files = self.__download_members(down_tar, base_path, files, write_to, member_stats)
+            while reader.read(65536):
+                pass  # consume the trailing padding, so the connection can be reused
+        self.logger.debug("get_archive %s time %.4f s", file_path, time.monotonic() - get_arc_start)
+        return out_files
 
-        tmp_tar.seek(0)
-        down_tar = tarfile.open(fileobj=tmp_tar, mode="r|")
+    def __download_members(self, down_tar: tarfile.TarFile, base_path: pathlib.Path, files: Set[str],
+                           write_to: Optional[tarfile.TarFile],
+                           member_stats: Optional[Dict[str, Tuple[int, int]]] = None) -> List[FileLog]:
         out_files = []
         for tar_file in down_tar:
             file_in_cont = (base_path.parent or base_path) / tar_file.name
@@ -328,6 +629,13 @@ class TarTool:
             if cont_full_name not in files:
                 continue  # not interested in this
             files.remove(cont_full_name)
+            if member_stats is not None:
+                member_stats[cont_full_name] = tar_file.size, int(tar_file.mtime)
+            harvested = self.harvested.get(cont_full_name)
+            if harvested and harvested[2] == (tar_file.size, int(tar_file.mtime)):
+                # harvested while the tool was running, not changed since
+                harvested[0] and out_files.append(harvested[0])
+                continue
 
             if cont_full_name.startswith(self.work_dir):
                 file_in_host = pathlib.Path(cont_full_name[len(self.work_dir):])
@@ -346,22 +654,26 @@ class TarTool:
             md = ''
             timestamp = datetime.now()
             if write_to:
-                # write file to tar, calculate hash
-                with tempfile.TemporaryFile() as temp_file:
-                    tf_data = down_tar.extractfile(tar_file)
-                    md = read_with_hash(tf_data.read, temp_file.write)
-
-                    write_tf = tarfile.TarInfo(file_in_host.as_posix())
-                    write_tf.mtime = tar_file.mtime
-                    write_tf.mode = tar_file.mode
-                    write_tf.size = temp_file.tell()
-                    temp_file.seek(0)
-                    write_to.addfile(write_tf, fileobj=temp_file)
+                # stream file to tar, calculate hash on the way
+                write_tf = tarfile.TarInfo(file_in_host.as_posix())
+                write_tf.mtime = tar_file.mtime
+                write_tf.mode = tar_file.mode
+                if tar_file.isfile():
+                    write_tf.size = tar_file.size
+                    tf_data = DigestReader(down_tar.extractfile(tar_file))
+                    write_to.addfile(write_tf, fileobj=tf_data)
+                    md = tf_data.hexdigest()
+                else:
+                    write_tf.type = tar_file.type
+                    write_tf.linkname = tar_file.linkname
+                    write_to.addfile(write_tf)
+            elif tar_file.isfile() and self.output_store:
+                md = self.__download_to_store(down_tar.extractfile(tar_file), file_in_host, modified)
             elif tar_file.isfile():
                 # this is a file we were looking for
                 if not file_in_host.exists():
                     # no local file or explicit output asked, this is too easy
-                    self.logger.info(f"=> {file_in_host.as_posix()}")
+                    self.__log_output(f"=> {file_in_host.as_posix()}")
                     tf_data = down_tar.extractfile(tar_file)
                     if file_in_host.parent:
                         file_in_host.parent.mkdir(parents=True, exist_ok=True)
@@ -379,7 +691,7 @@ class TarTool:
                     with temp_file.open("wb") as f:
                         md = read_with_hash(tf_data.read, f.write)
 
-                    self.logger.info(f"=> {file_in_host.as_posix()}")
+                    self.__log_output(f"=> {file_in_host.as_posix()}")
                     if modified:
                         # modified by timestamp or size, overwrite
                         file_in_host.unlink()
@@ -403,15 +715,50 @@ class TarTool:
             else:
                 if not file_in_host.exists():
                     # must be a directory we need
-                    self.logger.info(f"=> {file_in_host.as_posix()}/")
+                    self.__log_output(f"=> {file_in_host.as_posix()}/")
                     file_in_host.mkdir(parents=True, exist_ok=True)
                     timestamp = datetime.fromtimestamp(file_in_host.stat().st_mtime)
                 else:
                     pass  # no action required
-            out_files.append(FileLog(file_in_host.resolve(), md, timestamp))
-        tmp_tar.close()
+            if tar_file.isfile():
+                # written as regular file, resolving the directory is enough
+                host_path = self.stats.resolve(file_in_host.parent) / file_in_host.name
+            else:
+                host_path = file_in_host.resolve()
+            out_files.append(FileLog(host_path, md, timestamp))
         return out_files
 
+    def __log_output(self, message: str):
+        self.progress.clear()  # do not draw over the message
+        self.logger.info(message)
+
+    def __download_to_store(self, tf_data, file_in_host: pathlib.Path, modified: bool) -> str:
+        """Download file next to the host file and share it with the output store by reflink or hard link.
+        When neither is possible the file is downloaded as is, without storing it"""
+        file_in_host.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = file_in_host.parent / f'.{file_in_host.name}.cincan-tmp'
+        try:
+            with tmp_file.open("wb") as f:
+                md = read_with_hash(tf_data.read, f.write)
+            if file_in_host.exists() and not modified:
+                with file_in_host.open("rb") as f:
+                    host_digest = read_with_hash(f.read)
+                if md == host_digest:
+                    self.logger.debug(f"identical file {file_in_host.as_posix()} digest {md}, no action")
+                    tmp_file.unlink()
+                    return md
+            self.__log_output(f"=> {file_in_host.as_posix()}")
+            if self.output_store.is_intact(md) and self.output_store.share_to(md, file_in_host, self.output_links):
+                tmp_file.unlink()  # already stored
+            else:
+                self.output_store.add_shared(tmp_file, md, self.output_links)
+                os.replace(tmp_file, file_in_host)
+        except BaseException:
+            if os.path.lexists(tmp_file):
+                os.unlink(tmp_file)
+            raise
+        return md
+
     def __check_if_modified(self, host_file: pathlib.Path, file_info: tarfile.TarInfo) -> Tuple[bool, bool]:
         """Check if file has been modified, or not modified in the container"""
         up_stat = self.upload_stats.get(host_file.as_posix())
@@ -0,0 +1,68 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+# phases in the order they happen in a run
+PHASES = ['image_lookup', 'version_check', 'file_resolution', 'hashing', 'restore', 'create', 'upload', 'exec', 'diff',
+          'download', 'removal']
+
+
+class Timings:
+    """Durations and transferred bytes of the phases of a run, measured with a monotonic clock.
+    CPU time is kept for phases which spend it in worker threads, e.g. compressing an upload"""
+    __slots__ = ('seconds', 'bytes', 'cpu')
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.bytes: Dict[str, int] = {}
+        self.cpu: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Measure a phase, durations of repeated phases are summed"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.monotonic() - start
+
+    def add_bytes(self, name: str, count: int):
+        self.bytes[name] = self.bytes.get(name, 0) + count
+
+    def add_cpu(self, name: str, seconds: float):
+        self.cpu[name] = self.cpu.get(name, 0.0) + seconds
+
+    def total(self) -> float:
+        return sum(self.seconds.values())
+
+    def to_json(self) -> Dict[str, Any]:
+        js: Dict[str, Any] = {'seconds': {k: round(v, 6) for k, v in self.seconds.items()}}
+        if self.bytes:
+            js['bytes'] = dict(self.bytes)
+        if self.cpu:
+            js['cpu_seconds'] = {k: round(v, 6) for k, v in self.cpu.items()}
+        return js
+
+    @classmethod
+    def from_json(cls, js: Dict[str, Any]) -> 'Timings':
+        timings = Timings()
+        timings.seconds = dict(js.get('seconds', {}))
+        timings.bytes = dict(js.get('bytes', {}))
+        timings.cpu = dict(js.get('cpu_seconds', {}))
+        return timings
+
+    def summary(self) -> str:
+        """Summary table of the phases"""
+        all_names = set(self.seconds) | set(self.bytes) | set(self.cpu)
+        names = [p for p in PHASES if p in all_names]
+        names += sorted(all_names - set(names))
+        lines = [f"{'phase':<16} {'seconds':>10} {'bytes':>14}" + (f" {'cpu seconds':>12}" if self.cpu else '')]
+        for name in names:
+            b = self.bytes.get(name)
+            line = f"{name:<16} {self.seconds.get(name, 0.0):>10.4f} {'' if b is None else b:>14}"
+            if self.cpu:
+                c = self.cpu.get(name)
+                line += f" {'' if c is None else f'{c:.4f}':>12}"
+            lines.append(line)
+        lines.append(f"{'total':<16} {self.total():>10.4f} {'':>14}" + (f" {'':>12}" if self.cpu else ''))
+        return '\n'.join(lines) + '\n'
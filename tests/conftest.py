@@ -3,6 +3,9 @@ import pathlib
 from typing import List
 import shutil
 import io
+from unittest import mock
+from benchmarks.fake_engine import FakeEngine, FakeEngineServer
+from cincan.cache import JsonCache
 from cincan.frontend import ToolImage
 
 @pytest.fixture(autouse=True, scope="function")
@@ -19,6 +22,34 @@ def tool(request):
     yield tool
 
 
+@pytest.fixture(scope='function')
+def mock_tool(tmp_path):
+    """Tool with mocked Docker client, for tests which do not need Docker"""
+    with mock.patch('docker.from_env') as from_env, mock.patch('docker.APIClient'), \
+            mock.patch('cincan.frontend.ImageFetcher') as fetcher:
+        from_env.return_value.api.base_url = 'http+docker://localhost'
+        fetcher.return_value.get_image.return_value.id = 'sha256:1234'
+        tool = ToolImage(image='quay.io/cincan/test:dev', batch=True)
+    tool.image_cache = JsonCache(tmp_path / 'images')
+    tool.background_cleanup = False
+    yield tool
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """Fake Docker Engine in DOCKER_HOST, for tests which exercise the Docker API without Docker.
+    Home is a temporary directory, so that the configuration and caches of the user are not touched"""
+    monkeypatch.setenv('HOME', (tmp_path / 'home').as_posix())
+    (tmp_path / 'home').mkdir()
+    socket_path = tmp_path / 'docker.sock'
+    server = FakeEngineServer(socket_path.as_posix(), FakeEngine())
+    server.start()
+    monkeypatch.setenv('DOCKER_HOST', f'unix://{socket_path.as_posix()}')
+    yield server.engine
+    server.shutdown()
+    server.server_close()
+
+
 @pytest.fixture(scope="session", autouse=True)
 def delete_temporary_files(request, tmp_path_factory):
     """Cleanup a testing directory once we are finished."""
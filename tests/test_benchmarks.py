@@ -0,0 +1,16 @@
+import json
+
+from benchmarks import suite
+
+
+def test_benchmark_history(tmp_path, capsys):
+    history = tmp_path / 'history.jsonl'
+    results = suite.main(['--filter', 'unpack_container_stream', '--repeat', '1', '--history', history.as_posix()])
+    assert list(results) == ['unpack_container_stream']
+    suite.main(['--filter', 'unpack_container_stream', '--repeat', '1', '--history', history.as_posix()])
+
+    records = [json.loads(line) for line in history.read_text().splitlines()]
+    assert len(records) == 2
+    assert records[0]['version'] == records[1]['version']
+    assert records[1]['results']['unpack_container_stream']['items'] == 10000
+    assert '%' in capsys.readouterr().out.splitlines()[-1]  # change to the previous run
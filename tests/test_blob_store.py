@@ -0,0 +1,91 @@
+import hashlib
+import io
+import json
+import sys
+
+import pytest
+
+from cincan.blob_store import BlobStore
+from cincan.configuration import Configuration
+from cincan.frontend import main
+
+
+def test_add_and_copy(tmp_path):
+    store = BlobStore(tmp_path / 'store')
+    digest = store.add(io.BytesIO(b'data'))
+    assert digest == hashlib.sha256(b'data').hexdigest()
+    assert store.contains(digest)
+    assert store.size_of(digest) == 4
+
+    target = tmp_path / 'out' / 'data.bin'
+    store.copy_to(digest, target)
+    assert target.read_bytes() == b'data'
+    target.write_bytes(b'modified')  # a copy, not the stored file
+    assert store.path_for(digest).read_bytes() == b'data'
+
+    store.copy_to(digest, target, link=True)  # replaces existing file
+    assert target.read_bytes() == b'data'
+    assert [p.name for p in target.parent.iterdir()] == ['data.bin']
+
+
+def test_modified_file_replaced(tmp_path):
+    store = BlobStore(tmp_path / 'store')
+    digest = store.add(io.BytesIO(b'data'))
+    stored = store.path_for(digest)
+    stored.chmod(0o644)
+    stored.write_bytes(b'edited through a hard link')
+    assert not store.is_intact(digest)
+    assert store.add(io.BytesIO(b'data')) == digest
+    assert store.is_intact(digest) and stored.read_bytes() == b'data'
+    stored.chmod(0o644)
+    stored.write_bytes(b'edited again')
+    assert store.add(io.BytesIO(b'data'), digest) == digest
+    assert stored.read_bytes() == b'data'
+
+
+def test_add_shared(tmp_path, monkeypatch):
+    monkeypatch.setattr(BlobStore, '_BlobStore__reflink', classmethod(lambda cls, source, target: False))
+    store = BlobStore(tmp_path / 'store')
+    file = tmp_path / 'data.bin'
+    file.write_bytes(b'data')
+    digest = hashlib.sha256(b'data').hexdigest()
+    assert not store.add_shared(file, digest)  # neither reflink nor hard link, not stored
+    assert not store.contains(digest)
+
+    assert store.add_shared(file, digest, link=True)
+    assert store.path_for(digest).stat().st_nlink == 2
+    assert store.is_intact(digest)  # linked, hashed again
+    target = tmp_path / 'out' / 'data.bin'
+    assert not store.share_to(digest, target)
+    assert not target.exists()
+    assert store.share_to(digest, target, link=True)
+    assert store.path_for(digest).stat().st_nlink == 3
+
+
+def test_remove_unreferenced(tmp_path):
+    store = BlobStore(tmp_path / 'store')
+    keep = store.add(io.BytesIO(b'keep'))
+    drop = store.add(io.BytesIO(b'drop'))
+    assert store.remove_unreferenced({keep}, dry_run=True) == (1, 4)
+    assert store.contains(drop)
+    assert store.remove_unreferenced({keep}) == (1, 4)
+    assert list(store.digests()) == [keep]
+
+
+def test_gc_requires_command_log(tmp_path, monkeypatch, capsys):
+    config_file = tmp_path / 'config.json'
+    config_file.write_text(json.dumps({'store_directory': (tmp_path / 'store').as_posix()}))
+    monkeypatch.setattr('cincan.frontend.Configuration', lambda: Configuration(config_file))
+    store = BlobStore(tmp_path / 'store')
+    digest = store.add(io.BytesIO(b'data'))
+
+    monkeypatch.setattr(sys, 'argv', ['cincan', 'gc'])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert 'use --force' in str(e.value.code)
+    assert store.contains(digest)
+
+    monkeypatch.setattr(sys, 'argv', ['cincan', 'gc', '--force'])
+    main()
+    assert 'Removed 1 files, 4 bytes' in capsys.readouterr().out
+    assert not store.contains(digest)
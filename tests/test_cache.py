@@ -0,0 +1,37 @@
+import time
+from cincan.cache import JsonCache
+
+
+def test_json_cache(tmp_path):
+    cache = JsonCache(tmp_path / 'cache')
+    assert cache.get('sha256:abc') is None
+    cache.put('sha256:abc', {'work_dir': '/home/appuser/', 'ignore': []})
+    assert cache.get('sha256:abc') == {'work_dir': '/home/appuser/', 'ignore': []}
+    assert cache.get('sha256:abd') is None
+
+    cache.put('sha256:abc', {'work_dir': '/'})
+    assert cache.get('sha256:abc') == {'work_dir': '/'}
+    assert len(list((tmp_path / 'cache').iterdir())) == 1
+
+    cache.remove('sha256:abc')
+    assert cache.get('sha256:abc') is None
+    cache.remove('sha256:abc')
+
+
+def test_json_cache_expiration(tmp_path):
+    cache = JsonCache(tmp_path, ttl=60)
+    cache.put('quay.io/cincan/test:latest', {'tag': 'dev'})
+    assert cache.get('quay.io/cincan/test:latest') == {'tag': 'dev'}
+
+    entry = cache.get_entry('quay.io/cincan/test:latest')
+    entry['time'] = time.time() - 61
+    assert cache.is_expired(entry)
+    assert not JsonCache(tmp_path).is_expired(entry)
+
+
+def test_json_cache_broken_entry(tmp_path):
+    cache = JsonCache(tmp_path)
+    cache.put('key', {'a': 1})
+    for f in tmp_path.iterdir():
+        f.write_text('{"key": "ke')
+    assert cache.get('key') is None
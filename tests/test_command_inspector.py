@@ -0,0 +1,58 @@
+import pathlib
+from datetime import datetime, timedelta
+
+from cincan.command_inspector import CommandInspector
+from cincan.command_log import CommandLog, FileLog, CommandLogWriter, CommandLogIndex
+
+
+def digest_of(name: str) -> str:
+    return name.encode('ascii').hex().ljust(64, '0')
+
+
+def log_entry(n: int, in_files, out_files) -> CommandLog:
+    log = CommandLog(['cincan/test', str(n)], datetime(2021, 3, 1) + timedelta(seconds=n))
+    log.in_files = [FileLog(pathlib.Path('/work') / f, digest_of(f)) for f in in_files]
+    log.out_files = [FileLog(pathlib.Path('/work') / f, digest_of(f)) for f in out_files]
+    return log
+
+
+def test_fanin_and_fanout(tmp_path):
+    writer = CommandLogWriter(tmp_path)
+    writer.write(log_entry(1, ['sample.zip'], ['a.txt', 'b.txt']))
+    writer.write(log_entry(2, ['a.txt'], ['a.json']))
+    writer.write(log_entry(3, ['a.json', 'b.txt'], ['report.html']))
+    writer.write(log_entry(4, ['other'], ['other.json']))
+    inspector = CommandInspector(CommandLogIndex(tmp_path), pathlib.Path('/work'))
+
+    dep = inspector.fanin(pathlib.Path('/work/report.html'), 3, digest=digest_of('report.html'))
+    assert [c.command.command for c in dep.next] == [['cincan/test', '3']]
+    assert [f.file.as_posix() for f in dep.next[0].next] == ['a.json', 'b.txt']
+    a_json, b_txt = dep.next[0].next
+    assert [c.command.command for c in a_json.next] == [['cincan/test', '2']]
+    assert [c.command.command for c in b_txt.next] == [['cincan/test', '1']]
+    # depth exhausted
+    assert a_json.next[0].next[0].next[0].next[0].next == []
+
+    dep = inspector.fanout(pathlib.Path('/work/sample.zip'), 5, digest=digest_of('sample.zip'))
+    assert str(dep) == '\n'.join([
+        'sample.zip 73616d706c652e7a',
+        '|-- cincan/test 1',
+        '    |-->a.txt 612e747874000000',
+        '        |-- cincan/test 2',
+        '            |-->a.json 612e6a736f6e0000',
+        '                |-- cincan/test 3',
+        '                    |-->report.html 7265706f72742e68',
+        '    |-->b.txt 622e747874000000',
+        '        |-- cincan/test 3',
+        '            |-->report.html 7265706f72742e68',
+    ])
+
+
+def test_no_digest(tmp_path):
+    writer = CommandLogWriter(tmp_path)
+    log = log_entry(1, [], [])
+    log.out_files = [FileLog(pathlib.Path('/work/dir'), '')]
+    writer.write(log)
+    inspector = CommandInspector(CommandLogIndex(tmp_path), pathlib.Path('/work'))
+    dep = inspector.fanin(pathlib.Path('/work/no-such-file'), 3)
+    assert dep.next == []
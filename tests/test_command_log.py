@@ -0,0 +1,158 @@
+import json
+import multiprocessing
+import pathlib
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from cincan.command_log import CommandLog, FileLog, CommandLogWriter, CommandLogIndex, CommandLogStore, \
+    JSON_TIME_FORMAT, LOG_DB_NAME
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', (tmp_path / 'home').as_posix())
+    (tmp_path / 'home' / '.cincan').mkdir(parents=True)
+    yield tmp_path / 'home'
+
+
+def new_log(n: int) -> CommandLog:
+    log = CommandLog(['cincan/test', 'cmd', str(n)], datetime(2021, 3, 1) + timedelta(seconds=n))
+    log.in_files.append(FileLog(pathlib.Path(f'/samples/in-{n}'), f'{n:064x}'))
+    log.out_files.append(FileLog(pathlib.Path(f'/samples/out-{n}'), f'{n + 1:064x}', datetime(2021, 3, 2)))
+    return log
+
+
+def test_write_and_list(tmp_path):
+    writer = CommandLogWriter(tmp_path / 'logs')
+    for n in [2, 0, 1]:
+        writer.write(new_log(n))
+    index = CommandLogIndex(tmp_path / 'logs')
+    assert [e.command[-1] for e in index.list_entries()] == ['0', '1', '2']
+    assert [e.command[-1] for e in index.list_entries(reverse=True)] == ['2', '1', '0']
+    entry = next(iter(index.list_entries()))
+    assert entry.to_json() == new_log(0).to_json()
+
+
+def test_migrate_legacy_files(tmp_path):
+    log_dir = tmp_path / 'logs'
+    log_dir.mkdir()
+    for n in range(5):
+        with (log_dir / f'2021-03-01-00-00-0{n}-000000').open('w') as f:
+            json.dump(new_log(n).to_json(), f)
+    (log_dir / 'broken').write_text('{')
+    (log_dir / 'no-timestamp').write_text('{"command": ["cincan/test"]}')
+
+    index = CommandLogIndex(log_dir)
+    assert [e.command[-1] for e in index.list_entries()] == ['0', '1', '2', '3', '4']
+    assert sorted(f.name for f in log_dir.iterdir() if not f.name.startswith(LOG_DB_NAME)) == \
+        ['broken', 'no-timestamp']
+
+    # file left behind by interrupted migration is not added twice
+    with (log_dir / '2021-03-01-00-00-01-000000').open('w') as f:
+        json.dump(new_log(1).to_json(), f)
+    assert index.store.migrate(log_dir) == 0
+    assert len(index.store) == 5
+
+
+def append_logs(log_dir: pathlib.Path, first: int):
+    store = CommandLogStore(log_dir / LOG_DB_NAME)
+    for n in range(first, first + 50):
+        store.append(new_log(n))
+    store.close()
+
+
+def test_concurrent_appends(tmp_path):
+    CommandLogWriter(tmp_path)
+    processes = [multiprocessing.Process(target=append_logs, args=(tmp_path, i * 50)) for i in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+        assert p.exitcode == 0
+    entries = list(CommandLogIndex(tmp_path).list_entries())
+    assert [int(e.command[-1]) for e in entries] == list(range(200))
+
+
+def test_logs_of_all_users(home):
+    writer = CommandLogWriter()
+    writer.write(new_log(1))
+    other = home / '.cincan' / 'shared' / 'other-user' / 'logs'
+    CommandLogWriter(other).write(new_log(2))
+    not_migrated = home / '.cincan' / 'shared' / 'old-user' / 'logs'
+    not_migrated.mkdir(parents=True)
+    with (not_migrated / new_log(0).timestamp.strftime(JSON_TIME_FORMAT)).open('w') as f:
+        json.dump(new_log(0).to_json(), f)
+
+    index = CommandLogIndex()
+    assert [e.command[-1] for e in index.list_entries()] == ['0', '1', '2']
+    # other users logs are not migrated by us
+    assert len(list(not_migrated.iterdir())) == 1
+    assert index.referenced_digests() == {f'{n:064x}' for n in range(4)}
+
+
+def test_digest_index_of_old_database(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / LOG_DB_NAME))
+    connection.executescript("""
+        CREATE TABLE commands (id INTEGER PRIMARY KEY, timestamp TEXT NOT NULL, entry TEXT NOT NULL);
+        CREATE INDEX commands_by_time ON commands(timestamp);
+        CREATE TABLE migrated (name TEXT PRIMARY KEY);
+        PRAGMA user_version=1;
+    """)
+    js = new_log(1).to_json()
+    connection.execute('INSERT INTO commands(timestamp, entry) VALUES (?, ?)', (js['timestamp'], json.dumps(js)))
+    connection.commit()
+    connection.close()
+
+    index = CommandLogIndex(tmp_path)
+    index.store.append(new_log(2))
+    assert [e.command[-1] for e in index.producers_of(f'{2:064x}')] == ['1']
+    assert [e.command[-1] for e in index.consumers_of(f'{2:064x}')] == ['2']
+    assert list(index.consumers_of('')) == []
+
+
+def test_old_database_of_other_user_not_written(home):
+    other = home / '.cincan' / 'shared' / 'other-user' / 'logs'
+    other.mkdir(parents=True)
+    connection = sqlite3.connect(str(other / LOG_DB_NAME))
+    connection.executescript("""
+        CREATE TABLE commands (id INTEGER PRIMARY KEY, timestamp TEXT NOT NULL, entry TEXT NOT NULL);
+        CREATE INDEX commands_by_time ON commands(timestamp);
+        CREATE TABLE migrated (name TEXT PRIMARY KEY);
+        PRAGMA user_version=1;
+    """)
+    js = new_log(1).to_json()
+    connection.execute('INSERT INTO commands(timestamp, entry) VALUES (?, ?)', (js['timestamp'], json.dumps(js)))
+    connection.commit()
+    connection.close()
+    (other / LOG_DB_NAME).chmod(0o444)
+    content = (other / LOG_DB_NAME).read_bytes()
+
+    index = CommandLogIndex()
+    assert [e.command[-1] for e in index.list_entries()] == ['1']
+    assert [e.command[-1] for e in index.producers_of(f'{2:064x}')] == ['1']
+    assert index.referenced_digests() == {f'{1:064x}', f'{2:064x}'}
+    for store in index.stores:
+        store.close()
+    assert (other / LOG_DB_NAME).read_bytes() == content
+    assert sorted(f.name for f in other.iterdir()) == [LOG_DB_NAME]
+
+
+def test_compact_entries():
+    js = new_log(1).to_json()
+    log = CommandLog.from_json(js)
+    assert not hasattr(log, '__dict__')
+    assert log.to_json() == js
+    assert log.streams is None
+    assert log.stdout == b''
+    log.stdout += b'data'
+    assert log.stdout == b'data' and log.stderr == b''
+
+    assert log.in_files[0].raw_digest == (1).to_bytes(32, 'big')
+    assert log.in_files[0].digest == f'{1:064x}'
+    assert FileLog(pathlib.Path('/dev/stdout'), '').digest == ''
+    assert FileLog(pathlib.Path('/dev/stdout'), 'not-hex').to_json()['sha256'] == 'not-hex'
+
+    other = CommandLog.from_json(js)
+    assert other.in_files[0].raw_path is log.in_files[0].raw_path
@@ -0,0 +1,89 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+
+import pytest
+
+from cincan.compression import DecompressReader, ParallelCompressor, compress_stream, compression_by_magic, compression_by_name, \
+    is_remote_engine, sample_ratio
+
+DECOMPRESS = {'gz': gzip.decompress, 'bz2': bz2.decompress, 'xz': lzma.decompress}
+
+
+def test_detect_compression():
+    assert compression_by_name('out.tar.gz') == 'gz'
+    assert compression_by_name('out.TGZ') == 'gz'
+    assert compression_by_name('evidence.tar.xz') == 'xz'
+    assert compression_by_name('out.tar') is None
+    assert compression_by_magic(gzip.compress(b'x')) == 'gz'
+    assert compression_by_magic(bz2.compress(b'x')) == 'bz2'
+    assert compression_by_magic(lzma.compress(b'x')) == 'xz'
+    assert compression_by_magic(b'ustar') is None
+
+
+@pytest.mark.parametrize('compression', ['gz', 'bz2', 'xz'])
+def test_parallel_compressor(compression):
+    data = os.urandom(1000) * 5000  # several blocks
+    out = io.BytesIO()
+    compressor = ParallelCompressor(out, compression, jobs=3)
+    for i in range(0, len(data), 70000):
+        compressor.write(data[i:i + 70000])
+    compressor.close()
+    assert DECOMPRESS[compression](out.getvalue()) == data
+    assert compressor.in_bytes == len(data)
+    assert compressor.out_bytes == len(out.getvalue()) < len(data) / 10
+    assert compressor.cpu_seconds > 0
+
+
+def test_compress_nothing():
+    out = io.BytesIO()
+    ParallelCompressor(out, 'gz').close()
+    assert gzip.decompress(out.getvalue()) == b''
+
+
+def test_compress_stream():
+    data = b'abc' * 1000000
+    chunks = list(compress_stream(io.BytesIO(data).read, lambda sink: ParallelCompressor(sink, 'gz', level=1)))
+    assert len(chunks) > 1
+    assert gzip.decompress(b''.join(chunks)) == data
+
+
+def test_sample_ratio():
+    data = io.BytesIO(os.urandom(1024 * 1024) + b'a' * 4 * 1024 * 1024)
+    assert sample_ratio(data, 0, 1024 * 1024) > 0.99
+    assert sample_ratio(data, 1024 * 1024, 4 * 1024 * 1024) < 0.01
+    assert 0.1 < sample_ratio(data, 0, 5 * 1024 * 1024) < 0.5  # spread over the data
+    assert data.tell() == 0
+
+
+def test_remote_engine():
+    assert not is_remote_engine('http+docker://localhost')
+    assert not is_remote_engine('http+docker://localnpipe')
+    assert not is_remote_engine('http://127.0.0.1:2375')
+    assert is_remote_engine('http+docker://ssh')
+    assert is_remote_engine('https://docker.example.com:2376')
+
+
+@pytest.mark.parametrize('compression', ['gz', 'bz2', 'xz', None])
+def test_decompress_concatenated_streams(compression):
+    data = os.urandom(100) * 10000
+    out = io.BytesIO()
+    if compression:
+        compressor = ParallelCompressor(out, compression)
+        compressor.block_size = 300 * 1000  # several streams
+        compressor.write(data)
+        compressor.close()
+    else:
+        out.write(data)
+    reader = DecompressReader(io.BytesIO(out.getvalue()), chunk_size=1000)
+    assert reader.compression == compression
+    assert reader.read(10) == data[:10]
+    assert reader.read(500_000) + reader.read() == data[10:]
+    assert reader.read() == b''
+
+
+def test_decompress_truncated():
+    with pytest.raises(EOFError):
+        DecompressReader(io.BytesIO(gzip.compress(b'abc' * 10000)[:-10])).read()
@@ -0,0 +1,320 @@
+import hashlib
+import io
+import logging
+import os
+import pathlib
+import sys
+import time
+
+import docker
+import pytest
+import requests
+
+from benchmarks.fake_engine import FakeEngine, FakeEngineServer
+from cincan.batch import BatchRunner, ping_endpoint, read_commands
+from cincan.cache import JsonCache
+from cincan.frontend import ToolImage, is_cpuset_rejected, main
+from cincan.progress import Progress
+from cincan.reaper import ContainerReaper, CONTAINER_LABEL, OWNER_LABEL, STALE_AGE
+from cincan.resources import FootprintHistory, ResourcePool
+from cincan.scheduler import Endpoint, Scheduler
+
+
+def test_run_against_fake_engine(engine, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pathlib.Path('samples').mkdir()
+    pathlib.Path('samples/a.bin').write_bytes(b'a')
+    os.utime('samples/a.bin', (1600000000, 1600000000))  # old enough to be known unmodified by the timestamp
+    tool = ToolImage(image='fake/tool:latest', batch=True)
+    tool.background_cleanup = False
+    out = tool.run_get_string(['samples/a.bin'])
+    assert out == 'ca978112ca1bbdcafac231b39a23dc4da786eff8147c4e72b9807785afee48bb  samples/a.bin\n'
+    assert tool.upload_files == ['samples/a.bin']
+    assert tool.download_files == ['samples/a.bin.sha256']
+    assert engine.requests['create'] == engine.requests['delete'] == 1
+    assert not engine.containers
+
+
+def test_harvest_while_running(engine, tmp_path, monkeypatch, caplog):
+    monkeypatch.chdir(tmp_path)
+    caplog.set_level(logging.INFO)
+    engine.run_time = 1.0
+    pathlib.Path('samples').mkdir()
+    pathlib.Path('samples/a.bin').write_bytes(b'a')
+    os.utime('samples/a.bin', (1600000000, 1600000000))
+    tool = ToolImage(image='fake/tool:latest', batch=True)
+    tool.background_cleanup = False
+    tool.harvest = True
+    tool.config.harvest_interval = 0.05
+    tool.config.harvest_grace = 0.2
+    log = tool.run_buffered(['samples/a.bin'])
+    assert log.exit_code == 0
+    assert tool.download_files == ['samples/a.bin.sha256']
+    assert pathlib.Path('samples/a.bin.sha256').read_bytes() == (
+        b'ca978112ca1bbdcafac231b39a23dc4da786eff8147c4e72b9807785afee48bb\n')
+    assert [f.digest for f in log.out_files if f.path.name == 'a.bin.sha256'] == [
+        hashlib.sha256(pathlib.Path('samples/a.bin.sha256').read_bytes()).hexdigest()]
+    assert log.timings.bytes['harvest'] > 0
+    # work directory downloaded at once after the run, the harvested file is not written again
+    assert caplog.text.count('=> samples/a.bin.sha256') == 1
+    assert log.timings.bytes['download'] > 0
+
+
+def test_harvest_of_failed_run(engine, tmp_path, monkeypatch, caplog):
+    monkeypatch.chdir(tmp_path)
+    engine.run_time = 1.0
+    pathlib.Path('samples').mkdir()
+    pathlib.Path('samples/a.bin').write_bytes(b'a')
+    os.utime('samples/a.bin', (1600000000, 1600000000))
+    tool = ToolImage(image='fake/tool:latest', batch=True)
+    tool.background_cleanup = False
+    tool.harvest = True
+    tool.config.harvest_interval = 0.05
+    tool.config.harvest_grace = 0.2
+    log = tool.run_buffered(['samples/a.bin', 'samples/missing.bin'])
+    assert log.exit_code == 1
+    # written by the harvest before the tool failed, logged although not downloaded after the run
+    assert pathlib.Path('samples/a.bin.sha256').is_file()
+    assert tool.download_files == ['samples/a.bin.sha256']
+    assert 'tool failed, files harvested while it was running are kept: samples/a.bin.sha256' in caplog.text
+
+
+def test_chatty_output_coalesced(engine, tmp_path, monkeypatch, capsysbinary):
+    monkeypatch.chdir(tmp_path)
+    engine.stdout_lines = 5000
+    tool = ToolImage(image='fake/tool:latest', batch=True)
+    tool.background_cleanup = False
+    assert tool.run([]).exit_code == 0
+    assert capsysbinary.readouterr().out == b''.join(b'%d: line of output\n' % n for n in range(5000))
+
+
+def test_failing_run_against_fake_engine(engine, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tool = ToolImage(image='fake/tool:latest', batch=True)
+    tool.background_cleanup = False
+    assert tool.run_get_string(['missing.bin']) == 'missing.bin: no such file\n'
+    assert tool.download_files == []
+
+
+def test_compressed_upload(engine, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pathlib.Path('samples').mkdir()
+    text = b''.join(b'%d: GET /index.html 200\n' % i for i in range(100000))
+    pathlib.Path('samples/access.log').write_bytes(text)
+    pathlib.Path('samples/random.bin').write_bytes(os.urandom(1024 * 1024))
+    for sample, compressed in [('samples/access.log', True), ('samples/random.bin', False)]:
+        tool = ToolImage(image='fake/tool:latest', batch=True)
+        tool.background_cleanup = False
+        tool.compress_upload = True
+        out = tool.run_get_string([sample])
+        assert out == f"{hashlib.sha256(pathlib.Path(sample).read_bytes()).hexdigest()}  {sample}\n"
+        log = tool.run([sample])
+        size = pathlib.Path(sample).stat().st_size
+        if compressed:
+            assert log.timings.bytes['upload'] < size / 5
+            assert log.timings.bytes['upload_saved'] > size / 2
+            assert log.timings.cpu['upload'] > 0
+        else:
+            assert log.timings.bytes['upload'] > size
+            assert 'upload_saved' not in log.timings.bytes
+            assert 'upload' not in log.timings.cpu
+
+
+def test_background_cleanup(engine, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('PYTHONPATH', pathlib.Path(__file__).parent.parent.as_posix())
+    tool = ToolImage(image='fake/tool:latest', batch=True)
+    tool.config.cache_directory = tmp_path / 'cache'
+    assert tool.run_get_string(['missing.bin']) == 'missing.bin: no such file\n'
+    assert 'kill' not in engine.requests  # container had exited
+
+    # detached helper removes the container after we have returned
+    reaper = ContainerReaper(tmp_path / 'cache' / 'reap')
+    deadline = time.monotonic() + 20
+    while (engine.containers or reaper.queued()) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not engine.containers
+    assert reaper.queued() == []
+
+
+def test_reaper_sweep(engine, tmp_path):
+    client = docker.from_env()
+    reaper = ContainerReaper(tmp_path / 'reap')
+    own = {CONTAINER_LABEL: 'fake/tool', OWNER_LABEL: reaper.owner}
+    c_queued = client.containers.create('fake/tool', labels=own)
+    c_stale = client.containers.create('fake/tool', labels=own)
+    c_downloading = client.containers.create('fake/tool', labels=own)  # long run, exited just now
+    c_foreign = client.containers.create('fake/tool', labels={CONTAINER_LABEL: 'fake/tool', OWNER_LABEL: 'other'})
+    c_other = client.containers.create('fake/tool')
+    for c in [c_queued, c_stale, c_downloading, c_foreign, c_other]:
+        c.start()
+        c.wait()
+        engine.containers[c.id].created -= 2 * STALE_AGE
+    engine.containers[c_stale.id].finished_at -= STALE_AGE + 1
+    engine.containers[c_foreign.id].finished_at -= STALE_AGE + 1
+
+    reaper.directory.mkdir()
+    (reaper.directory / c_queued.id).touch()
+    (reaper.directory / 'gone').touch()
+    assert sorted(reaper.queued()) == sorted([c_queued.id, 'gone'])
+    assert reaper.sweep(client) == 2
+    assert sorted(engine.containers) == sorted([c_downloading.id, c_foreign.id, c_other.id])
+    assert reaper.queued() == []
+
+
+def test_pull_many(engine, monkeypatch, capsys, caplog):
+    engine.remote_tags.update({'quay.io/cincan/a:latest', 'quay.io/cincan/b:dev', 'other/c:1.0'})
+    monkeypatch.setattr(sys, 'argv', ['cincan', '--batch', 'pull', '-j', '3', 'a', 'cincan/b', 'other/c:1.0',
+                                      'missing'])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 1
+    out = capsys.readouterr()
+    lines = sorted(out.err.splitlines())
+    assert [line.split(',')[0] for line in lines] == [
+        'other/c:1.0: 2/2 layers done', 'quay.io/cincan/a: 2/2 layers done', 'quay.io/cincan/b: 2/2 layers done',
+        'quay.io/cincan/missing: failed']
+    assert lines[0].startswith('other/c:1.0: 2/2 layers done, 2.0 kB in ')
+    assert "quay.io/cincan/missing: 'latest' or 'dev' tag not found" in caplog.text
+    assert {'quay.io/cincan/a:latest', 'quay.io/cincan/b:dev', 'other/c:1.0'} <= engine.tags
+    assert engine.requests['pull'] == 6  # b and missing try the development tag
+
+
+def test_batch_over_endpoints(engine, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    second = FakeEngineServer((tmp_path / 'second.sock').as_posix(), FakeEngine(latency=0.01))
+    second.start()
+    pathlib.Path('samples').mkdir()
+    for i in range(6):
+        pathlib.Path(f'samples/{i}.bin').write_bytes(b'%d' % i)
+    commands = read_commands(io.StringIO(
+        '# digests of the samples\n' + ''.join(f'fake/tool samples/{i}.bin\n' for i in range(6))))
+    endpoints = [Endpoint('first', os.environ['DOCKER_HOST'], max_runs=2),
+                 Endpoint('second', f"unix://{tmp_path / 'second.sock'}", weight=2, max_runs=2),
+                 Endpoint('missing', f"unix://{tmp_path / 'missing.sock'}")]
+
+    def tool_for(name, docker_host, client):
+        tool = ToolImage(name, image=name, batch=True, docker_host=docker_host, client=client)
+        tool.background_cleanup = False
+        return tool
+
+    try:
+        runner = BatchRunner(Scheduler(endpoints, ping_endpoint), tool_for, logging.getLogger('batch'),
+                             Progress(enabled=False))
+        assert runner.run_all(commands, jobs=4) == 0
+    finally:
+        second.shutdown()
+        second.server_close()
+    assert sorted(capsys.readouterr().out.splitlines()) == sorted(
+        f"{hashlib.sha256(b'%d' % i).hexdigest()}  samples/{i}.bin" for i in range(6))
+    assert all(pathlib.Path(f'samples/{i}.bin.sha256').exists() for i in range(6))  # collected back
+    assert engine.requests['create'] > 0 and second.engine.requests['create'] > 0
+    assert engine.requests['create'] + second.engine.requests['create'] == 6
+    assert [e.done for e in endpoints[:2]] == [engine.requests['create'], second.engine.requests['create']]
+    assert endpoints[2].healthy is False and not endpoints[2].active
+
+
+def test_batch_retried_when_endpoint_unreachable(engine, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    pathlib.Path('0.bin').write_bytes(b'0')
+    # passed the health check, but gone by the time of the run
+    gone = Endpoint('gone', f"unix://{tmp_path / 'gone.sock'}", weight=10)
+    local = Endpoint('local', os.environ['DOCKER_HOST'])
+
+    def tool_for(name, docker_host, client):
+        tool = ToolImage(name, image=name, batch=True, docker_host=docker_host, client=client)
+        tool.background_cleanup = False
+        return tool
+
+    runner = BatchRunner(Scheduler([gone, local], lambda e: None), tool_for, logging.getLogger('batch'),
+                         Progress(enabled=False))
+    assert runner.run_all([['fake/tool', '0.bin']], jobs=1) == 0
+    assert (gone.healthy, gone.failed) == (False, 1)
+    assert local.done == 1
+    assert capsys.readouterr().out == f"{hashlib.sha256(b'0').hexdigest()}  0.bin\n"
+
+
+def test_batch_line_with_run_options():
+    assert read_commands(io.StringIO('fake/tool --in x.tar\n\n')) == [['fake/tool', '--in', 'x.tar']]
+    with pytest.raises(ValueError, match="line 2: options of 'cincan run' are not supported"):
+        read_commands(io.StringIO('fake/tool a\n--in x.tar fake/tool\n'))
+
+
+def test_batch_placed_on_cpus(engine, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for i in range(3):
+        pathlib.Path(f'{i}.bin').write_bytes(b'%d' % i)
+    pool = ResourcePool({0: [0, 1], 1: [2, 3]}, 8 * 1024 ** 3)
+
+    tools = []
+
+    def tool_for(name, docker_host, client):
+        tool = ToolImage(name, image=name, batch=True, docker_host=docker_host, client=client)
+        tool.background_cleanup = False
+        tools.append(tool)
+        return tool
+
+    runner = BatchRunner(Scheduler([Endpoint('local')], ping_endpoint), tool_for, logging.getLogger('batch'),
+                         Progress(enabled=False), pool=pool,
+                         footprints=FootprintHistory(JsonCache(tmp_path / 'footprints')))
+    assert runner.run_all([['fake/tool', f'{i}.bin'] for i in range(3)], jobs=3) == 0
+    assert engine.requests['create'] == 3
+    cpusets = [t.resources['cpuset_cpus'] for t in tools]
+    assert all(c in ('0', '1', '2', '3') for c in cpusets)
+    assert all('nano_cpus' not in t.resources and 'mem_limit' not in t.resources for t in tools)
+    assert pool.free == {0: {0, 1}, 1: {2, 3}} and pool.free_memory == pool.memory
+
+
+def test_batch_placement_rejected_by_engine(engine, tmp_path, monkeypatch, caplog):
+    monkeypatch.chdir(tmp_path)
+    engine.cpus = 2  # engine in a VM with fewer CPUs than this host
+    for i in range(3):
+        pathlib.Path(f'{i}.bin').write_bytes(b'%d' % i)
+    pool = ResourcePool({0: [4, 5, 6, 7]}, 8 * 1024 ** 3)
+    endpoint = Endpoint('local')
+
+    def tool_for(name, docker_host, client):
+        tool = ToolImage(name, image=name, batch=True, docker_host=docker_host, client=client)
+        tool.background_cleanup = False
+        return tool
+
+    runner = BatchRunner(Scheduler([endpoint], ping_endpoint), tool_for, logging.getLogger('batch'),
+                         Progress(enabled=False), pool=pool)
+    assert runner.run_all([['fake/tool', f'{i}.bin'] for i in range(3)], jobs=1) == 0
+    assert 'CPU placement rejected, running without it: Requested CPUs are not available' in caplog.text
+    assert not endpoint.placement
+    assert engine.requests['create'] == 4  # retried once, the following runs are not placed
+
+
+def test_cpuset_rejection_detected():
+    def error(status: int, explanation: str) -> docker.errors.APIError:
+        response = requests.Response()
+        response.status_code = status
+        return docker.errors.APIError('create', response, explanation)
+
+    assert is_cpuset_rejected(error(400, 'Requested CPUs are not available - requested 4, available: 0-1'))
+    assert is_cpuset_rejected(error(400, 'Invalid value 9 for cpuset cpus'))
+    assert not is_cpuset_rejected(error(400, 'invalid mount config for type "bind"'))
+    assert not is_cpuset_rejected(error(500, 'Requested CPUs are not available'))
+
+
+def test_batch_malformed_footprint_labels(engine, tmp_path, monkeypatch, caplog):
+    monkeypatch.chdir(tmp_path)
+    engine.labels = {'cincan.cpus': 'many', 'cincan.memory': '1g'}
+    pathlib.Path('0.bin').write_bytes(b'0')
+    pool = ResourcePool({0: [0, 1]}, 8 * 1024 ** 3)
+    tools = []
+
+    def tool_for(name, docker_host, client):
+        tool = ToolImage(name, image=name, batch=True, docker_host=docker_host, client=client)
+        tool.background_cleanup = False
+        tools.append(tool)
+        return tool
+
+    runner = BatchRunner(Scheduler([Endpoint('local')], ping_endpoint), tool_for, logging.getLogger('batch'),
+                         Progress(enabled=False), pool=pool)
+    assert runner.run_all([['fake/tool', '0.bin']], jobs=1) == 0
+    assert "fake/tool: ignoring footprint labels of the image: could not convert string to float: 'many'" \
+        in caplog.text
+    # default footprint, placed but not limited
+    assert tools[0].resources == {'cpuset_cpus': '0'}
@@ -114,3 +114,38 @@ def test_with_existing_directory():
     # Issue #26 - space character doesn't work in file name
     resolver = FileResolver(["-i", "'tests/foo: story of foo-bar.pdf'"], pathlib.Path())
     assert resolver.host_files == [pathlib.Path("tests/foo: story of foo-bar.pdf")]
+
+
+def test_filter_prunes_sub_directories():
+    assert FileMatcher('samples/sub/*', include=True).may_match_under('samples')
+    assert FileMatcher('samples/sub/*', include=True).may_match_under('samples/sub')
+    assert not FileMatcher('samples/sub/*', include=True).may_match_under('tests')
+    assert FileMatcher('*.txt', include=True).may_match_under('tests')
+    assert not FileMatcher('samples/*', include=False).may_match_under('samples/sub')
+    assert FileMatcher('samples/sub', include=False).may_match_under('samples/sub')
+    assert FileMatcher('*.txt', include=False).may_match_under('samples/sub')
+
+    resolver = FileResolver(['samples'], pathlib.Path(), input_filters=FileMatcher.parse(['samples/sub*']))
+    assert resolver.detect_upload_files() == [pathlib.Path('samples/sub'), pathlib.Path('samples/sub/source-c.txt')]
+
+    resolver = FileResolver(['samples'], pathlib.Path(), input_filters=FileMatcher.parse(['^samples/sub*']))
+    files = resolver.detect_upload_files()
+    assert pathlib.Path('samples/source-a.txt') in files
+    assert not any(f.as_posix().startswith('samples/sub') for f in files)
+
+
+def test_deep_directory_tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    d = pathlib.Path('tree')
+    for i in range(3):
+        sub = d / f'd{i}' / 'deeper'
+        sub.mkdir(parents=True)
+        (sub / 'a.bin').write_bytes(b'a')
+        (d / f'd{i}' / 'b.txt').write_text('b')
+    resolver = FileResolver(['tree'], pathlib.Path())
+    files = resolver.detect_upload_files()
+    assert len(files) == 1 + 3 * 4
+    assert len(resolver.host_file_set) == len(resolver.host_files)
+
+    resolver = FileResolver(['tree'], pathlib.Path(), input_filters=FileMatcher.parse(['*.txt']))
+    assert resolver.detect_upload_files() == [pathlib.Path(f'tree/d{i}/b.txt') for i in range(3)]
@@ -0,0 +1,51 @@
+import logging
+
+import docker
+import pytest
+from cincanregistry import ToolRegistry
+
+from benchmarks.fake_engine import IMAGE_ID
+from cincan.configuration import Configuration
+from cincan.image_fetcher import ImageFetcher
+
+
+@pytest.fixture
+def fetcher(engine, tmp_path):
+    config = Configuration(tmp_path / 'config.json')
+    config.cache_directory = tmp_path / 'cache'
+    client = docker.from_env()
+    return ImageFetcher(config, ToolRegistry(), client, client.api, logging.getLogger('test'), batch=True)
+
+
+def test_development_tag_resolution_cached(engine, fetcher):
+    engine.remote_tags.add('quay.io/cincan/tool:dev')
+    assert fetcher.get_image('quay.io/cincan/tool').id == IMAGE_ID
+    assert engine.requests['pull'] == 2  # stable tag absent, development tag pulled
+    assert fetcher.resolutions.get('quay.io/cincan/tool') == {'image': 'quay.io/cincan/tool:dev', 'id': IMAGE_ID}
+
+    lookups = engine.requests['image']
+    assert fetcher.get_image('quay.io/cincan/tool').id == IMAGE_ID
+    assert engine.requests['pull'] == 2
+    assert engine.requests['image'] == lookups + 1  # straight to the development tag
+
+    # pull refreshes the resolution, stable tag published meanwhile
+    engine.remote_tags.add('quay.io/cincan/tool:latest')
+    fetcher.get_image('quay.io/cincan/tool', pull=True)
+    assert engine.requests['pull'] == 3
+    assert fetcher.resolutions.get('quay.io/cincan/tool')['image'] == 'quay.io/cincan/tool:latest'
+
+
+def test_missing_image_cached(engine, fetcher, caplog):
+    with pytest.raises(SystemExit):
+        fetcher.get_image('quay.io/cincan/missing')
+    assert engine.requests['pull'] == 2
+    with pytest.raises(SystemExit):
+        fetcher.get_image('quay.io/cincan/missing')
+    assert engine.requests['pull'] == 2
+    assert "(cached result, use --pull to check again)" in caplog.text
+
+    # expired
+    fetcher.resolutions.ttl = 0
+    engine.remote_tags.add('quay.io/cincan/missing:latest')
+    assert fetcher.get_image('quay.io/cincan/missing').id == IMAGE_ID
+    assert engine.requests['pull'] == 3
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import logging
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+import pytest
+from cincanregistry.remotes import QuayRegistry
+
+from cincan.cache import JsonCache
+from cincan.manifest_cache import ManifestCache
+
+MANIFEST = {
+    'schemaVersion': 2, 'mediaType': 'application/vnd.docker.distribution.manifest.v2+json',
+    'config': {'mediaType': 'application/vnd.docker.container.image.v1+json', 'size': 10,
+               'digest': 'sha256:' + '0' * 64},
+    'layers': [],
+}
+LAYER = {'mediaType': 'application/vnd.docker.image.rootfs.diff.tar.gzip', 'size': 1, 'digest': 'sha256:' + '1' * 64}
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    """Stand-in for Docker Registry HTTP API V2 with token authentication"""
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    manifests = {}  # name:tag -> manifest
+
+    def log_message(self, format, *args):
+        pass
+
+    def __reply(self, status: int, body: bytes = b'', headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.requests.append(('HEAD', self.path))
+        realm = f'http://127.0.0.1:{self.server.server_port}/token'
+        self.__reply(401, headers={'WWW-Authenticate': f'Bearer realm="{realm}",service="stand-in"'})
+
+    def do_GET(self):
+        self.requests.append(('GET', self.path, self.headers.get('If-None-Match')))
+        if self.path.startswith('/token'):
+            return self.__reply(200, json.dumps({'token': 'secret'}).encode())
+        assert self.headers['Authorization'] == 'Bearer secret'
+        name, tag = self.path[len('/v2/'):].split('/manifests/')
+        manifest = self.manifests.get(f'{name}:{tag}')
+        if manifest is None:
+            return self.__reply(404, json.dumps({'errors': [{'code': 'MANIFEST_UNKNOWN'}]}).encode())
+        body = json.dumps(manifest).encode()
+        digest = 'sha256:' + hashlib.sha256(body).hexdigest()
+        if self.headers.get('If-None-Match') == f'"{digest}"':
+            return self.__reply(304)
+        self.__reply(200, body, {'Docker-Content-Digest': digest, 'Etag': f'"{digest}"'})
+
+
+@pytest.fixture
+def registry():
+    RegistryHandler.requests = []
+    RegistryHandler.manifests = {'cincan/a:latest': MANIFEST, 'cincan/b:dev': dict(MANIFEST, layers=[])}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RegistryHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    remote = QuayRegistry()
+    remote.registry_root = f'http://127.0.0.1:{server.server_port}'
+    yield remote
+    server.shutdown()
+    server.server_close()
+
+
+def manifest_gets():
+    return [r for r in RegistryHandler.requests if '/manifests/' in r[1]]
+
+
+def test_manifest_cached_and_revalidated(registry, tmp_path):
+    cache = ManifestCache(registry, JsonCache(tmp_path, ttl=60), logging.getLogger('test'))
+    assert cache.get('cincan/a', 'latest') == MANIFEST
+    assert cache.get('cincan/a', 'latest') == MANIFEST
+    assert len(manifest_gets()) == 1  # second one from the cache
+
+    cache.cache.ttl = 0  # expired, revalidated with conditional request
+    assert cache.get('cincan/a', 'latest') == MANIFEST
+    assert len(manifest_gets()) == 2
+    assert manifest_gets()[1][2].startswith('"sha256:')
+
+    RegistryHandler.manifests['cincan/a:latest'] = dict(MANIFEST, layers=[LAYER])
+    assert cache.get('cincan/a', 'latest')['layers'] == [LAYER]
+    assert cache.get('cincan/a', 'latest')['layers'] == [LAYER]  # new digest is cached
+    assert [r[2] is not None for r in manifest_gets()] == [False, True, True, True]
+
+    assert cache.get('cincan/missing', 'latest') is None
+
+
+def test_expired_manifest_used_when_registry_unreachable(registry, tmp_path, monkeypatch, caplog):
+    cache = ManifestCache(registry, JsonCache(tmp_path, ttl=0), logging.getLogger('test'))
+    assert cache.get('cincan/a', 'latest') == MANIFEST
+    monkeypatch.setattr('cincan.manifest_cache.fetch_manifest_if_modified',
+                        mock.Mock(side_effect=ConnectionError('unreachable')))
+    assert cache.get('cincan/a', 'latest') == MANIFEST
+    assert 'using cached one: unreachable' in caplog.text
+    assert cache.get('cincan/b', 'dev') is None
+
+
+def test_manifests_in_bulk(registry, tmp_path):
+    cache = ManifestCache(registry, JsonCache(tmp_path, ttl=60), logging.getLogger('test'))
+    res = cache.get_all([('cincan/a', 'latest'), ('cincan/b', 'dev'), ('cincan/c', 'latest')], jobs=3)
+    assert res == [MANIFEST, MANIFEST, None]
+    assert len(manifest_gets()) == 3
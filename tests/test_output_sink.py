@@ -0,0 +1,51 @@
+import io
+
+from cincan.output_sink import OutputSink
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_terminal_written_per_frame():
+    out = io.BytesIO()
+    sink = OutputSink(out, tty=True)
+    for i in range(3):
+        sink.write(b'line %d\n' % i)
+    assert out.getvalue() == b'line 0\nline 1\nline 2\n'
+    assert sink.writes == 3 and sink.timeout() is None
+
+
+def test_pipe_coalesced():
+    out = io.BytesIO()
+    clock = Clock()
+    sink = OutputSink(out, tty=False, max_buffer=100, max_delay=0.05, clock=clock)
+    for i in range(30):
+        sink.write(b'line %02d\n' % i)  # 8 bytes
+    assert sink.writes == 2  # at 104 and 208 bytes
+    assert len(out.getvalue()) == 208
+    sink.flush()
+    assert out.getvalue() == b''.join(b'line %02d\n' % i for i in range(30))
+    assert sink.writes == 3
+
+    sink.write(b'x' * 1000)  # large frame is not copied into the buffer
+    assert sink.writes == 4 and not sink.buffer
+
+
+def test_pipe_held_back_at_most_max_delay():
+    out = io.BytesIO()
+    clock = Clock()
+    sink = OutputSink(out, tty=False, max_buffer=1000, max_delay=0.5, clock=clock)
+    sink.write(b'first\n')
+    assert out.getvalue() == b'' and sink.timeout() == 0.5
+    clock.now += 0.25
+    assert sink.timeout() == 0.25
+    clock.now += 0.5
+    assert sink.timeout() == 0.0
+    sink.write(b'second\n')  # late, written with the earlier output
+    assert out.getvalue() == b'first\nsecond\n'
+    assert sink.writes == 1 and sink.timeout() is None
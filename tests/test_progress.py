@@ -0,0 +1,84 @@
+import io
+
+from cincan.progress import Progress, ProgressReader, format_bytes, format_duration
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_format():
+    assert format_bytes(999) == '999 B'
+    assert format_bytes(1500) == '1.5 kB'
+    assert format_bytes(2_500_000_000) == '2.5 GB'
+    assert format_duration(65) == '1:05'
+    assert format_duration(3725) == '1:02:05'
+
+
+def test_rate_and_eta():
+    clock = Clock()
+    progress = Progress(io.StringIO(), tty=True, clock=clock)
+    task = progress.task('upload', total=10_000_000)
+    clock.now += 2
+    task.advance(2_000_000)
+    assert task.rate() == 1_000_000
+    assert task.eta() == 8
+    assert task.line() == 'upload: 2.0 MB/10.0 MB 1.0 MB/s ETA 0:08'
+
+
+def test_terminal_frame_rate():
+    clock = Clock()
+    out = io.StringIO()
+    progress = Progress(out, tty=True, fps=10, delay=0.5, clock=clock)
+    task = progress.task('download', total=1000)
+    task.advance(100)
+    assert out.getvalue() == ''  # not shown before delay
+    clock.now += 1
+    task.advance(100)
+    frame = out.getvalue()
+    assert frame == '\033[2Kdownload: 200 B/1.0 kB 200 B/s ETA 0:04\n'
+    for _ in range(100):
+        task.advance(1)  # within the same frame
+    assert out.getvalue() == frame
+    clock.now += 0.25
+    task.advance(1)
+    assert out.getvalue().startswith(frame + '\033[1A\033[2Kdownload: 301 B/1.0 kB')
+    task.finish()
+    assert out.getvalue().endswith('\033[1A\033[2K\n\033[1A')  # finished transfer is removed
+
+
+def test_summary_lines():
+    clock = Clock()
+    out = io.StringIO()
+    progress = Progress(out, tty=False, summary_interval=5, clock=clock)
+    short = progress.task('short')
+    long = progress.task('long', total=100)
+    short.advance(10)
+    short.finish()
+    assert out.getvalue() == ''  # short transfers are not reported
+    clock.now += 5
+    long.advance(50)
+    assert out.getvalue() == 'long: 50 B/100 B 10 B/s ETA 0:05\n'
+    clock.now += 1
+    long.advance(10)
+    assert out.getvalue().count('\n') == 1
+    clock.now += 4
+    long.finish()
+    assert out.getvalue().splitlines()[-1] == 'long: done, 60 B in 10.0 s, 6 B/s'
+    reported = progress.task('reported', report=True)
+    reported.finish(failed=True)
+    assert out.getvalue().splitlines()[-1] == 'reported: failed'
+
+
+def test_progress_reader():
+    progress = Progress(enabled=False)
+    task = progress.task('upload', total=6)
+    reader = ProgressReader(io.BytesIO(b'abcdef'), 6, task)
+    assert len(reader) == 6
+    assert reader.read(4) == b'abcd'
+    assert reader.read() == b'ef'
+    assert reader.count == task.done == 6
@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+from cincan.cache import JsonCache
+from cincan.resources import Footprint, FootprintHistory, FootprintSampler, ResourcePool, parse_cpu_list, \
+    parse_memory
+
+GB = 1024 ** 3
+
+
+def test_parse():
+    assert parse_memory('512m') == 512 * 1024 * 1024
+    assert parse_memory('1.5G') == int(1.5 * GB)
+    assert parse_memory('1024') == 1024
+    with pytest.raises(ValueError):
+        parse_memory('lots')
+    assert parse_cpu_list('0-3,8,10-11\n') == [0, 1, 2, 3, 8, 10, 11]
+
+
+def test_footprint_from_labels():
+    assert Footprint.from_labels({'maintainer': 'cincan'}) is None
+    footprint = Footprint.from_labels({'cincan.cpus': '2', 'cincan.memory': '1g'})
+    assert (footprint.cpus, footprint.memory, footprint.declared) == (2.0, GB, True)
+    for labels in [{'cincan.cpus': 'two'}, {'cincan.cpus': '0'}, {'cincan.memory': 'lots'}]:
+        with pytest.raises(ValueError):
+            Footprint.from_labels(labels)
+
+
+def test_disjoint_cpusets_within_numa_node():
+    pool = ResourcePool({0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}, 8 * GB)
+    a = pool.acquire(Footprint(3, GB))
+    b = pool.acquire(Footprint(2, GB))
+    assert (a.cpus, a.node) == ([0, 1, 2], 0)
+    assert (b.cpus, b.node) == ([4, 5], 1)
+    c = pool.acquire(Footprint(1, GB))
+    assert c.cpus == [3]  # best fit, the node with fewest free CPUs
+    d = pool.acquire(Footprint(1.5, GB))
+    assert d.container_options() == {'cpuset_cpus': '6,7', 'cpuset_mems': '1'}  # observed, only the CPU set
+    assert a.container_options() == {'cpuset_cpus': '0,1,2', 'cpuset_mems': '0'}
+    pool.release(d)
+    declared = pool.acquire(Footprint(1.5, GB, declared=True))
+    assert declared.container_options() == {'cpuset_cpus': '6,7', 'cpuset_mems': '1', 'nano_cpus': 1_500_000_000,
+                                            'mem_limit': GB}
+
+
+def test_spread_over_numa_nodes():
+    pool = ResourcePool({0: [0, 1], 1: [2, 3]}, 8 * GB)
+    pool.acquire(Footprint(1, GB))
+    spread = pool.acquire(Footprint(3, GB))  # does not fit into a single node
+    assert (spread.cpus, spread.node) == ([1, 2, 3], None)
+    assert 'cpuset_mems' not in spread.container_options()
+
+
+def test_admission_waits_for_resources():
+    pool = ResourcePool({0: [0, 1]}, 2 * GB)
+    first = pool.acquire(Footprint(1, int(1.5 * GB)))
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(pool.acquire(Footprint(1, GB))))
+    waiter.start()
+    waiter.join(0.2)
+    assert not admitted  # a free CPU, but not enough memory
+    pool.release(first)
+    waiter.join(5)
+    assert admitted[0].cpus == [0]
+    big = Footprint(16, 64 * GB, declared=True)
+    pool.release(admitted[0])
+    allocation = pool.acquire(big)  # larger than the pool, runs alone
+    assert allocation.cpus == [0, 1] and allocation.memory == 2 * GB
+    assert allocation.container_options()['mem_limit'] == 64 * GB
+
+
+def test_no_pool_without_cpu_affinity(monkeypatch):
+    assert ResourcePool.of_host().cpu_count() >= 1
+    monkeypatch.delattr('os.sched_getaffinity')  # e.g. macOS
+    assert ResourcePool.of_host() is None
+
+
+def test_footprint_history(tmp_path):
+    history = FootprintHistory(JsonCache(tmp_path))
+    assert history.get('cincan/tshark') is None
+    for cpus, memory in [(1.5, GB), (0.5, 2 * GB)] + [(0.1, 100)] * 4:
+        history.record('cincan/tshark', Footprint(cpus, memory))
+    footprint = history.get('cincan/tshark')
+    assert (footprint.cpus, footprint.memory) == (0.5, 2 * GB)  # the first run is forgotten
+
+
+def test_footprint_sampler():
+    now = [0.0]
+
+    def stats():
+        for i in range(3):
+            now[0] = float(i)
+            yield {'memory_stats': {'usage': [100, 300, 200][i]}, 'cpu_stats': {'cpu_usage': {'total_usage': i * 2e9}}}
+
+    sampler = FootprintSampler(stats, clock=lambda: now[0]).start()
+    footprint = sampler.footprint()
+    assert (footprint.cpus, footprint.memory) == (2.0, 300)
+    assert FootprintSampler(lambda: iter([])).start().footprint() is None
@@ -0,0 +1,134 @@
+import hashlib
+import io
+import logging
+import pathlib
+from unittest import mock
+
+from cincan.command_log import CommandLog, FileLog
+from cincan.frontend import ToolImage
+from cincan.run_cache import RunCache
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def stored_run(cache: RunCache, work_dir: pathlib.Path, key: str, content: bytes):
+    out_file = work_dir / f'out-{key}.txt'
+    out_file.write_bytes(content)
+    log = CommandLog(['test'])
+    log.out_files.append(FileLog(out_file, sha256(content)))
+    stdout = io.BytesIO()
+    stdout.write(b'out')
+    cache.store(key, log, work_dir, stdout, None)
+
+
+def test_store_and_restore(tmp_path):
+    cache = RunCache(tmp_path / 'runs', 1024 * 1024, logging.getLogger())
+    work_dir = tmp_path / 'work'
+    (work_dir / 'results').mkdir(parents=True)
+    (work_dir / 'results' / 'a.txt').write_bytes(b'aaa')
+    log = CommandLog(['test'])
+    log.out_files = [FileLog(work_dir / 'results', ''), FileLog(work_dir / 'results' / 'a.txt', sha256(b'aaa'))]
+    stdout = io.BytesIO()
+    stdout.write(b'output\n')
+    cache.store('key', log, work_dir, stdout, io.BytesIO())
+
+    assert cache.lookup('other') is None
+    result = cache.lookup('key')
+    assert result['exit_code'] == 0
+    assert result['stderr'] == ''
+
+    restore_dir = tmp_path / 'restore'
+    restore_dir.mkdir()
+    stdout, stderr = io.BytesIO(), io.BytesIO()
+    log = cache.restore(result, restore_dir, CommandLog(['test']), stdout, stderr)
+    assert (restore_dir / 'results' / 'a.txt').read_bytes() == b'aaa'
+    assert stdout.getvalue() == b'output\n'
+    assert stderr.getvalue() == b''
+    assert [(f.path, f.digest) for f in log.out_files] == [
+        (restore_dir / 'results', ''),
+        (restore_dir / 'results' / 'a.txt', sha256(b'aaa')),
+        (pathlib.Path('/dev/stdout'), sha256(b'output\n'))]
+
+
+def test_missing_blob(tmp_path):
+    cache = RunCache(tmp_path / 'runs', 1024 * 1024, logging.getLogger())
+    stored_run(cache, tmp_path, 'key', b'data')
+    cache.blobs.remove(sha256(b'data'))
+    assert cache.lookup('key') is None
+    assert cache.entries.get('key') is None
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = RunCache(tmp_path / 'runs', 25, logging.getLogger())
+    stored_run(cache, tmp_path, 'a', b'a' * 10)
+    stored_run(cache, tmp_path, 'b', b'b' * 10)
+    assert cache.lookup('a') is not None  # 'b' is now the least recently used
+    stored_run(cache, tmp_path, 'c', b'c' * 10)
+    assert cache.lookup('a') is not None
+    assert cache.lookup('b') is None
+    assert cache.lookup('c') is not None
+    # stdout 'out' shared by the runs, 'b' * 10 removed
+    assert sorted(cache.blobs.digests()) == sorted([sha256(b'a' * 10), sha256(b'c' * 10), sha256(b'out')])
+
+
+def test_evict_only_over_size_limit(tmp_path):
+    cache = RunCache(tmp_path / 'runs', 1024, logging.getLogger())
+    with mock.patch.object(RunCache, 'evict', autospec=True, side_effect=RunCache.evict) as evict:
+        stored_run(cache, tmp_path, 'a', b'a' * 10)
+        assert evict.call_count == 1  # stored size not yet known
+        for key in 'bcd':
+            stored_run(cache, tmp_path, key, b'x' * 10)
+        assert evict.call_count == 1
+        assert cache.state.get('size') == {'bytes': 13 + 3 * 13}  # shared blobs counted again
+        stored_run(cache, tmp_path, 'e', b'e' * 1000)
+        assert evict.call_count == 2
+        assert cache.state.get('size') == {'bytes': 1000 + 3 + 10 + 10}
+
+
+def test_memoized_run(mock_tool, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mock_tool.config.cache_directory = tmp_path / 'cache'
+    mock_tool.image.attrs = {'Config': {'Entrypoint': ['tool'], 'Cmd': None}}
+    mock_tool.memoize = True
+    mock_tool.buffer_output = True
+    pathlib.Path('input.txt').write_text('input')
+
+    def create_container(upload_files, in_files, entry_point, user_cmd, stats, digests):
+        assert digests == {tmp_path / 'input.txt': sha256(pathlib.Path('input.txt').read_bytes())}
+        mock_tool.container = mock.Mock()
+        return CommandLog(['test'] + user_cmd)
+
+    def container_exec(container, log, write_stdout, stdout_copy, stderr_copy):
+        stdout_copy.write(b'done\n')
+        log.stdout = b'done\n'
+        return log
+
+    def download_results(container, log, stats):
+        pathlib.Path('output.txt').write_text('output')
+        log.out_files.append(FileLog(tmp_path / 'output.txt', sha256(b'output')))
+        return log
+
+    with mock.patch.object(ToolImage, '_ToolImage__create_container', side_effect=create_container) as create, \
+            mock.patch.object(ToolImage, '_ToolImage__container_exec', side_effect=container_exec), \
+            mock.patch.object(ToolImage, '_ToolImage__download_results', side_effect=download_results):
+        assert mock_tool.run_get_string(['input.txt']) == 'done\n'
+        assert create.call_count == 1
+
+        pathlib.Path('output.txt').unlink()
+        assert mock_tool.run_get_string(['input.txt']) == 'done\n'
+        assert create.call_count == 1  # no container
+        assert pathlib.Path('output.txt').read_text() == 'output'
+        assert mock_tool.download_files == ['output.txt']
+
+        log = mock_tool.run(['input.txt'])
+        assert log.cached
+        assert {'file_resolution', 'hashing', 'restore'} <= set(log.timings.seconds)
+        assert 'exec' not in log.timings.seconds
+        assert log.to_json()['cached']
+        assert [f.path.name for f in log.in_files] == ['input.txt']
+
+        pathlib.Path('input.txt').write_text('modified input')
+        mock_tool.run_get_string(['input.txt'])
+        assert create.call_count == 2
@@ -0,0 +1,90 @@
+import threading
+
+from cincan.scheduler import HEALTH_RECHECK, Endpoint, Scheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_least_loaded_by_weight():
+    small, big = Endpoint('small', weight=1, max_runs=2), Endpoint('big', 'tcp://big:2375', weight=2, max_runs=4)
+    scheduler = Scheduler([small, big], lambda e: None)
+    placed = [scheduler.acquire().name for _ in range(6)]
+    assert placed.count('big') == 4 and placed.count('small') == 2
+    assert placed[:3] == ['big', 'small', 'big']  # big takes two for each one of small
+    assert scheduler.status() == '0 queued | small: 2/2 running, 0 done, 0 failed | big: 4/4 running, 0 done, 0 failed'
+    scheduler.release(big, failed=True)
+    assert scheduler.acquire().name == 'big'  # small is full
+    scheduler.release(small)
+    assert small.done == 1 and big.failed == 1
+
+
+def test_queue_until_free():
+    endpoint = Endpoint('only', max_runs=1)
+    scheduler = Scheduler([endpoint], lambda e: None)
+    first = scheduler.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(scheduler.acquire()))
+    waiter.start()
+    while not scheduler.queued:
+        pass
+    assert scheduler.status().startswith('1 queued')
+    scheduler.release(first)
+    waiter.join(5)
+    assert acquired == [endpoint]
+    assert scheduler.queued == 0
+
+
+def test_unhealthy_endpoint():
+    clock = Clock()
+    errors = {'down': 'connection refused'}
+    down, up = Endpoint('down', 'tcp://down:2375'), Endpoint('up', 'tcp://up:2375')
+    scheduler = Scheduler([down, up], lambda e: errors.get(e.name), clock=clock)
+    assert scheduler.acquire() is up
+    assert 'down: down (connection refused)' in scheduler.status()
+
+    errors.clear()
+    assert scheduler.acquire() is up  # not checked again yet
+    clock.now += HEALTH_RECHECK
+    assert scheduler.acquire() is down  # recovered, and less loaded
+
+    scheduler.release(up, failed=True, error='connection reset')
+    scheduler.release(up)
+    scheduler.release(down, failed=True, error='connection reset')
+    errors.update({'up': 'refused', 'down': 'refused'})
+    clock.now += HEALTH_RECHECK
+    assert scheduler.acquire() is None
+
+
+def test_health_checked_outside_lock():
+    checking, proceed = threading.Event(), threading.Event()
+
+    def slow_check(e):
+        checking.set()
+        proceed.wait(5)
+        return None
+
+    scheduler = Scheduler([Endpoint('slow')], slow_check)
+    acquired = []
+    waiters = [threading.Thread(target=lambda: acquired.append(scheduler.acquire())) for _ in range(2)]
+    waiters[0].start()
+    assert checking.wait(5)
+    assert scheduler.status() == '1 queued | slow: 0/4 running, 0 done, 0 failed'  # not blocked by the check
+    waiters[1].start()  # waits for the check in progress, instead of finding no healthy endpoint
+    while scheduler.queued < 2:
+        pass
+    proceed.set()
+    for w in waiters:
+        w.join(5)
+    assert [e.name for e in acquired] == ['slow', 'slow']
+
+
+def test_endpoint_from_config():
+    e = Endpoint.from_config({'host': 'ssh://user@host', 'weight': 2, 'max_runs': 8}, 1)
+    assert (e.name, e.host, e.weight, e.max_runs) == ('ssh://user@host', 'ssh://user@host', 2.0, 8)
+    assert Endpoint.from_config({}, 2).name == 'endpoint-2'
@@ -0,0 +1,64 @@
+import logging
+from unittest import mock
+import docker.errors
+
+
+def head_response(image_files):
+    """Mock HEAD /containers/{id}/archive for files in the image"""
+    def head(url, params, **kwargs):
+        res = mock.Mock()
+        res.path = params['path']
+        res.headers = {}
+        return res
+
+    def raise_for_status(res):
+        if res.path not in image_files:
+            raise docker.errors.NotFound(res.path)
+    return head, raise_for_status
+
+
+def test_detect_shell_with_probe_container(mock_tool, caplog):
+    api = mock_tool.client.api
+    api.head.side_effect, api._raise_for_status.side_effect = head_response({'/bin/sh'})
+    mock_tool.config.default_shells = ['/bin/bash', '/bin/sh']
+
+    caplog.set_level(logging.WARNING)
+    mock_tool.shell = '/bin/zsh'
+    assert mock_tool._detect_shell() == '/bin/sh'
+    assert "User supplied shell path not found." in caplog.records[0].message
+    # one container for all the candidates, never started, always removed
+    mock_tool.client.containers.create.assert_called_once()
+    mock_tool.client.containers.create.return_value.start.assert_not_called()
+    mock_tool.client.containers.create.return_value.remove.assert_called_once_with(force=True)
+    assert [c[1]['params']['path'] for c in api.head.call_args_list] == ['/bin/zsh', '/bin/bash', '/bin/sh']
+
+
+def test_detect_shell_cached(mock_tool):
+    api = mock_tool.client.api
+    api.head.side_effect, api._raise_for_status.side_effect = head_response({'/bin/bash', '/bin/sh'})
+    mock_tool.config.default_shells = ['/bin/bash', '/bin/sh']
+    mock_tool.shell = '/bin/bash'
+    assert mock_tool._detect_shell() == '/bin/bash'
+    assert mock_tool.image_cache.get('sha256:1234') == {'shells': {'/bin/bash': True}}
+
+    # known shells do not need a container
+    mock_tool.client.containers.create.reset_mock()
+    assert mock_tool._detect_shell() == '/bin/bash'
+    mock_tool.client.containers.create.assert_not_called()
+
+    # not found paths are cached as well
+    mock_tool.shell = '/bin/zsh'
+    assert mock_tool._detect_shell() == '/bin/bash'
+    assert mock_tool.image_cache.get('sha256:1234') == {'shells': {'/bin/bash': True, '/bin/zsh': False}}
+    mock_tool.client.containers.create.reset_mock()
+    assert mock_tool._detect_shell() == '/bin/bash'
+    mock_tool.client.containers.create.assert_not_called()
+
+
+def test_detect_shell_none_found(mock_tool):
+    api = mock_tool.client.api
+    api.head.side_effect, api._raise_for_status.side_effect = head_response(set())
+    mock_tool.config.default_shells = []
+    mock_tool.shell = '/bin/zsh'
+    assert not mock_tool._detect_shell()
+    mock_tool.client.containers.create.return_value.remove.assert_called_once_with(force=True)
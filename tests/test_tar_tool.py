@@ -0,0 +1,265 @@
+import hashlib
+import io
+import logging
+import os
+import pathlib
+import tarfile
+from collections import Counter
+from unittest import mock
+
+import pytest
+from docker.errors import NotFound
+
+from cincan.blob_store import BlobStore
+from cincan.cache import JsonCache
+from cincan.file_tool import FileResolver
+from cincan.tar_tool import TarTool
+
+
+def mock_container(work_dir: str = '/home/appuser') -> mock.Mock:
+    container = mock.Mock()
+    container.attrs = {'Image': 'sha256:1234'}
+    container.image.attrs = {'Config': {'WorkingDir': work_dir}}
+    container.uploaded = io.BytesIO()
+    container.put_archive.side_effect = lambda path, data: container.uploaded.write(
+        data.read() if hasattr(data, 'read') else b''.join(data))
+    return container
+
+
+def test_upload_syscall_count(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for d in ['a', 'b']:
+        pathlib.Path('tree', d).mkdir(parents=True)
+        for i in range(10):
+            pathlib.Path('tree', d, f'{i}.txt').write_text(f'{d}{i}')
+    pathlib.Path('single.txt').write_text('single')
+
+    calls = Counter()
+    real_stat, real_lstat = os.stat, os.lstat
+
+    def count_stat(path, *args, **kwargs):
+        calls[('stat', os.fspath(path))] += 1
+        return real_stat(path, *args, **kwargs)
+
+    def count_lstat(path, *args, **kwargs):
+        calls[('lstat', os.fspath(path))] += 1
+        return real_lstat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'stat', count_stat)
+    monkeypatch.setattr(os, 'lstat', count_lstat)
+
+    resolver = FileResolver(['-i', 'single.txt', 'tree', 'single.txt'], pathlib.Path())
+    upload_files = {}
+    resolver.resolve_upload_files(upload_files)
+    container = mock_container()
+    in_files = []
+    upload_stats = {}
+    TarTool(logging.getLogger(), container, upload_stats, stats=resolver.stats).upload(upload_files, in_files)
+    monkeypatch.setattr(os, 'stat', real_stat)
+    monkeypatch.setattr(os, 'lstat', real_lstat)
+
+    assert len(upload_files) == 1 + 1 + 2 + 20
+    assert len(in_files) == 21
+    assert len(upload_stats) == len(upload_files)
+    # no file is stat'ed more than once, files found by walking directories are not stat'ed separately at all
+    assert max(calls.values()) == 1
+    assert not [c for c in calls if c[1].startswith('tree/')]
+
+    # content and log entries are as before
+    in_files.sort(key=lambda f: f.path)
+    assert in_files[0].path == tmp_path.resolve() / 'single.txt'
+    assert in_files[1].path == tmp_path.resolve() / 'tree/a/0.txt'
+    assert in_files[1].digest == hashlib.sha256(b'a0').hexdigest()
+    container.put_archive.assert_called_once()
+    container.uploaded.seek(0)
+    with tarfile.open(fileobj=container.uploaded) as tar:
+        member = tar.getmember('tree/a/0.txt')
+        assert member.mode == 511
+        assert member.size == 2
+        assert member.mtime == upload_stats['tree/a/0.txt'][1]
+        assert tar.extractfile(member).read() == b'a0'
+        assert tar.getmember('tree/b').isdir()
+
+
+def archive_of(name: str, data: bytes) -> bytes:
+    tar_data = io.BytesIO()
+    with tarfile.open(fileobj=tar_data, mode='w') as tar:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return tar_data.getvalue()
+
+
+def test_cached_ignore_file(tmp_path):
+    ignore_data = archive_of('.cincanignore', b'# comment\n.test\nlogs/\n')
+
+    def get_archive(path):
+        if path == '/home/appuser/.cincanignore':
+            return [ignore_data], {}
+        raise NotFound(path)
+
+    cache = JsonCache(tmp_path)
+    container = mock_container()
+    container.get_archive.side_effect = get_archive
+    container.diff.return_value = []
+    tar_tool = TarTool(logging.getLogger(), container, {}, image_cache=cache)
+    assert tar_tool.download_files() == []
+    assert cache.get('sha256:1234') == {'work_dir': '/home/appuser/', 'ignore': ['.test', 'logs/']}
+
+    # second run with the same image does not touch the ignore file nor image attributes
+    container = mock_container()
+    container.image.attrs = None
+    container.get_archive.side_effect = get_archive
+    container.diff.return_value = []
+    tar_tool = TarTool(logging.getLogger(), container, {}, image_cache=cache)
+    assert tar_tool.work_dir == '/home/appuser/'
+    tar_tool.download_files()
+    assert '/home/appuser/.cincanignore' not in [c[0][0] for c in container.get_archive.call_args_list]
+
+    # ignore file created by the run is always read
+    container.diff.return_value = [{'Path': '/home/appuser/.cincanignore', 'Kind': 1}]
+    tar_tool.download_files()
+    assert '/home/appuser/.cincanignore' in [c[0][0] for c in container.get_archive.call_args_list]
+
+
+def test_cached_missing_ignore_file(tmp_path):
+    cache = JsonCache(tmp_path)
+    container = mock_container()
+    container.get_archive.side_effect = NotFound('not found')
+    container.diff.return_value = []
+    TarTool(logging.getLogger(), container, {}, image_cache=cache).download_files()
+    assert cache.get('sha256:1234') == {'work_dir': '/home/appuser/', 'ignore': []}
+
+
+def test_download_into_output_store(tmp_path, monkeypatch):
+    data = b'extracted certificate\n'
+    digest = hashlib.sha256(data).hexdigest()
+    store = BlobStore(tmp_path / 'store')
+    monkeypatch.setattr(BlobStore, '_BlobStore__reflink', classmethod(lambda cls, source, target: False))
+
+    def get_archive(path):
+        if path == '/home/appuser/':
+            return [archive_of('appuser/cert.pem', data)], {}
+        raise NotFound(path)
+
+    for sample in ['a', 'b']:
+        (tmp_path / sample).mkdir()
+        monkeypatch.chdir(tmp_path / sample)
+        container = mock_container()
+        container.get_archive.side_effect = get_archive
+        container.diff.return_value = [{'Path': '/home/appuser/cert.pem', 'Kind': 1}]
+        out_files = TarTool(logging.getLogger(), container, {}, output_store=store,
+                            output_links=sample == 'a').download_files()
+        assert [f.digest for f in out_files] == [digest]
+
+    # stored once, hard linked only when enabled
+    assert list(store.digests()) == [digest]
+    assert (tmp_path / 'a' / 'cert.pem').read_bytes() == data
+    assert (tmp_path / 'b' / 'cert.pem').read_bytes() == data
+    assert os.path.samefile(tmp_path / 'a' / 'cert.pem', store.path_for(digest))
+    assert store.path_for(digest).stat().st_nlink == 2
+    assert (tmp_path / 'b' / 'cert.pem').stat().st_nlink == 1  # plain download without link or reflink
+    assert [p.name for p in (tmp_path / 'b').iterdir()] == ['cert.pem']
+
+
+def test_download_streamed_into_output_tar(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = os.urandom(30000)
+    down_data = io.BytesIO()
+    with tarfile.open(fileobj=down_data, mode='w') as tar:
+        info = tarfile.TarInfo('appuser/results')
+        info.type = tarfile.DIRTYPE
+        tar.addfile(info)
+        info = tarfile.TarInfo('appuser/results/data.bin')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    down_data = down_data.getvalue()
+
+    def get_archive(path):
+        if path == '/home/appuser/':
+            # small chunks, as from the HTTP response
+            return (down_data[i:i + 1000] for i in range(0, len(down_data), 1000)), {'mode': 1 << 31}
+        raise NotFound(path)
+
+    container = mock_container()
+    container.get_archive.side_effect = get_archive
+    container.diff.return_value = [{'Path': '/home/appuser/results', 'Kind': 1},
+                                   {'Path': '/home/appuser/results/data.bin', 'Kind': 1}]
+    out_files = TarTool(logging.getLogger(), container, {}, explicit_file='out.tar').download_files()
+    assert [(f.path.name, f.digest) for f in out_files] == [('data.bin', hashlib.sha256(data).hexdigest())]
+    with tarfile.open('out.tar') as tar:
+        assert tar.extractfile('results/data.bin').read() == data
+    assert not pathlib.Path('results').exists()
+
+
+def test_upload_archive_in_single_pass(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = os.urandom(300_000)
+    in_data = io.BytesIO()
+    with tarfile.open(fileobj=in_data, mode='w') as tar:
+        info = tarfile.TarInfo('samples')
+        info.type = tarfile.DIRTYPE
+        tar.addfile(info)
+        info = tarfile.TarInfo('samples/data.bin')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    in_data = in_data.getvalue()
+    pathlib.Path('in.tar').write_bytes(in_data)
+
+    for explicit_file in ['in.tar', '-']:
+        if explicit_file == '-':
+            monkeypatch.setattr('sys.stdin', io.TextIOWrapper(io.BufferedReader(io.BytesIO(in_data))))
+        container = mock_container()
+        upload_stats, in_files = {}, []
+        TarTool(logging.getLogger(), container, upload_stats, explicit_file=explicit_file).upload({}, in_files)
+        assert container.uploaded.getvalue() == in_data
+        assert [(f.path.name, f.digest) for f in in_files] == [('data.bin', hashlib.sha256(data).hexdigest())]
+        assert sorted(upload_stats) == ['samples', 'samples/data.bin']
+
+
+def test_compressed_archives(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = b'captured traffic\n' * 10000
+    with tarfile.open('in.tar.xz', mode='w:xz') as tar:
+        info = tarfile.TarInfo('sample.pcap')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+    container = mock_container()
+    in_files = []
+    TarTool(logging.getLogger(), container, {}, explicit_file='in.tar.xz').upload({}, in_files)
+    assert container.uploaded.getvalue() == pathlib.Path('in.tar.xz').read_bytes()  # decompressed by the engine
+    assert [f.digest for f in in_files] == [hashlib.sha256(data).hexdigest()]
+
+    def get_archive(path):
+        if path == '/home/appuser/':
+            return [archive_of('appuser/sample.pcap', data)], {}
+        raise NotFound(path)
+
+    container.get_archive.side_effect = get_archive
+    container.diff.return_value = [{'Path': '/home/appuser/sample.pcap', 'Kind': 1}]
+    out_files = TarTool(logging.getLogger(), container, {}, explicit_file='out.tar.gz').download_files()
+    assert [f.digest for f in out_files] == [hashlib.sha256(data).hexdigest()]
+    with tarfile.open('out.tar.gz', mode='r:gz') as tar:
+        assert tar.extractfile('sample.pcap').read() == data
+
+
+@pytest.mark.parametrize('name', ['out.tar.gz', 'out.tar.bz2'])
+def test_multi_block_output_back_as_input(tmp_path, monkeypatch, name):
+    monkeypatch.chdir(tmp_path)
+    data = b''.join(b'%08d captured traffic\n' % i for i in range(200000))  # several compressed blocks
+    container = mock_container()
+
+    def get_archive(path):
+        if path == '/home/appuser/':
+            return [archive_of('appuser/sample.pcap', data)], {}
+        raise NotFound(path)
+
+    container.get_archive.side_effect = get_archive
+    container.diff.return_value = [{'Path': '/home/appuser/sample.pcap', 'Kind': 1}]
+    TarTool(logging.getLogger(), container, {}, explicit_file=name).download_files()
+
+    # concatenated streams of the blocks, which tarfile stream modes do not read
+    in_files = []
+    TarTool(logging.getLogger(), mock_container(), {}, explicit_file=name).upload({}, in_files)
+    assert [f.digest for f in in_files] == [hashlib.sha256(data).hexdigest()]
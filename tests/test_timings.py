@@ -0,0 +1,65 @@
+from unittest import mock
+
+import pytest
+
+from cincan.command_log import CommandLog
+from cincan.frontend import ToolImage
+from cincan.timings import Timings
+
+
+def test_phases():
+    timings = Timings()
+    with mock.patch('time.monotonic', side_effect=[1.0, 1.5, 2.0, 2.25, 3.0, 4.0]):
+        with timings.phase('upload'):
+            pass
+        with timings.phase('upload'):
+            pass
+        with timings.phase('exec'):
+            pass
+    timings.add_bytes('upload', 1000)
+    timings.add_bytes('upload', 24)
+    assert timings.seconds == {'upload': 0.75, 'exec': 1.0}
+    assert timings.bytes == {'upload': 1024}
+    assert timings.total() == 1.75
+    assert timings.summary().splitlines() == [
+        'phase               seconds          bytes',
+        'upload               0.7500           1024',
+        'exec                 1.0000               ',
+        'total                1.7500               ',
+    ]
+
+
+def test_timings_in_command_log():
+    log = CommandLog(['test'])
+    assert 'timings' not in log.to_json()
+    log.timings = Timings()
+    log.timings.seconds['create'] = 0.5
+    log.timings.add_bytes('download', 10)
+    js = log.to_json()
+    assert js['timings'] == {'seconds': {'create': 0.5}, 'bytes': {'download': 10}}
+    assert CommandLog.from_json(js).timings.to_json() == js['timings']
+
+
+def test_cpu_seconds():
+    timings = Timings()
+    timings.seconds['upload'] = 0.5
+    timings.add_bytes('upload', 1024)
+    timings.add_bytes('upload_saved', 4096)
+    timings.add_cpu('upload', 1.25)
+    assert timings.to_json()['cpu_seconds'] == {'upload': 1.25}
+    assert timings.total() == 0.5
+    assert timings.summary().splitlines() == [
+        'phase               seconds          bytes  cpu seconds',
+        'upload               0.5000           1024       1.2500',
+        'upload_saved         0.0000           4096             ',
+        'total                0.5000                            ',
+    ]
+
+
+def test_timings_reset_when_run_fails(mock_tool, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mock_tool.image.attrs = {'Config': {'Entrypoint': ['tool'], 'Cmd': None}}
+    with mock.patch.object(ToolImage, '_ToolImage__create_container', side_effect=OSError('no space')):
+        with pytest.raises(OSError):
+            mock_tool.run(['input.txt'])
+    assert mock_tool.timings.seconds == {}